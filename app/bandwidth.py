@@ -0,0 +1,397 @@
+"""
+Bandwidth shaping.
+
+Every running download is registered with the shaper and charged for the
+bytes it moves. Four levels of token buckets apply: per task, per client
+connection, per upstream host and global. Rates are in bytes/s, None means
+unlimited.
+
+The global / host / client capacity is split between the active jobs by
+weighted max-min fairness (water-filling), recomputed a few times a second:
+a job that cannot use its share (slow CDN, tiny file) is capped near what it
+actually moves and the rest goes to the jobs that are being held back, so
+the total stays high. Audio jobs get a larger weight by default, so a small
+download is never stuck behind a big video on the same link.
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from urllib.parse import urlparse
+
+from . import config
+from .postprocess import is_audio_profile
+
+_UNITS = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+# Smallest rate handed out, so a saturated group never stalls a job completely
+MIN_RATE = 16 * 1024
+# Demand assumed for a job that is not being held back: twice what it moved
+DEMAND_HEADROOM = 2.0
+
+
+def parse_rate(value):
+    """'10M' / '512k' / 1048576 -> bytes/s. 0, '' and None mean unlimited (None)."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value) or None
+    text = str(value).strip().lower().removesuffix("/s").removesuffix("b")
+    if not text or text in ("0", "off", "none", "unlimited"):
+        return None
+    unit = _UNITS.get(text[-1])
+    try:
+        rate = int(float(text[:-1]) * unit) if unit else int(float(text))
+    except ValueError:
+        raise ValueError(f"Bad rate: {value!r} (use bytes/s, or K/M/G)")
+    if rate < 0:
+        raise ValueError(f"Bad rate: {value!r}")
+    return rate or None
+
+
+class TokenBucket:
+    """
+    Bytes/s bucket that may go into debt: reserve(n) takes n tokens at once
+    and returns how long the caller has to wait before using them.
+    Not thread-safe on its own (the Shaper's lock guards it).
+    """
+
+    def __init__(self, rate=None, burst_seconds=0.25):
+        self.burst_seconds = burst_seconds
+        self.rate = None
+        self.tokens = 0.0
+        self._last = None
+        self.set_rate(rate)
+
+    @property
+    def burst(self):
+        return max(64 * 1024, self.rate * self.burst_seconds)
+
+    def set_rate(self, rate):
+        if rate == self.rate:
+            return
+        if self.rate and self._last is not None:
+            self._refill(time.monotonic())
+        self.rate = rate
+        if rate:
+            self.tokens = min(self.tokens, self.burst) if self._last is not None else self.burst
+
+    def _refill(self, now):
+        if self._last is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self, nbytes, now):
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        self.tokens -= nbytes
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class _Task:
+    __slots__ = ("task_id", "client", "host", "weight", "limit", "bucket", "active", "fresh", "throttled",
+                 "last_io", "bytes", "observed", "demand", "progress_file", "progress_bytes")
+
+    def __init__(self, task_id, client, weight):
+        self.task_id = task_id
+        self.client = client
+        self.host = None
+        self.weight = weight
+        # Per-task override set through the API (None = the per_task default)
+        self.limit = None
+        self.bucket = TokenBucket()
+        self.active = False
+        self.fresh = False
+        self.throttled = False
+        self.last_io = 0.0
+        self.bytes = 0
+        self.observed = 0.0
+        self.demand = float("inf")
+        # Last yt-dlp progress seen (threaded path)
+        self.progress_file = None
+        self.progress_bytes = 0
+
+
+class Shaper:
+    """
+    Token buckets per task, client, host and globally, with the group
+    capacity shared by weight between the jobs that are moving bytes.
+    Callers charge bytes after receiving them and sleep for the returned delay.
+    """
+
+    def __init__(self, global_rate=None, per_host=None, per_client=None, per_task=None, interval=0.5):
+        self.limits = {"global": global_rate, "per_host": per_host, "per_client": per_client,
+                       "per_task": per_task}
+        # Overrides set through the API: host / client -> rate (None = unlimited)
+        self.hosts = {}
+        self.clients = {}
+        self.interval = interval
+        self._tasks = {}
+        self._global = TokenBucket(global_rate, burst_seconds=1.0)
+        self._host_buckets = {}
+        self._client_buckets = {}
+        self._lock = threading.Lock()
+        self._last_sample = time.monotonic()
+        self._dirty = True
+
+    @property
+    def limited(self):
+        """True when any limit is set (otherwise reserve() never makes anyone wait)."""
+        return any(self.limits.values()) or any(self.hosts.values()) or any(self.clients.values()) \
+            or any(t.limit for t in list(self._tasks.values()))
+
+    # --- jobs ---
+
+    def register(self, task_id, client=None, weight=1.0):
+        with self._lock:
+            self._tasks[task_id] = _Task(task_id, client, max(0.01, float(weight or 1.0)))
+
+    def unregister(self, task_id):
+        with self._lock:
+            if self._tasks.pop(task_id, None) is not None:
+                self._dirty = True
+
+    def reserve(self, task_id, nbytes, host=None):
+        """Charges nbytes to a task. Returns the seconds it must wait (0 for unknown tasks)."""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return 0.0
+            now = time.monotonic()
+            if host and host != task.host:
+                task.host = host
+                self._dirty = True
+            if not task.active:
+                # Woke up: gets a share right away instead of at the next rebalance
+                task.active = task.fresh = True
+                self._dirty = True
+            task.bytes += nbytes
+            task.last_io = now
+            if self._dirty or now - self._last_sample >= self.interval:
+                self._rebalance(now)
+
+            delay = task.bucket.reserve(nbytes, now)
+            delay = max(delay, self._global.reserve(nbytes, now))
+            for table, key, cap in ((self._host_buckets, task.host, self._host_cap(task.host)),
+                                    (self._client_buckets, task.client, self._client_cap(task.client))):
+                bucket = _group_bucket(table, key, cap)
+                if bucket is not None:
+                    delay = max(delay, bucket.reserve(nbytes, now))
+            if delay > 0:
+                task.throttled = True
+            return delay
+
+    async def throttle(self, task_id, nbytes, host=None):
+        delay = self.reserve(task_id, nbytes, host)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def throttle_sync(self, task_id, nbytes, host=None):
+        delay = self.reserve(task_id, nbytes, host)
+        if delay > 0:
+            time.sleep(delay)
+
+    def throttle_progress(self, task_id, d):
+        """yt-dlp progress hook: charges the bytes since the last call and sleeps on the download thread."""
+        if d.get('status') != 'downloading':
+            return
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return
+            downloaded = d.get('downloaded_bytes') or 0
+            if d.get('filename') != task.progress_file or downloaded < task.progress_bytes:
+                task.progress_file = d.get('filename')
+                task.progress_bytes = 0
+            delta = downloaded - task.progress_bytes
+            task.progress_bytes = downloaded
+        if delta > 0:
+            self.throttle_sync(task_id, delta, host_of((d.get('info_dict') or {}).get('url')))
+
+    # --- runtime settings ---
+
+    def configure(self, settings):
+        """
+        Applies {"global", "per_host", "per_client", "per_task": rate,
+        "hosts" / "clients": {name: rate}, "tasks": {task_id: {"rate", "weight"}}}.
+        A rate of null/0 removes the limit. Raises ValueError, also for a task
+        that is not running (nothing is applied then).
+        """
+        limits = {k: parse_rate(settings[k]) for k in self.limits if k in settings}
+        hosts = {h: parse_rate(r) for h, r in (settings.get("hosts") or {}).items()}
+        clients = {c: parse_rate(r) for c, r in (settings.get("clients") or {}).items()}
+        tasks = {}
+        for task_id, fields in (settings.get("tasks") or {}).items():
+            tasks[task_id] = {"rate": parse_rate(fields["rate"]) if "rate" in fields else False,
+                              "weight": float(fields["weight"]) if fields.get("weight") else None}
+        with self._lock:
+            unknown = [task_id for task_id in tasks if task_id not in self._tasks]
+            if unknown:
+                raise ValueError(f"Not running: {', '.join(map(str, unknown))}")
+            self.limits.update(limits)
+            self._global.set_rate(self.limits["global"])
+            for table, changes in ((self.hosts, hosts), (self.clients, clients)):
+                for name, rate in changes.items():
+                    table[name] = rate
+            for task_id, fields in tasks.items():
+                task = self._tasks[task_id]
+                if fields["rate"] is not False:
+                    task.limit = fields["rate"]
+                if fields["weight"]:
+                    task.weight = max(0.01, fields["weight"])
+            self._dirty = True
+        return self.stats()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "limits": dict(self.limits),
+                "hosts": dict(self.hosts),
+                "clients": dict(self.clients),
+                "tasks": {
+                    t.task_id: {
+                        "client": t.client, "host": t.host, "weight": t.weight, "limit": t.limit,
+                        "rate": t.bucket.rate, "throughput": round(t.observed), "active": t.active,
+                    }
+                    for t in self._tasks.values()
+                },
+            }
+
+    # --- allocation ---
+
+    def _host_cap(self, host):
+        return self.hosts[host] if host in self.hosts else self.limits["per_host"]
+
+    def _client_cap(self, client):
+        return self.clients[client] if client in self.clients else self.limits["per_client"]
+
+    def _rebalance(self, now):
+        if now - self._last_sample >= self.interval:
+            self._sample(now)
+        self._dirty = False
+        self._allocate([t for t in self._tasks.values() if t.active])
+        # Drop group buckets nobody uses any more
+        hosts = {t.host for t in self._tasks.values()}
+        clients = {t.client for t in self._tasks.values()}
+        for table, used in ((self._host_buckets, hosts), (self._client_buckets, clients)):
+            for key in [k for k in table if k not in used]:
+                del table[key]
+
+    def _sample(self, now):
+        """Measures what every active job moved since the last sample and derives its demand."""
+        elapsed = max(now - self._last_sample, 1e-3)
+        self._last_sample = now
+        for task in self._tasks.values():
+            if not task.active:
+                continue
+            task.observed = task.bytes / elapsed
+            if task.fresh or task.throttled:
+                task.demand = float("inf")
+            else:
+                task.demand = max(task.observed * DEMAND_HEADROOM, MIN_RATE)
+            task.bytes = 0
+            task.fresh = task.throttled = False
+            if now - task.last_io > 2 * self.interval:
+                # Not moving bytes (waiting on a merge, following another job, ...): out of the split
+                task.active = False
+                task.bucket.set_rate(None)
+
+    def _allocate(self, tasks):
+        """Weighted max-min fair rates for `tasks` under the global, host, client and task limits."""
+        groups = {}  # key -> [remaining capacity, weight of unfrozen members, members]
+        paths = {}
+        caps = {}
+        for task in tasks:
+            path = []
+            for key, cap in ((("global",), self.limits["global"]),
+                             (("host", task.host), self._host_cap(task.host)),
+                             (("client", task.client), self._client_cap(task.client))):
+                if cap:
+                    group = groups.setdefault(key, [float(cap), 0.0, []])
+                    group[1] += task.weight
+                    group[2].append(task)
+                    path.append(key)
+            limit = task.limit if task.limit is not None else self.limits["per_task"]
+            if not path and not limit:
+                task.bucket.set_rate(None)
+                continue
+            paths[task] = path
+            caps[task] = min(limit or float("inf"), task.demand)
+
+        # Progressive filling: raise every job's rate with its weight until a
+        # job reaches its own cap or a group runs out, freeze those, repeat
+        seq = itertools.count()
+        latest = {}
+        heap = []
+
+        def push(key):
+            remaining, weight, _ = groups[key]
+            if weight <= 1e-9:
+                latest.pop(key, None)
+                return
+            latest[key] = next(seq)
+            heapq.heappush(heap, (max(remaining, 0.0) / weight, latest[key], key))
+
+        for key in groups:
+            push(key)
+        order = sorted(paths, key=lambda t: caps[t] / t.weight)
+        frozen = set()
+        i = 0
+        while len(frozen) < len(paths):
+            while order[i] in frozen:
+                i += 1
+            task = order[i]
+            while heap and latest.get(heap[0][2]) != heap[0][1]:
+                heapq.heappop(heap)
+            if heap and heap[0][0] < caps[task] / task.weight:
+                level, _, key = heapq.heappop(heap)
+                latest.pop(key, None)
+                members = [m for m in groups[key][2] if m not in frozen]
+                rates = [(m, m.weight * level) for m in members]
+            else:
+                rates = [(task, caps[task])]
+            touched = set()
+            for member, rate in rates:
+                member.bucket.set_rate(max(int(rate), MIN_RATE))
+                frozen.add(member)
+                for key in paths[member]:
+                    groups[key][0] -= rate
+                    groups[key][1] -= member.weight
+                    touched.add(key)
+            for key in touched:
+                if key in latest:
+                    push(key)
+
+
+def _group_bucket(table, key, cap):
+    if not cap:
+        table.pop(key, None)
+        return None
+    bucket = table.get(key)
+    if bucket is None:
+        bucket = table[key] = TokenBucket(cap, burst_seconds=1.0)
+    else:
+        bucket.set_rate(cap)
+    return bucket
+
+
+def host_of(url):
+    try:
+        return urlparse(url).hostname if url else None
+    except ValueError:
+        return None
+
+
+def default_weight(format_id, profile=None):
+    """Audio jobs are small: weighted up so they finish quickly next to big videos."""
+    audio = format_id == "best_audio" or str(format_id).startswith("audio:") or is_audio_profile(profile)
+    return config.BANDWIDTH_AUDIO_WEIGHT if audio else 1.0
+
+
+shaper = Shaper(
+    parse_rate(config.BANDWIDTH_GLOBAL),
+    parse_rate(config.BANDWIDTH_PER_HOST),
+    parse_rate(config.BANDWIDTH_PER_CLIENT),
+    parse_rate(config.BANDWIDTH_PER_TASK),
+)
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import uuid
+
+from . import config
+from .downloader import status_bus, ydl_pool
+from .events import FINAL_STATES
+
+_DONE = object()
+
+
+def iter_entries(url: str):
+    """
+    Lazily enumerates a playlist/channel with flat extraction.
+    Pages are only fetched as the generator is consumed, so the first items
+    are available long before a large playlist is fully resolved.
+    A plain video URL yields a single entry.
+    """
+    with ydl_pool.acquire('flat') as ydl:
+        result = ydl.extract_info(url, download=False, process=False)
+        if result.get('_type') not in ('playlist', 'multi_video'):
+            yield {"url": result.get('webpage_url') or url, "id": result.get('id'), "title": result.get('title')}
+            return
+        for entry in result.get('entries') or []:
+            if not entry:
+                continue
+            yield {
+                "url": entry.get('url') or entry.get('webpage_url'),
+                "id": entry.get('id'),
+                "title": entry.get('title'),
+                "duration": entry.get('duration'),
+                "thumbnail": (entry.get('thumbnails') or [{}])[-1].get('url'),
+            }
+
+
+def iter_batch(source):
+    """Accepts a playlist/channel URL or a list of URLs (which may be playlists too)."""
+    urls = [source] if isinstance(source, str) else list(source)
+    for url in urls:
+        if url:
+            yield from iter_entries(url)
+
+
+async def run_batch(scheduler, source, emit, format_id="best", download_path="Default",
+                    priority="low", fan_out=None, profile=None, client=None, cancel_on_exit=False,
+                    on_submit=None):
+    """
+    Feeds every entry of `source` into the scheduler and streams results.
+    1. Entries are enumerated on a thread of the batch's own and handed over
+       one by one. Not on a pool thread: it blocks on the hand-off while the
+       downloads it waits for need the pools.
+    2. At most `fan_out` items of this batch are queued/running at once.
+    3. emit() gets each item's metadata as soon as it is known, then its
+       progress deltas (tagged with task_id), then a final 'batch_done'.
+    4. With `cancel_on_exit`, items still unfinished when the batch is
+       cancelled (client gone) are cancelled too, after the grace period
+       of scheduler.release(). `on_submit` gets each new task id.
+    """
+    loop = asyncio.get_running_loop()
+    batch_id = str(uuid.uuid4())
+    fan_out = max(1, fan_out or config.BATCH_FAN_OUT)
+    # Bounded hand-off: the enumerator stalls instead of racing ahead of the downloads
+    entries = asyncio.Queue(maxsize=fan_out)
+    slots = asyncio.Semaphore(fan_out)
+    stop = threading.Event()
+
+    def enumerate_entries():
+        try:
+            for entry in iter_batch(source):
+                if stop.is_set():
+                    break
+                asyncio.run_coroutine_threadsafe(entries.put(entry), loop).result()
+        except Exception as e:
+            asyncio.run_coroutine_threadsafe(entries.put(e), loop).result()
+        finally:
+            asyncio.run_coroutine_threadsafe(entries.put(_DONE), loop).result()
+
+    async def follow(task_id):
+        sub = status_bus.subscribe(task_id)
+        final = None
+        try:
+            async for delta in sub:
+                await emit({"batch_id": batch_id, "task_id": task_id, **delta})
+                if delta.get("state") in FINAL_STATES:
+                    final = delta["state"]
+        finally:
+            sub.close()
+            slots.release()
+        return final
+
+    producer = threading.Thread(target=enumerate_entries, name=f"batch-{batch_id[:8]}", daemon=True)
+    producer.start()
+    followers = []
+    submitted = []
+    index = 0
+    error = None
+
+    try:
+        await emit({"batch_id": batch_id, "state": "batch_started"})
+        while True:
+            entry = await entries.get()
+            if entry is _DONE:
+                break
+            if isinstance(entry, Exception):
+                error = str(entry)
+                continue
+            if not entry.get("url"):
+                continue
+            await slots.acquire()
+            index += 1
+            task_id = str(uuid.uuid4())
+            await emit({"batch_id": batch_id, "task_id": task_id, "index": index, "item": entry})
+            followers.append(asyncio.create_task(follow(task_id)))
+            scheduler.submit(task_id, entry["url"], format_id, download_path, priority, profile=profile, client=client)
+            submitted.append(task_id)
+            if on_submit is not None:
+                on_submit(task_id)
+        results = await asyncio.gather(*followers, return_exceptions=True)
+    except BaseException:
+        # Client went away: stop enumerating (queued items still download unless cancel_on_exit)
+        stop.set()
+        for f in followers:
+            f.cancel()
+        if cancel_on_exit:
+            scheduler.release(submitted)
+        while producer.is_alive():
+            try:
+                await asyncio.wait_for(entries.get(), 0.5)
+            except asyncio.TimeoutError:
+                pass
+        raise
+
+    done = {
+        "batch_id": batch_id,
+        "state": "batch_done",
+        "total": index,
+        "completed": sum(1 for r in results if r == "completed"),
+        "cancelled": sum(1 for r in results if r == "cancelled"),
+        "failed": sum(1 for r in results if r not in ("completed", "cancelled")),
+    }
+    if error:
+        done["message"] = error
+    await emit(done)
+    return done
@@ -0,0 +1,99 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+# youtu.be/ID, /shorts/ID, /embed/ID, /live/ID, /v/ID
+_YT_PATH_ID = re.compile(r'^/(?:shorts/|embed/|live/|v/)?([0-9A-Za-z_-]{11})(?:[/?]|$)')
+_YT_HOSTS = ("youtube.com", "youtu.be", "youtube-nocookie.com")
+
+
+def video_key(url: str):
+    """
+    Normalizes a URL into a cache key.
+    All YouTube URL flavours of the same video (watch?v=, youtu.be, shorts,
+    embed, extra params like &t=30) collapse to 'youtube:<id>'.
+    Other sites fall back to the URL without its fragment.
+    """
+    url = (url or "").strip()
+    try:
+        parsed = urlparse(url if "://" in url else f"https://{url}")
+    except ValueError:
+        return url
+
+    host = (parsed.hostname or "").lower()
+    if any(host == h or host.endswith("." + h) for h in _YT_HOSTS):
+        video_id = parse_qs(parsed.query).get("v", [None])[0]
+        if not video_id:
+            m = _YT_PATH_ID.match(parsed.path)
+            video_id = m.group(1) if m else None
+        if video_id:
+            return f"youtube:{video_id}"
+
+    return url.split("#", 1)[0]
+
+
+class TTLCache:
+    """
+    Small thread-safe cache with per-entry expiry and an LRU size bound.
+    Used for yt-dlp metadata, whose format URLs go stale after a while.
+    """
+
+    def __init__(self, maxsize=256, ttl=1800):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+        }
@@ -0,0 +1,226 @@
+"""
+Compact, column-oriented table of a video's formats.
+
+Built once per extraction and cached next to the info dict, it answers
+"best <=1080p AVC under 50 MB" or "best opus" with a walk over a
+pre-sorted index instead of re-scanning and re-formatting info['formats'].
+It also holds the format lists fetch_formats sends to the UI.
+"""
+import re
+from array import array
+
+VIDEO, AUDIO = "video", "audio"
+
+_VCODECS = (("avc", "avc"), ("h264", "avc"), ("hev", "hevc"), ("hvc", "hevc"), ("h265", "hevc"),
+            ("vp09", "vp9"), ("vp9", "vp9"), ("vp8", "vp8"), ("av01", "av1"), ("av1", "av1"))
+_ACODECS = (("mp4a", "aac"), ("aac", "aac"), ("opus", "opus"), ("vorbis", "vorbis"),
+            ("mp3", "mp3"), ("flac", "flac"), ("ac-3", "ac3"), ("ec-3", "eac3"))
+
+_QUERY_TERM = re.compile(r'^\s*(\w+)\s*(<=|>=|=)\s*([\w.]+)\s*$')
+_SIZE_UNITS = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+
+def codec_family(codec, table):
+    """'avc1.64001F' -> 'avc', 'mp4a.40.2' -> 'aac'. 'none' stays 'none'."""
+    if not codec or codec == 'none':
+        return codec or ''
+    codec = codec.lower()
+    for prefix, family in table:
+        if codec.startswith(prefix):
+            return family
+    return codec.split('.')[0]
+
+
+def audio_codec(codec):
+    return codec_family(codec, _ACODECS)
+
+
+def is_query(format_id):
+    return isinstance(format_id, str) and format_id.split(":", 1)[0] in (VIDEO, AUDIO) and ":" in format_id
+
+
+def parse_query(text):
+    """
+    'video:height<=1080,vcodec=avc,size<=50M' -> {'kind': 'video', 'max_height': 1080, ...}
+    Terms: height (<=, >=, =), ext, vcodec, acodec, size (<=, with K/M/G), abr (>=).
+    """
+    kind, _, terms = text.partition(":")
+    query = {"kind": kind}
+    for term in filter(None, terms.split(",")):
+        m = _QUERY_TERM.match(term)
+        if not m:
+            raise ValueError(f"Bad format query term: {term!r}")
+        name, op, value = m.groups()
+        if name == "height":
+            key = {"<=": "max_height", ">=": "min_height", "=": "height"}[op]
+            query[key] = int(value)
+        elif name == "size" and op == "<=":
+            unit = _SIZE_UNITS.get(value[-1].lower())
+            query["max_bytes"] = int(float(value[:-1]) * unit) if unit else int(value)
+        elif name == "abr" and op == ">=":
+            query["min_abr"] = float(value)
+        elif name in ("ext", "vcodec", "acodec") and op == "=":
+            query[name] = value.lower()
+        else:
+            raise ValueError(f"Unsupported format query term: {term!r}")
+    return query
+
+
+def is_audio_only(info, format_id):
+    for f in (info or {}).get('formats') or ():
+        if f.get('format_id') == format_id:
+            return f.get('vcodec') == 'none' and f.get('acodec') != 'none'
+    return False
+
+
+def has_audio(info, format_id):
+    """Whether a format carries audio: True/False, or None when info doesn't tell."""
+    for f in (info or {}).get('formats') or ():
+        if f.get('format_id') == format_id:
+            acodec = f.get('acodec')
+            return None if acodec is None else acodec != 'none'
+    return None
+
+
+class FormatCatalog:
+    """
+    One row per format, stored column-wise (arrays for numbers, tuples for
+    strings). Indexes hold row numbers, best first.
+    """
+
+    __slots__ = ("format_ids", "exts", "vcodecs", "acodecs", "notes", "heights", "sizes",
+                 "abrs", "tbrs", "kinds", "by_kind", "by_vcodec", "by_acodec", "by_height_ext",
+                 "_raw_sizes", "_ui")
+
+    def __init__(self, formats, duration=None):
+        rows = [f for f in formats or () if f.get('format_id')]
+        self.format_ids = tuple(f['format_id'] for f in rows)
+        self.exts = tuple(f.get('ext') or '' for f in rows)
+        self.vcodecs = tuple(codec_family(f.get('vcodec'), _VCODECS) for f in rows)
+        self.acodecs = tuple(codec_family(f.get('acodec'), _ACODECS) for f in rows)
+        self.notes = tuple(f.get('format_note') or '' for f in rows)
+        self.heights = array('i', (f.get('height') or 0 for f in rows))
+        self.abrs = array('d', (f.get('abr') or 0 for f in rows))
+        self.tbrs = array('d', (f.get('tbr') or 0 for f in rows))
+        # Reported size, else estimated from the bitrate (0 = unknown)
+        self.sizes = array('q', (
+            int(f.get('filesize') or f.get('filesize_approx')
+                or ((f.get('tbr') or 0) * 125 * (duration or 0)))
+            for f in rows))
+        # As reported, for the UI (no estimate)
+        self._raw_sizes = tuple(f.get('filesize') or f.get('filesize_approx') for f in rows)
+        self.kinds = tuple(
+            AUDIO if f.get('vcodec') == 'none' and f.get('acodec') != 'none'
+            else VIDEO if f.get('vcodec') != 'none' else ''
+            for f in rows)
+
+        n = range(len(rows))
+        videos = sorted((i for i in n if self.kinds[i] == VIDEO),
+                        key=lambda i: (self.heights[i], self.tbrs[i], self.sizes[i]), reverse=True)
+        audios = sorted((i for i in n if self.kinds[i] == AUDIO),
+                        key=lambda i: (self.abrs[i] or self.tbrs[i], self.sizes[i]), reverse=True)
+        self.by_kind = {VIDEO: videos, AUDIO: audios}
+        self.by_vcodec = {}
+        for i in videos:
+            self.by_vcodec.setdefault(self.vcodecs[i], []).append(i)
+        self.by_acodec = {}
+        for i in audios:
+            self.by_acodec.setdefault(self.acodecs[i], []).append(i)
+        # Largest format per (height, ext), the UI shows one card each
+        self.by_height_ext = {}
+        for i in n:
+            if self.kinds[i] != VIDEO or self.heights[i] < 144:
+                continue
+            key = (self.heights[i], self.exts[i])
+            prev = self.by_height_ext.get(key)
+            if prev is None or self._ui_size(i) > self._ui_size(prev):
+                self.by_height_ext[key] = i
+        self._ui = None
+
+    @classmethod
+    def from_info(cls, info):
+        return cls(info.get('formats'), info.get('duration'))
+
+    def __len__(self):
+        return len(self.format_ids)
+
+    def _ui_size(self, i):
+        return self._raw_sizes[i] or 0
+
+    def query(self, kind=VIDEO, height=None, max_height=None, min_height=None, ext=None,
+              vcodec=None, acodec=None, max_bytes=None, min_abr=None, limit=None):
+        """Row numbers matching every given filter, best first."""
+        if kind == VIDEO and vcodec:
+            candidates = self.by_vcodec.get(vcodec, ())
+        elif kind == AUDIO and acodec:
+            candidates = self.by_acodec.get(acodec, ())
+        else:
+            candidates = self.by_kind.get(kind, ())
+        found = []
+        for i in candidates:
+            h = self.heights[i]
+            if (height is not None and h != height) or (max_height is not None and h > max_height) \
+                    or (min_height is not None and h < min_height):
+                continue
+            if ext and self.exts[i] != ext:
+                continue
+            if acodec and self.acodecs[i] != acodec:
+                continue
+            if max_bytes is not None and not 0 < self.sizes[i] <= max_bytes:
+                continue
+            if min_abr is not None and self.abrs[i] < min_abr:
+                continue
+            found.append(i)
+            if limit and len(found) >= limit:
+                break
+        return found
+
+    def best(self, **query):
+        """format_id of the best match, or None."""
+        rows = self.query(limit=1, **query)
+        return self.format_ids[rows[0]] if rows else None
+
+    def row(self, i):
+        return {
+            "format_id": self.format_ids[i],
+            "kind": self.kinds[i],
+            "ext": self.exts[i],
+            "height": self.heights[i],
+            "vcodec": self.vcodecs[i],
+            "acodec": self.acodecs[i],
+            "abr": self.abrs[i],
+            "tbr": self.tbrs[i],
+            "filesize": self.sizes[i] or None,
+        }
+
+    def ui_lists(self):
+        """The (video, audio) card lists fetch_formats returns. Built once, do not mutate."""
+        if self._ui is None:
+            audio = []
+            for i in sorted((i for i in range(len(self)) if self.kinds[i] == AUDIO),
+                            key=self._ui_size, reverse=True):
+                audio.append({
+                    'format_id': self.format_ids[i],
+                    'ext': self.exts[i],
+                    'quality': self.abrs[i] or 0,
+                    'note': f"{self.abrs[i]:.0f}kbps",
+                    'size': _size_str(self._raw_sizes[i]),
+                    'filesize_bytes': self._ui_size(i),
+                })
+            video = []
+            for (height, ext), i in sorted(self.by_height_ext.items(), key=lambda kv: kv[0][0], reverse=True):
+                video.append({
+                    'format_id': self.format_ids[i],
+                    'ext': ext,
+                    'quality': f"{height}p",
+                    'height': height,
+                    'note': self.notes[i],
+                    'size': _size_str(self._raw_sizes[i]),
+                    'filesize_bytes': self._ui_size(i),
+                })
+            self._ui = (video, audio)
+        return self._ui
+
+
+def _size_str(filesize):
+    return f"{filesize / 1024 / 1024:.1f} MB" if filesize else "N/A"
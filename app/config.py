@@ -0,0 +1,169 @@
+"""
+Runtime settings for the server.
+Every value can be overridden with an INFINITY_* environment variable,
+so deployments can tune limits without touching the code.
+"""
+import os
+import sys
+from pathlib import Path
+
+
+def _int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        from . import log
+        log.warning(f"{name} is not a number, using {default}")
+        return default
+
+
+def _str(name, default):
+    return os.environ.get(name, default)
+
+
+def _data_home():
+    """Per-user folder for application data (not the user's documents)."""
+    if os.name == "nt":
+        return os.path.join(os.environ.get("LOCALAPPDATA") or os.path.join(Path.home(), "AppData", "Local"),
+                            "InfinityLoader")
+    if sys.platform == "darwin":
+        return os.path.join(Path.home(), "Library", "Application Support", "InfinityLoader")
+    return os.path.join(os.environ.get("XDG_DATA_HOME") or os.path.join(Path.home(), ".local", "share"),
+                        "infinityloader")
+
+
+# --- Logging ---
+# (first, so warnings about the settings below already follow them)
+# Lowest level printed: debug, info, warning or error
+LOG_LEVEL = _str("INFINITY_LOG_LEVEL", "debug")
+# "text" for readable lines, "json" for one JSON object per line (log shippers)
+LOG_FORMAT = _str("INFINITY_LOG_FORMAT", "text")
+
+# Where downloads go when the user did not pick a folder
+DEFAULT_DOWNLOAD_FOLDER = _str(
+    "INFINITY_DOWNLOAD_FOLDER", os.path.join(Path.home(), "Downloads", "Youtube Download")
+)
+# Where the server keeps its own files (job journal, media store)
+DATA_DIR = _str("INFINITY_DATA_DIR", _data_home())
+
+# --- Scheduler ---
+# Parallel yt-dlp downloads (one worker thread each)
+MAX_DOWNLOADS = _int("INFINITY_MAX_DOWNLOADS", 3)
+# Parallel FFmpeg merges run by yt-dlp (video + audio into one container)
+MAX_POSTPROCESS = _int("INFINITY_MAX_POSTPROCESS", 2)
+# Parallel metadata extractions (fetch_info), kept apart from downloads
+MAX_METADATA = _int("INFINITY_MAX_METADATA", 4)
+
+# --- Metadata cache ---
+# Seconds before cached format info is considered stale (stream URLs expire)
+METADATA_CACHE_TTL = _int("INFINITY_METADATA_CACHE_TTL", 1800)
+# Max number of videos kept in the cache (least recently used are dropped)
+METADATA_CACHE_SIZE = _int("INFINITY_METADATA_CACHE_SIZE", 256)
+
+# --- Progress events ---
+# Throttle window for status frames sent to a client (milliseconds)
+STATUS_COALESCE_MS = _int("INFINITY_STATUS_COALESCE_MS", 200)
+# Seconds a finished task's status is kept before being dropped
+STATUS_FINISHED_TTL = _int("INFINITY_STATUS_FINISHED_TTL", 60)
+# Seconds without any update after which a task's status is dropped
+STATUS_MAX_AGE = _int("INFINITY_STATUS_MAX_AGE", 6 * 3600)
+
+# --- Websocket protocol ---
+# Period of the batched frames in the compact /ws protocol (milliseconds, a client may ask for its own)
+WS_FRAME_INTERVAL_MS = _int("INFINITY_WS_FRAME_INTERVAL_MS", 250)
+# permessage-deflate on /ws frames when the client offers it (read by run.py for uvicorn)
+WS_DEFLATE = _int("INFINITY_WS_DEFLATE", 1)
+
+# --- Job journal / resume ---
+# SQLite file recording every job so unfinished ones resume after a restart ("off" disables)
+JOURNAL_PATH = _str("INFINITY_JOURNAL", os.path.join(DATA_DIR, "jobs.db"))
+if JOURNAL_PATH.lower() in ("", "off", "none", "0"):
+    JOURNAL_PATH = None
+# Days finished jobs stay in the journal
+JOURNAL_KEEP_DAYS = _int("INFINITY_JOURNAL_KEEP_DAYS", 7)
+# Connections per download (fragments in parallel / aria2c segments when > 1)
+DOWNLOAD_CONNECTIONS = _int("INFINITY_DOWNLOAD_CONNECTIONS", 1)
+
+# --- Job store (queue + status events) ---
+# "memory" for one server process, "sqlite:///path/jobs.db" to share them between the worker processes
+# of one host, "redis://host:6379/0" between hosts (needs the redis package)
+JOB_STORE = _str("INFINITY_JOB_STORE", "memory")
+# Milliseconds between two syncs with a shared store (status batches out and in, queue polling)
+JOB_STORE_INTERVAL_MS = _int("INFINITY_JOB_STORE_INTERVAL_MS", 100)
+# Seconds before the jobs claimed by a process that died (stopped renewing its claims) are run again
+JOB_STORE_LEASE = _int("INFINITY_JOB_STORE_LEASE", 30)
+
+# --- Job control ---
+# Cancel the downloads a websocket (or a streamed /api/batch) started when it disconnects,
+# unless the request set "cancel_on_disconnect": false (1 = on, 0 = off)
+CANCEL_ON_DISCONNECT = _int("INFINITY_CANCEL_ON_DISCONNECT", 1)
+# Seconds those downloads are kept first, so a client that reconnects (page reload) and
+# watches its tasks again takes them back (0 = cancel at once)
+DISCONNECT_GRACE_S = _int("INFINITY_DISCONNECT_GRACE_S", 10)
+
+# --- Retries ---
+# Retries of a failed download (throttling, expired URLs, network errors, failed merges)
+RETRY_ATTEMPTS = _int("INFINITY_RETRY_ATTEMPTS", 4)
+# Exponential backoff between retries, with full jitter (milliseconds)
+RETRY_BACKOFF_MS = _int("INFINITY_RETRY_BACKOFF_MS", 1000)
+RETRY_BACKOFF_MAX_MS = _int("INFINITY_RETRY_BACKOFF_MAX_MS", 30000)
+
+# --- Batch / playlist mode ---
+# Items of one batch that may be queued or downloading at the same time
+BATCH_FAN_OUT = _int("INFINITY_BATCH_FAN_OUT", 4)
+
+# --- Startup ---
+# "production" runs without the auto-reloader (run.py --prod does the same), "development" reloads on code changes
+ENVIRONMENT = _str("INFINITY_ENV", "development")
+# Page extracted in the background at startup to prime yt-dlp's player/signature cache ("" = off)
+WARMUP_URL = _str("INFINITY_WARMUP_URL", "")
+
+# --- yt-dlp instance pool ---
+# Idle YoutubeDL instances kept per option profile
+YDL_POOL_IDLE = _int("INFINITY_YDL_POOL_IDLE", 4)
+# Instances built per profile at startup (0 = build on first use)
+YDL_POOL_WARM = _int("INFINITY_YDL_POOL_WARM", 1)
+
+# --- Execution backend ---
+# "thread" runs yt-dlp in pool threads; "process" ships it to worker processes (escapes the GIL)
+EXECUTION_BACKEND = _str("INFINITY_BACKEND", "thread")
+
+# --- Transfer engine ---
+# "async" moves the bytes on the event loop (needs httpx), "thread" lets yt-dlp download on a pool thread
+DOWNLOAD_ENGINE = _str("INFINITY_ENGINE", "async")
+# HTTP connections pooled and shared by every async transfer
+ENGINE_MAX_CONNECTIONS = _int("INFINITY_ENGINE_CONNECTIONS", 256)
+# Threads doing the file writes of the async engine
+ENGINE_IO_THREADS = _int("INFINITY_ENGINE_IO_THREADS", 4)
+
+# --- Bandwidth shaping ---
+# Rates in bytes/s with optional K/M/G suffix ("8M"), 0 = unlimited. Adjustable at runtime (/api/bandwidth)
+BANDWIDTH_GLOBAL = _str("INFINITY_BANDWIDTH_GLOBAL", "0")
+BANDWIDTH_PER_HOST = _str("INFINITY_BANDWIDTH_PER_HOST", "0")
+BANDWIDTH_PER_CLIENT = _str("INFINITY_BANDWIDTH_PER_CLIENT", "0")
+BANDWIDTH_PER_TASK = _str("INFINITY_BANDWIDTH_PER_TASK", "0")
+# Share of an audio job next to a video job (1) when bandwidth is split between them
+BANDWIDTH_AUDIO_WEIGHT = _int("INFINITY_BANDWIDTH_AUDIO_WEIGHT", 2)
+
+# --- Post-processing ---
+# Audio conversions running at once, on their own pool (a download slot is freed first)
+MAX_TRANSCODE = _int("INFINITY_MAX_TRANSCODE", 2)
+# FFmpeg threads per conversion (0 = CPU cores / MAX_TRANSCODE)
+TRANSCODE_THREADS = _int("INFINITY_TRANSCODE_THREADS", 0)
+# Profile used for best_audio, and for video downloads, when the client does not pick one
+AUDIO_PROFILE = _str("INFINITY_AUDIO_PROFILE", "mp3-192")
+VIDEO_PROFILE = _str("INFINITY_VIDEO_PROFILE", "mp4")
+
+# --- Media store ---
+# Content-addressed copies of finished downloads, reused for repeat requests ("off" disables)
+MEDIA_STORE = _str("INFINITY_MEDIA_STORE", os.path.join(DATA_DIR, "media-store"))
+if MEDIA_STORE.lower() in ("", "off", "none", "0"):
+    MEDIA_STORE = None
+# Size quota in MB; least recently used files are evicted beyond it
+MEDIA_STORE_MAX_MB = _int("INFINITY_MEDIA_STORE_MAX_MB", 10240)
+# 1 = copy downloads into the store when they cannot be reflinked or hard linked (every file written twice)
+MEDIA_STORE_COPY = _int("INFINITY_MEDIA_STORE_COPY", 0)
+
+# --- Streaming to the client ---
+# Concurrent /api/stream responses (each holds one reader thread, or one FFmpeg process)
+MAX_STREAMS = _int("INFINITY_MAX_STREAMS", 8)
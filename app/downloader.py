@@ -1,10 +1,221 @@
-import yt_dlp
 import os
+import copy
+import glob
+import re
 import shutil
-from pathlib import Path
+import threading
+import time
 
-# Shared dictionary
+from . import config
+from .cache import TTLCache, video_key
+from .catalog import FormatCatalog, is_query, parse_query, is_audio_only, has_audio
+from .events import EventBus
+from .journal import JobJournal
+from .store import open_store
+from .media_store import MediaStore
+from .progress import ProgressTracker
+from .ydl_pool import YDLPool
+from .metrics import STAGE_SECONDS, DOWNLOADS, EXTRACTIONS, FALLBACKS
+from .retry import DIRECT, MERGE_ONLY, REFRESH, RetryState
+from .postprocess import VIDEO_PROFILES, check_profile, is_audio_profile, probe, transcoder
+from .bandwidth import shaper
+from .startup import report as startup_report
+from . import log
+
+# Shared dictionary (task_id -> status), written through status_bus
 download_status = {}
+status_bus = EventBus(
+    download_status,
+    coalesce=config.STATUS_COALESCE_MS / 1000,
+    finished_ttl=config.STATUS_FINISHED_TTL,
+    max_age=config.STATUS_MAX_AGE,
+)
+
+# Queue and status events, shared with the other server processes unless "memory" (see store.py)
+job_store = open_store(
+    config.JOB_STORE,
+    interval=config.JOB_STORE_INTERVAL_MS / 1000,
+    finished_ttl=config.STATUS_FINISHED_TTL,
+    max_age=config.STATUS_MAX_AGE,
+    lease=config.JOB_STORE_LEASE,
+)
+
+# Per-task and server-wide throughput, fed by progress_hook
+progress_tracker = ProgressTracker()
+
+# Persistent job records, used to resume unfinished downloads after a restart.
+# Opened by the app's startup hook only: worker processes import this module too (see workers.py)
+job_journal = JobJournal(config.JOURNAL_PATH)
+
+# Finished files reused for repeat requests (same video, format and profile), opened like the journal
+media_store = MediaStore(config.MEDIA_STORE, config.MEDIA_STORE_MAX_MB * 1024 * 1024, bool(config.MEDIA_STORE_COPY))
+
+# Extracted info dicts, keyed by normalized video id (see cache.video_key)
+metadata_cache = TTLCache(config.METADATA_CACHE_SIZE, config.METADATA_CACHE_TTL)
+# Format catalogs built from those info dicts (same keys, same lifetime)
+catalog_cache = TTLCache(config.METADATA_CACHE_SIZE, config.METADATA_CACHE_TTL)
+
+# Leader task id -> task ids attached to its download (see run_download)
+status_followers = {}
+_followers_lock = threading.Lock()
+
+class _Flight:
+    def __init__(self, owner):
+        self.owner = owner
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key.
+    The first caller runs the work; callers arriving while it is in progress
+    wait for it and get the same result (or exception) instead of repeating it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, fn, *args, owner=None, on_join=None, check=None, **kwargs):
+        """
+        Returns (result, shared) where shared is True for attached callers.
+        An attached caller runs check() while it waits (it may raise to leave).
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight(owner)
+                leader = True
+            else:
+                leader = False
+                # Runs under the lock so the leader cannot finish unnoticed
+                if on_join:
+                    on_join(flight.owner)
+
+        if not leader:
+            while not flight.done.wait(0.25 if check else None):
+                check()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn(*args, **kwargs)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, False
+
+    def in_flight(self):
+        return len(self._flights)
+
+extract_flight = SingleFlight()
+download_flight = SingleFlight()
+
+# Worker processes set this to forward status changes to the parent (see workers.py)
+status_sink = None
+
+def run_local(fn, *args, **kwargs):
+    return fn(*args, **kwargs)
+
+# Runs the heavy yt-dlp calls (extraction, the download job itself).
+# The process backend swaps this for a call into a worker process.
+run_heavy = run_local
+
+class Stopped(Exception):
+    """Raised inside a running job that was cancelled or paused (see request_stop)."""
+
+    def __init__(self, action):
+        super().__init__("Cancelled" if action == "cancel" else "Paused")
+        self.action = action
+
+# What the clients asked for: task_id -> "cancel" / "pause"
+_stop_wanted = {}
+# What running jobs act on. A download shared by several tasks (see run_download)
+# only stops once all of them asked. Worker processes get a proxy of the
+# parent's dict (see workers.py) and `stop_relay` mirrors the writes into it.
+stop_requests = {}
+stop_relay = None
+_stop_checked = {}
+
+def request_stop(task_id, action="cancel"):
+    """
+    Asks a running job to stop. Its hooks raise Stopped at the next chunk
+    (or while it waits for a converter), and its FFmpeg conversion is killed.
+    """
+    with _followers_lock:
+        _stop_wanted[task_id] = action
+        leaders = [task_id, *(leader for leader, tasks in status_followers.items() if task_id in tasks)]
+        _update_stops(leaders)
+
+def clear_stop(task_id):
+    """Forgets the stop request of a job that is over."""
+    with _followers_lock:
+        _stop_wanted.pop(task_id, None)
+        _stop_checked.pop(task_id, None)
+        if stop_requests.pop(task_id, None) is not None and stop_relay is not None:
+            stop_relay.pop(task_id, None)
+
+def _update_stops(task_ids):
+    # Called with _followers_lock held
+    for task_id in task_ids:
+        action = _stop_wanted.get(task_id)
+        if action is None or any(t not in _stop_wanted for t in status_followers.get(task_id, ())):
+            continue
+        if stop_requests.get(task_id) != action:
+            stop_requests[task_id] = action
+            if stop_relay is not None:
+                stop_relay[task_id] = action
+            transcoder.cancel(task_id)
+
+def stop_requested(task_id):
+    """'cancel' / 'pause' when the job should stop, else None."""
+    if status_sink is not None:
+        # In a worker process every lookup is a round trip to the parent
+        now = time.monotonic()
+        if now - _stop_checked.get(task_id, 0) < 0.25:
+            return None
+        _stop_checked[task_id] = now
+    try:
+        return stop_requests.get(task_id)
+    except Exception:
+        # Parent gone (shutdown)
+        return None
+
+def check_stop(task_id):
+    action = stop_requested(task_id)
+    if action is not None:
+        raise Stopped(action)
+
+def stopped_status(action):
+    if action == "pause":
+        return {"state": "paused", "message": "Paused"}
+    return {"state": "cancelled", "message": "Cancelled"}
+
+def _status_targets(task_id):
+    with _followers_lock:
+        return (task_id, *status_followers.get(task_id, ()))
+
+def set_status(task_id, status):
+    """Replaces the status of a task and of every task attached to it."""
+    if status_sink is not None:
+        status_sink(task_id, status, True)
+        return
+    for tid in _status_targets(task_id):
+        status_bus.publish(tid, status, replace=True)
+
+def update_status(task_id, fields):
+    """Merges fields into the status of a task (and its followers) while still tracked."""
+    if status_sink is not None:
+        status_sink(task_id, fields, False)
+        return
+    for tid in _status_targets(task_id):
+        status_bus.publish(tid, fields)
 
 class MyLogger:
     def debug(self, msg):
@@ -14,9 +225,9 @@ class MyLogger:
     def warning(self, msg):
         ignore_keywords = ["PO Token", "JavaScript runtime", "SABR", "missing a url"]
         if not any(k in msg for k in ignore_keywords):
-            print(f"[WARNING] {msg}")
+            log.warning(msg, source="yt-dlp")
     def error(self, msg):
-        print(f"[ERROR] {msg}")
+        log.error(msg, source="yt-dlp")
 
 def get_ffmpeg_path():
     """
@@ -50,194 +261,613 @@ def get_ffmpeg_path():
     return None
 
 def progress_hook(d, task_id):
+    # Raising here aborts the transfer (yt-dlp lets hook exceptions through)
+    check_stop(task_id)
     if d['status'] == 'downloading':
-        # Clean ANSI colors logic
-        p = d.get('_percent_str', '0%').replace('\x1b[0;94m', '').replace('\x1b[0m', '')
-        if task_id in download_status:
-            download_status[task_id].update({
-                "state": "processing",
-                "message": f"Downloading: {p}",
-                "filename": d.get('filename', 'unknown')
-            })
+        # Numeric record only; clients format the text themselves
+        record = progress_tracker.record(task_id, d)
+        if record is not None:
+            record["state"] = "processing"
+            record["filename"] = d.get('filename', 'unknown')
+            update_status(task_id, record)
+            job_journal.progress(task_id, record["downloaded_bytes"], record["total_bytes"])
     elif d['status'] == 'finished':
-        if task_id in download_status:
-            download_status[task_id].update({
-                "state": "converting",
-                "message": "Download complete. Processing/Converting...",
-            })
+        elapsed = progress_tracker.stream_finished(task_id)
+        if elapsed is not None:
+            kind = "audio" if d.get('info_dict', {}).get('vcodec') == 'none' else "video"
+            STAGE_SECONDS.observe(elapsed, stage="download", detail=kind)
+        update_status(task_id, {
+            "state": "converting",
+            "message": "Download complete. Processing/Converting...",
+        })
 
-def fetch_formats(url: str):
+def extract_metadata(url: str):
     """
-    Fetches available formats for a given URL without downloading.
-    Returns a dictionary with video info and sorted format lists.
+    Returns the yt-dlp info dict for a URL, using the metadata cache.
+    The dict is shared between callers: treat it as read-only.
     """
-    print(f"[DEBUG] Fetching formats for: {url}")
-    ffmpeg_path = get_ffmpeg_path()
-    opts = {
-        'quiet': False, # Enabled logs to debug "Infinite Loading"
-        'ffmpeg_location': ffmpeg_path,
+    key = video_key(url)
+    info = metadata_cache.get(key)
+    if info is not None:
+        log.debug("Metadata cache hit", key=key)
+        return info
+
+    # Concurrent lookups of the same video share one extraction
+    info, shared = extract_flight.do(key, _extract_metadata, url, key)
+    if shared:
+        log.debug("Joined in-flight extraction", key=key)
+    return info
+
+def _extract_metadata(url, key):
+    info = run_heavy(extract_info_dict, url)
+    metadata_cache.set(key, info)
+    catalog_cache.set(key, FormatCatalog.from_info(info))
+    return info
+
+def refresh_metadata(url: str):
+    """
+    Extracts a video again because its signed format URLs went stale, and
+    replaces the cached copy so later jobs get the fresh URLs too.
+    """
+    key = video_key(url)
+    metadata_cache.invalidate(key)
+    info, _ = extract_flight.do(key, _extract_metadata, url, key)
+    return info
+
+def get_catalog(url: str):
+    """The FormatCatalog for a URL, built once per extraction."""
+    key = video_key(url)
+    catalog = catalog_cache.get(key)
+    if catalog is None:
+        catalog = FormatCatalog.from_info(extract_metadata(url))
+        catalog_cache.set(key, catalog)
+    return catalog
+
+def query_formats(url: str, query: str, limit: int = 5):
+    """Formats of a URL matching a catalog query, best first."""
+    try:
+        catalog = get_catalog(url)
+        rows = catalog.query(limit=limit, **parse_query(query))
+        return {"status": "success", "url": url, "formats": [catalog.row(i) for i in rows]}
+    except Exception as e:
+        return {"status": "error", "url": url, "message": str(e)}
+
+def resolve_format(url: str, format_id: str):
+    """
+    Turns a catalog query ('video:height<=1080,vcodec=avc,size<=50M',
+    'audio:acodec=opus') into a concrete format_id. Other values pass through.
+    """
+    if not is_query(format_id):
+        return format_id
+    best = get_catalog(url).best(**parse_query(format_id))
+    if best is None:
+        raise ValueError(f"No format matches {format_id}")
+    return best
+
+def extract_info_dict(url: str):
+    """Uncached extraction. Returns a sanitized info dict that can be re-processed later."""
+    log.debug("Starting yt-dlp extraction...", url=url)
+    try:
+        with STAGE_SECONDS.time(stage="extract", detail="metadata"):
+            with ydl_pool.acquire('metadata') as ydl:
+                info = ydl.extract_info(url, download=False)
+                # Strip private/run-specific keys so the dict can be re-processed later
+                info = ydl.sanitize_info(info, remove_private_keys=True)
+    except Exception:
+        EXTRACTIONS.inc(result="error")
+        raise
+    EXTRACTIONS.inc(result="success")
+    log.debug("Extraction successful!", url=url)
+    return info
+
+def _base_profile(quiet=True):
+    return {
+        'quiet': quiet,
+        'ffmpeg_location': get_ffmpeg_path(),
         'noplaylist': True,
         'logger': MyLogger(),
     }
+
+# Option profiles for pooled YoutubeDL instances.
+# Anything yt-dlp only reads at construction (postprocessors, logger) lives here;
+# per-job settings (outtmpl, format, hooks) are passed to ydl_pool.acquire().
+YDL_PROFILES = {
+    'metadata': lambda: _base_profile(quiet=False), # Enabled logs to debug "Infinite Loading"
+    'merge': lambda: {
+        **_base_profile(),
+        'overwrites': True,
+        'merge_output_format': 'mp4', # Default container
+    },
+    'flat': lambda: {
+        **_base_profile(),
+        'extract_flat': 'in_playlist',
+        'lazy_playlist': True,
+        'noplaylist': False,
+    },
+}
+
+ydl_pool = YDLPool(YDL_PROFILES, max_idle=config.YDL_POOL_IDLE)
+
+def fetch_formats(url: str):
+    """
+    Fetches available formats for a given URL without downloading.
+    Returns a dictionary with video info and sorted format lists.
+    """
+    log.debug("Fetching formats", url=url)
     
     try:
-        print("[DEBUG] Starting yt-dlp extraction...")
-        with yt_dlp.YoutubeDL(opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            print("[DEBUG] Extraction successful!")
-            
-            formats = info.get('formats', [])
-            video_formats = []
-            audio_formats = []
-            
-            # Filter duplicates: Keep best bitrate for each Resolution + Container combo
-            unique_videos = {} # Key: (height, ext) -> format_dict
-            
-            for f in formats:
-                # Format Size (estimate if None)
-                filesize = f.get('filesize') or f.get('filesize_approx')
-                size_str = f"{filesize / 1024 / 1024:.1f} MB" if filesize else "N/A"
-                filesize_val = filesize or 0
-                
-                # Audio extraction
-                if f.get('vcodec') == 'none' and f.get('acodec') != 'none':
-                    audio_formats.append({
-                        'format_id': f['format_id'],
-                        'ext': f['ext'],
-                        'quality': f.get('abr', 0) or 0, # Audio bitrate
-                        'note': f"{(f.get('abr') or 0):.0f}kbps",
-                        'size': size_str,
-                        'filesize_bytes': filesize_val
-                    })
-                
-                # Video extraction
-                elif f.get('vcodec') != 'none':
-                    height = f.get('height') or 0
-                    if height >= 144: # Ignore super low quality thumbnail streams
-                        note = f.get('format_note', '')
-                        ext = f['ext']
-                        
-                        # Create candidate object
-                        candidate = {
-                            'format_id': f['format_id'],
-                            'ext': ext,
-                            'quality': f"{height}p",
-                            'height': height,
-                            'note': note,
-                            'size': size_str,
-                            'filesize_bytes': filesize_val
-                        }
-                        
-                        key = (height, ext)
-                        
-                        # Logic: Prefer larger filesize (usually indicates higher bitrate/quality)
-                        # If current key exists, compare
-                        if key in unique_videos:
-                            prev = unique_videos[key]
-                            if candidate['filesize_bytes'] > prev['filesize_bytes']:
-                                unique_videos[key] = candidate
-                            # If sizes are equal or 0, maybe prefer 'avc1' (h264) for mp4? for now size is good proxy.
-                        else:
-                            unique_videos[key] = candidate
-
-            # Convert dict back to list
-            video_formats = list(unique_videos.values())
-
-            # Sort formats
-            audio_formats.sort(key=lambda x: x['filesize_bytes'], reverse=True)
-            video_formats.sort(key=lambda x: x['height'], reverse=True)
-
-            return {
-                "status": "success",
-                "id": info.get('id'),
-                "title": info.get('title', 'Unknown'),
-                "thumbnail": info.get('thumbnail', ''),
-                "duration": info.get('duration_string', ''),
-                "author": info.get('uploader', ''),
-                "formats": {
-                    "video": video_formats,
-                    "audio": audio_formats
-                }
+        info = extract_metadata(url)
+        # Filtered, de-duplicated and sorted once per video by the catalog
+        video_formats, audio_formats = get_catalog(url).ui_lists()
+
+        return {
+            "status": "success",
+            "id": info.get('id'),
+            "title": info.get('title', 'Unknown'),
+            "thumbnail": info.get('thumbnail', ''),
+            "duration": info.get('duration_string', ''),
+            "author": info.get('uploader', ''),
+            "formats": {
+                "video": video_formats,
+                "audio": audio_formats
             }
-            
+        }
+        
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
-def run_download(url: str, format_id: str, task_id: str, download_path: str = "Default"):
+def warm_up(count=1, url=None):
     """
-    Downloads a specific format ID.
-    If format_id is 'best_audio', it downloads best audio and converts to mp3.
+    Pays the first request's one-time costs in the background: the yt-dlp
+    import, `count` pooled instances per profile with their extractors loaded,
+    the FFmpeg probe and, with `url`, one extraction, which downloads the
+    player JS into yt-dlp's signature cache (on disk, shared by every instance).
     """
-    # 1. Initialize Status
-    download_status[task_id] = {"state": "starting", "message": "Initializing..."}
-    
-    ffmpeg_path = get_ffmpeg_path()
-    
-    # Common Options
-    opts = {
-        'quiet': True,
-        'ffmpeg_location': ffmpeg_path,
-        'noplaylist': True,
-        'progress_hooks': [lambda d: progress_hook(d, task_id)],
-        'logger': MyLogger(),
-        'overwrites': True,
-    }
+    with startup_report.timed("warmup"):
+        with startup_report.timed("warmup.import"):
+            import yt_dlp  # noqa: F401  (ydl_pool imports it lazily, timed on its own here)
+        with startup_report.timed("warmup.ydl_pool"):
+            for profile in ("metadata", "merge"):
+                ydl_pool.warm(profile, count)
+        with startup_report.timed("warmup.ffmpeg_probe"):
+            probe(get_ffmpeg_path())
+        if url:
+            with startup_report.timed("warmup.extract"):
+                try:
+                    extract_metadata(url)
+                except Exception as e:
+                    log.warning(f"Warm-up extraction failed: {e}", url=url)
+    startup_report.warm = True
+    log.info(f"Warm-up done in {startup_report.phases['warmup']:.2f}s ({startup_report.summary('warmup.')})")
 
-    # Determine Output Folder
-    # Determine Output Folder
+def postprocess_hook(d, task_id, pp_slots, held, timings=None):
+    """
+    Takes a slot from `pp_slots` before the first FFmpeg post-processor runs,
+    so only a bounded number of merges/conversions burn CPU at the same time.
+    The slot is released by run_download once the job is over.
+    `timings` (name -> start time) is used to time each post-processor.
+    """
+    name = d.get('postprocessor') or 'unknown'
+    if d['status'] == 'finished':
+        if timings is not None and name in timings:
+            STAGE_SECONDS.observe(time.perf_counter() - timings.pop(name), stage="postprocess", detail=name)
+        return
+    if d['status'] != 'started':
+        return
+    check_stop(task_id)
+    if pp_slots is not None and not held and name != 'MoveFiles':
+        update_status(task_id, {
+            "state": "converting",
+            "message": "Waiting for a free converter...",
+        })
+        with STAGE_SECONDS.time(stage="postprocess_wait"):
+            # Wakes up now and then, so a job stopped while waiting gives up
+            while not pp_slots.acquire(timeout=0.25):
+                check_stop(task_id)
+        held.append(True)
+    if timings is not None:
+        timings[name] = time.perf_counter()
+
+def resolve_download_folder(download_path: str = "Default"):
     if download_path == "Default" or not os.path.exists(download_path):
         # User requested System Download Folder (Requirement: ~/Downloads/Youtube Download)
-        base_folder = os.path.join(Path.home(), "Downloads", "Youtube Download")
+        base_folder = config.DEFAULT_DOWNLOAD_FOLDER
         # Ensure it exists
         os.makedirs(base_folder, exist_ok=True)
     else:
         base_folder = download_path
+    return base_folder
+
+def run_download(url: str, format_id: str, task_id: str, download_path: str = "Default", pp_slots=None,
+                 connections=None, resume=False, profile=None, on_downloaded=None):
+    """
+    Downloads a specific format ID.
+    If format_id is 'best_audio', it downloads best audio and converts it
+    with an audio `profile` (see postprocess.py, default mp3-192).
+    `pp_slots` is an optional semaphore limiting parallel FFmpeg merges.
+    `on_downloaded` is called once the network part is over, before an
+    audio conversion waits on the transcode pool.
+    `connections` > 1 fetches fragments/segments over several connections.
+    `resume` keeps the files of an interrupted run and continues their .part files.
+
+    Identical concurrent requests (same video, format and folder) are
+    single-flighted: the first one downloads, the others attach to it,
+    mirror its progress and receive its final status.
+    A video/format finished before is linked from the media store instead.
+    """
+    job, final = prepare_download(url, format_id, task_id, download_path, profile)
+    if final is not None:
+        return final
+    try:
+        final, shared = download_flight.do(
+            job["key"], _download_and_convert,
+            url, job["format_id"], task_id, job["base_folder"], job["cached_info"], connections, resume,
+            job["profile"], owner=task_id, on_join=lambda leader_id: attach_follower(task_id, leader_id),
+            check=lambda: check_stop(task_id), pp_slots=pp_slots, on_downloaded=on_downloaded,
+        )
+    except Stopped as e:
+        # Only followers get here, the leader returns a stopped status
+        leave_flight(task_id)
+        final, shared = stopped_status(e.action), True
+    finally:
+        detach_followers(task_id)
+    return finish_download(task_id, final, job["store_key"], shared)
 
-    opts['outtmpl'] = os.path.join(base_folder, "%(title)s.%(ext)s")
+def prepare_download(url, format_id, task_id, download_path="Default", profile=None):
+    """
+    First step of every download (both engines): resolves the folder, the
+    format and the profile, then tries the media store.
+    Returns (job, final); final is set when the job is already over.
+    """
+    base_folder = resolve_download_folder(download_path)
+    job_journal.mark_running(task_id, base_folder)
+    try:
+        format_id = resolve_format(url, format_id)
+        cached_info = metadata_cache.get(video_key(url))
+        profile = check_profile(profile, format_id, cached_info)
+        # Stopped while the format was being resolved
+        check_stop(task_id)
+    except Stopped as e:
+        final = stopped_status(e.action)
+        set_status(task_id, final)
+        return None, finish_download(task_id, final)
+    except Exception as e:
+        final = {"state": "error", "message": str(e)}
+        set_status(task_id, final)
+        return None, finish_download(task_id, final)
+
+    store_key = media_store.key(video_key(url), format_id, profile)
+    final = from_media_store(store_key, task_id, base_folder)
+    if final is not None:
+        return None, finish_download(task_id, final)
+
+    return {
+        "base_folder": base_folder,
+        "format_id": format_id,
+        "profile": profile,
+        "key": (video_key(url), format_id, os.path.abspath(base_folder), profile),
+        "store_key": store_key,
+        # Reuse the info from fetch_info when we have it (skips a second extraction)
+        "cached_info": cached_info,
+    }, None
+
+def finish_download(task_id, final, store_key=None, shared=False):
+    """Last step: keeps the file in the media store, counts the job and closes its journal entry."""
+    if shared:
+        set_status(task_id, final)
+    elif store_key and final.get("state") == "completed" and final.get("file_path"):
+        try:
+            media_store.ingest(store_key, final["file_path"])
+        except OSError as e:
+            log.warning(f"Could not add to the media store: {e}", task_id=task_id)
+    DOWNLOADS.inc(result=final.get("state", "error"))
+    job_journal.finish(task_id, final)
+    return final
 
-    # Format Logic
+def attach_follower(task_id, leader_id):
+    """Makes task_id mirror the status of an identical download already running."""
+    with _followers_lock:
+        status_followers.setdefault(leader_id, set()).add(task_id)
+    status_bus.publish(task_id, {
+        "state": "starting",
+        "message": "Joined an identical download in progress...",
+    }, replace=True)
+
+def detach_followers(task_id):
+    with _followers_lock:
+        status_followers.pop(task_id, None)
+
+def leave_flight(task_id):
+    """A follower that stopped waiting: the leader no longer downloads for it."""
+    with _followers_lock:
+        leaders = [leader for leader, tasks in status_followers.items() if task_id in tasks]
+        for leader in leaders:
+            status_followers[leader].discard(task_id)
+        # The leader may have been waiting on this follower to stop
+        _update_stops(leaders)
+
+def _download_and_convert(url, format_id, task_id, base_folder, cached_info, connections, resume, profile,
+                          pp_slots=None, on_downloaded=None):
+    final = run_heavy(
+        _run_download, url, format_id, task_id, base_folder, cached_info, connections, resume,
+        profile=profile, pp_slots=pp_slots,
+    )
+    if on_downloaded is not None:
+        on_downloaded()
+    if final.get("state") == "converting":
+        final = convert_audio(task_id, final, profile)
+    return final
+
+def convert_audio(task_id, downloaded, profile):
+    """Runs an audio profile on the transcode pool and publishes the final status."""
+    def started(mode):
+        update_status(task_id, {
+            "state": "converting",
+            "message": "Remuxing audio (no re-encode)..." if mode == "copy" else f"Converting ({profile})...",
+        })
+
+    try:
+        check_stop(task_id)
+        path = transcoder.run(get_ffmpeg_path(), downloaded["file_path"], downloaded["output_base"], profile,
+                              downloaded.get("acodec"), on_start=started, task_id=task_id)
+        final = {
+            "state": "completed",
+            "message": "Done!",
+            "file_path": path,
+            "filename": os.path.basename(path),
+        }
+    except Exception as e:
+        # A killed FFmpeg fails like any other, the stop request tells them apart
+        action = stop_requested(task_id)
+        if action is None:
+            final = {"state": "error", "message": str(e)}
+        else:
+            final = stopped_status(action)
+            if action == "cancel":
+                _remove_files([downloaded["file_path"]])
+    set_status(task_id, final)
+    return final
+
+def from_media_store(store_key, task_id, base_folder):
+    """Final status for a stored copy linked into base_folder, or None on a miss."""
+    started = time.perf_counter()
+    try:
+        path = media_store.materialize(store_key, base_folder)
+    except OSError as e:
+        log.warning(f"Media store lookup failed: {e}", task_id=task_id)
+        return None
+    if path is None:
+        return None
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage="store_hit")
+    final = {
+        "state": "completed",
+        "message": "Done! (from cache)",
+        "file_path": path,
+        "filename": os.path.basename(path),
+    }
+    set_status(task_id, final)
+    return final
+
+def apply_connections(opts, connections):
+    """
+    Multi-connection fetching for one job.
+    DASH/HLS fragments are downloaded in parallel by yt-dlp itself; plain
+    HTTP streams are split across connections with aria2c when installed,
+    otherwise fetched in ranged chunks (sidesteps per-connection throttling).
+    """
+    if not connections or connections <= 1:
+        return
+    opts['concurrent_fragment_downloads'] = connections
+    if shutil.which('aria2c'):
+        opts['external_downloader'] = {'http': 'aria2c'}
+        opts['external_downloader_args'] = {
+            'aria2c': ['-x', str(connections), '-s', str(connections), '-k', '1M'],
+        }
+    else:
+        opts['http_chunk_size'] = 10 * 1024 * 1024
+
+def job_options(format_id, task_id, base_folder, cached_info, profile):
+    """Output template and format selection of one job (yt-dlp options)."""
+    opts = {'outtmpl': os.path.join(base_folder, "%(title)s.%(ext)s")}
+    convert = is_audio_profile(profile)
+    if convert:
+        # Per-task name, so other profiles of the same video never share the source file
+        opts['outtmpl'] = os.path.join(base_folder, f"%(title)s{_raw_tag(task_id)}.%(ext)s")
     if format_id == "best_audio":
-        # Convert to MP3 high quality
+        # Downloaded as-is, converted afterwards on the transcode pool
         opts['format'] = 'bestaudio/best'
-        opts['postprocessors'] = [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }]
+    elif is_audio_only(cached_info, format_id) or (convert and has_audio(cached_info, format_id)):
+        # A specific stream (e.g. from an 'audio:' query) is kept as-is
+        opts['format'] = format_id
+    elif convert:
+        # Not known to carry audio: add the best audio (yt-dlp keeps only the
+        # first audio stream, so an audio format_id still comes alone)
+        opts['format'] = f"{format_id}+bestaudio/bestaudio"
     else:
         # Specific Format Download
         # If it's a video, we fetch that video format + best audio and merge
         opts['format'] = f"{format_id}+bestaudio/best"
-        opts['merge_output_format'] = 'mp4' # Default container
+        opts['merge_output_format'] = VIDEO_PROFILES[profile]
+    return opts
+
+def _raw_tag(task_id):
+    return f".raw-{task_id[:8]}"
 
+def downloaded_status(filename, info, task_id, profile):
+    """Status once the file is on disk: completed, or waiting for its audio conversion."""
+    if is_audio_profile(profile):
+        # The parent hands this to the transcode pool
+        return {
+            "state": "converting",
+            "message": "Waiting for a free converter...",
+            "file_path": filename,
+            "filename": os.path.basename(filename),
+            "output_base": os.path.splitext(filename)[0][:-len(_raw_tag(task_id))],
+            "acodec": info.get('acodec'),
+        }
+    return {
+        "state": "completed",
+        "message": "Done!",
+        "file_path": filename,
+        "filename": os.path.basename(filename),
+    }
+
+# Format fields the async engine needs (plans cross process boundaries, keep them small)
+TRANSFER_FIELDS = ('format_id', 'ext', 'url', 'protocol', 'http_headers', 'vcodec', 'acodec',
+                   'filesize', 'filesize_approx', 'fragments', 'fragment_base_url', 'downloader_options')
+
+def plan_transfer(url, format_id, task_id, base_folder, cached_info=None, profile=None):
+    """
+    What _run_download would fetch, without fetching it: the output file name
+    and the selected formats (one, or video + audio to merge).
+    Used by the async engine (engine.py), which moves the bytes itself.
+    """
+    profile = profile or check_profile(None, format_id)
+    opts = job_options(format_id, task_id, base_folder, cached_info, profile)
+    with ydl_pool.acquire('merge', **opts) as ydl:
+        if cached_info is not None:
+            info = ydl.process_ie_result(copy.deepcopy(cached_info), download=False)
+        else:
+            info = ydl.extract_info(url, download=False)
+        filename = ydl.prepare_filename(info)
+    formats = info.get('requested_formats') or [info]
+    return {
+        "filename": filename,
+        "is_live": bool(info.get('is_live')),
+        "acodec": info.get('acodec'),
+        "formats": [{k: f.get(k) for k in TRANSFER_FIELDS} for f in formats],
+    }
+
+def _run_download(url, format_id, task_id, base_folder, cached_info=None, connections=None, resume=False,
+                  profile=None, pp_slots=None):
+    # 1. Initialize Status
+    set_status(task_id, {
+        "state": "starting",
+        "message": "Resuming..." if resume else "Initializing...",
+    })
+    
+    held = []
+    pp_timings = {}
+    # Files written so far, removed if the job is cancelled
+    written = set()
+    hooks = {
+        # The shaper sleeps on this thread when the job is over its share
+        'progress_hooks': [
+            lambda d: written.add(d.get('tmpfilename') or d.get('filename')),
+            lambda d: progress_hook(d, task_id),
+            lambda d: shaper.throttle_progress(task_id, d),
+        ],
+        'postprocessor_hooks': [lambda d: postprocess_hook(d, task_id, pp_slots, held, pp_timings)],
+    }
+
+    # Per-job options, applied on top of the pooled profile
+    opts = {
+        # A resumed job keeps the streams it already finished
+        'overwrites': not resume,
+        'continuedl': True,
+    }
+    apply_connections(opts, connections or config.DOWNLOAD_CONNECTIONS)
+    if shaper.limited:
+        # Small fixed reads, so the shaper is charged (and sleeps) in small steps
+        opts.update(buffersize=64 * 1024, noresizebuffer=True)
+
+    profile = profile or check_profile(None, format_id)
+    opts.update(job_options(format_id, task_id, base_folder, cached_info, profile))
+
+    retries = RetryState(merging='merge_output_format' in opts)
+    retry = None
+    direct = False
     try:
-        with yt_dlp.YoutubeDL(opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
-            
-            # Extension fix for Audio (if post-processed)
-            if format_id == "best_audio":
-                base, _ = os.path.splitext(filename)
-                filename = f"{base}.mp3"
-            
-            display_name = os.path.basename(filename)
-
-            download_status[task_id] = {
-                "state": "completed", 
-                "message": "Done!", 
-                "file_path": filename,
-                "filename": display_name
-            }
-            
-    except Exception as e:
-        # Retry with just the format_id if merge fails (fallback)
-        try:
-             print(f"Merge failed, trying direct download: {e}")
-             opts['format'] = format_id
-             with yt_dlp.YoutubeDL(opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                download_status[task_id] = {
-                    "state": "completed", "message": "Done (Direct)", "filename": "video"
-                }
-        except Exception as e2:
-            download_status[task_id] = {"state": "error", "message": str(e2)}
\ No newline at end of file
+        while True:
+            # What this attempt extracted or re-processed: its URLs tell an expired link from throttling
+            resolved = None
+            try:
+                if retry is not None:
+                    # What is on disk stays: finished streams are skipped, .part files continued
+                    step, delay = retry
+                    opts['overwrites'] = False
+                    if delay:
+                        wait_before_retry(task_id, delay, f"Retrying in {delay:.1f}s ({retries.kind})...")
+                    if step == REFRESH:
+                        update_status(task_id, {"state": "starting", "message": "Refreshing expired links..."})
+                        cached_info = refresh_metadata(url)
+                    elif step == MERGE_ONLY and 'merge_output_format' in opts:
+                        # Same streams, into the container that takes any codec
+                        opts['merge_output_format'] = 'mkv'
+                        _remove_merge_leftovers(written)
+                    elif step == DIRECT:
+                        # The chosen format alone, nothing to merge
+                        FALLBACKS.inc(kind="merge_direct")
+                        opts['format'] = format_id
+                        opts.pop('merge_output_format', None)
+                        direct = True
+                with ydl_pool.acquire('merge', **hooks, **opts) as ydl:
+                    if cached_info is not None:
+                        resolved = copy.deepcopy(cached_info)
+                    else:
+                        # Same as extract_info(download=True), in two steps so a failed download still has the info
+                        resolved = ydl.extract_info(url, download=False, process=False)
+                    info = ydl.process_ie_result(resolved, download=True)
+                    final = downloaded_status(ydl.prepare_filename(info), info, task_id, profile)
+                if direct and final["state"] == "completed":
+                    final["message"] = "Done (Direct)"
+                break
+            except Stopped as e:
+                # No retry: the job was asked to stop. A paused one keeps its .part files
+                log.info("Download stopped", task_id=task_id, action=e.action)
+                final = stopped_status(e.action)
+                if e.action == "cancel":
+                    _remove_files(written)
+                break
+            except Exception as e:
+                # Give the converter slot back while we wait or download again
+                if held:
+                    pp_slots.release()
+                    held.clear()
+                retry = retries.next_step(e, resolved)
+                if retry is None:
+                    log.warning(f"Download failed ({retries.kind})", task_id=task_id, error=e)
+                    final = {"state": "error", "message": str(e)}
+                    break
+                log.warning(f"Download failed ({retries.kind}), next: {retry[0]}", task_id=task_id, error=e)
+    finally:
+        if held:
+            pp_slots.release()
+        progress_tracker.forget(task_id)
+
+    set_status(task_id, final)
+    return final
+
+def wait_before_retry(task_id, delay, message):
+    """Backoff sleep, in small steps so a stop request still gets through."""
+    update_status(task_id, {"state": "starting", "message": message})
+    deadline = time.monotonic() + delay
+    while True:
+        check_stop(task_id)
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return
+        time.sleep(min(0.25, left))
+
+def _remove_files(paths):
+    """Deletes what a cancelled job left behind: streams, .part files and their fragments."""
+    for path in paths:
+        if not path:
+            continue
+        stem = path[:-len(".part")] if path.endswith(".part") else path
+        for candidate in (path, f"{stem}.ytdl", *glob.glob(f"{glob.escape(path)}-Frag*")):
+            try:
+                os.remove(candidate)
+            except OSError:
+                pass
+
+def _remove_merge_leftovers(streams):
+    """Deletes the half-written output yt-dlp leaves next to the streams when FFmpeg fails (name.temp.ext)."""
+    for path in streams:
+        m = re.match(r"(.+)\.f[\w-]+\.\w+(\.part)?$", path or "")
+        if m:
+            for leftover in glob.glob(f"{glob.escape(m.group(1))}.temp.*"):
+                try:
+                    os.remove(leftover)
+                except OSError:
+                    pass
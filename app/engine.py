@@ -0,0 +1,585 @@
+"""
+Asyncio transfer engine.
+
+yt-dlp still extracts the video and picks the formats (plan_transfer, on the
+scheduler's planning pool), but the bytes are moved here: every transfer is a coroutine
+on the event loop sharing one pooled HTTP client, so a download costs a few
+buffers and a socket instead of a thread and a YoutubeDL of its own.
+
+Plain http(s) formats are streamed to a .part file (in ranged windows when
+yt-dlp would chunk them). DASH segment lists and unencrypted HLS playlists
+are fetched fragment by fragment, a few at a time, and written in order.
+File writes run on a small I/O pool and every chunk is written before the
+next one is read, which is the backpressure on the socket.
+
+Progress goes through the same progress_hook as yt-dlp's, so clients get
+the same download_status events. Anything the engine does not handle (live
+streams, encrypted HLS, other protocols), and any transfer that fails here,
+is handed to the threaded yt-dlp path instead.
+"""
+import asyncio
+import functools
+import importlib.util
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+# Optional (the threaded engine is used without it) and imported with the first client
+httpx = None
+
+from . import config, downloader, log
+from .bandwidth import host_of, shaper
+from .downloader import (
+    Stopped, attach_follower, check_stop, convert_audio, detach_followers, downloaded_status, finish_download,
+    get_ffmpeg_path, leave_flight, plan_transfer, prepare_download, progress_hook, progress_tracker,
+    refresh_metadata, set_status, stop_requested, stopped_status, update_status, _remove_files, _run_download,
+)
+from .metrics import FALLBACKS, STAGE_SECONDS
+from .retry import BACKOFF, MERGE_ONLY, REFRESH, RetryState
+
+CHUNK = 64 * 1024
+# Bytes buffered per transfer before a write is issued
+WRITE_BUFFER = 1024 * 1024
+FRAGMENT_RETRIES = 3
+
+
+class Unsupported(Exception):
+    """The engine cannot fetch this format; the yt-dlp path takes over."""
+
+
+def available():
+    return httpx is not None or importlib.util.find_spec("httpx") is not None
+
+
+def parse_m3u8(text, base_url):
+    """Fragment URLs of an HLS media playlist (init segment first). Raises Unsupported."""
+    if '#EXT-X-STREAM-INF' in text:
+        raise Unsupported("HLS master playlist")
+    if '#EXT-X-ENDLIST' not in text:
+        raise Unsupported("live HLS playlist")
+    urls = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-KEY') and 'METHOD=NONE' not in line:
+            raise Unsupported("encrypted HLS")
+        if line.startswith('#EXT-X-BYTERANGE'):
+            raise Unsupported("HLS byte ranges")
+        if line.startswith('#EXT-X-MAP'):
+            m = re.search(r'URI="([^"]+)"', line)
+            if not m or 'BYTERANGE' in line:
+                raise Unsupported("HLS init segment")
+            urls.insert(0, urljoin(base_url, m.group(1)))
+        elif line and not line.startswith('#'):
+            urls.append(urljoin(base_url, line))
+    return urls
+
+
+def dash_fragments(fmt):
+    base = fmt.get('fragment_base_url') or ''
+    return [f.get('url') or urljoin(base, f['path']) for f in fmt['fragments']]
+
+
+def is_supported(plan):
+    if plan["is_live"]:
+        return False
+    for fmt in plan["formats"]:
+        protocol = fmt.get('protocol') or ''
+        if not fmt.get('url'):
+            return False
+        if protocol == 'http_dash_segments':
+            if not fmt.get('fragments'):
+                return False
+        elif protocol not in ('http', 'https', 'm3u8', 'm3u8_native'):
+            return False
+    return True
+
+
+class _Writer:
+    """Buffered writes of one .part file, run on the engine's I/O pool."""
+
+    def __init__(self, path, pool, append=False):
+        self.path = path
+        self.pool = pool
+        self.append = append
+        self._file = None
+        self._buf = []
+        self._size = 0
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+
+    async def __aenter__(self):
+        self._file = await self._run(open, self.path, 'ab' if self.append else 'wb')
+        return self
+
+    async def __aexit__(self, *exc):
+        try:
+            if exc[0] is None:
+                await self.flush()
+        finally:
+            await self._run(self._file.close)
+
+    async def write(self, data):
+        self._buf.append(data)
+        self._size += len(data)
+        if self._size >= WRITE_BUFFER:
+            await self.flush()
+
+    async def flush(self):
+        if self._buf:
+            data = b''.join(self._buf)
+            self._buf, self._size = [], 0
+            await self._run(self._file.write, data)
+
+    async def truncate(self):
+        self._buf, self._size = [], 0
+        await self._run(self._file.truncate, 0)
+
+
+class TransferEngine:
+    """
+    Moves the bytes of planned downloads on the event loop.
+    One HTTP client (connection pool) is shared by every transfer.
+    """
+
+    def __init__(self, max_connections, io_threads=4):
+        self.max_connections = max_connections
+        self.io_threads = max(1, io_threads)
+        self.active = 0
+        self.fallbacks = 0
+        self._client = None
+        self._io_pool = None
+
+    @property
+    def io_pool(self):
+        # Made on first use (again after aclose())
+        if self._io_pool is None:
+            self._io_pool = ThreadPoolExecutor(self.io_threads, thread_name_prefix="engine-io")
+        return self._io_pool
+
+    @property
+    def client(self):
+        global httpx
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                follow_redirects=True,
+                timeout=httpx.Timeout(30.0, read=60.0),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    async def download(self, plan, task_id, resume=False, connections=None, pp_slots=None):
+        """Fetches every format of the plan and merges them. Returns the output path."""
+        filename = plan["filename"]
+        formats = plan["formats"]
+        if resume and os.path.exists(filename):
+            return filename
+        self.active += 1
+        try:
+            if len(formats) == 1:
+                await self.fetch(formats[0], filename, task_id, connections)
+                return filename
+            ffmpeg = get_ffmpeg_path()
+            if not ffmpeg:
+                raise Unsupported("merging needs FFmpeg")
+            base = os.path.splitext(filename)[0]
+            parts = []
+            # One after the other, like yt-dlp, so progress is reported per stream
+            for fmt in formats:
+                path = f"{base}.f{fmt['format_id']}.{fmt['ext']}"
+                if not (resume and os.path.exists(path)):
+                    await self.fetch(fmt, path, task_id, connections)
+                parts.append(path)
+        finally:
+            self.active -= 1
+        await self.merge(ffmpeg, formats, parts, filename, task_id, pp_slots)
+        return filename
+
+    async def fetch(self, fmt, path, task_id, connections=None):
+        """Downloads one format to `path` (through path.part)."""
+        tmp = path + ".part"
+        report = _Reporter(task_id, path, fmt)
+        protocol = fmt.get('protocol') or ''
+        if protocol in ('http', 'https'):
+            await self._fetch_http(fmt, tmp, report)
+        else:
+            if protocol == 'http_dash_segments':
+                urls = dash_fragments(fmt)
+            else:
+                resp = await self.client.get(fmt['url'], headers=fmt.get('http_headers') or {})
+                resp.raise_for_status()
+                urls = parse_m3u8(resp.text, str(resp.url))
+            await self._fetch_fragments(fmt, urls, tmp, report, connections or config.DOWNLOAD_CONNECTIONS)
+        await asyncio.get_running_loop().run_in_executor(self.io_pool, os.replace, tmp, path)
+        report.finished()
+
+    async def _fetch_http(self, fmt, tmp, report):
+        # Same window yt-dlp would use (YouTube throttles long single requests)
+        window = (fmt.get('downloader_options') or {}).get('http_chunk_size')
+        # Continue a .part file left by an interrupted run
+        pos = os.path.getsize(tmp) if os.path.exists(tmp) else 0
+        total = fmt.get('filesize')
+        async with _Writer(tmp, self.io_pool, append=pos > 0) as out:
+            while True:
+                headers = dict(fmt.get('http_headers') or {})
+                # Byte offsets must be those of the file, not of a compressed body
+                headers['Accept-Encoding'] = 'identity'
+                stop = pos + window - 1 if window else None
+                if pos or stop is not None:
+                    headers['Range'] = f"bytes={pos}-{'' if stop is None else stop}"
+                received = 0
+                async with self.client.stream('GET', fmt['url'], headers=headers) as resp:
+                    if resp.status_code == 416 and pos:
+                        # The .part file (or the last window) already ended at EOF
+                        break
+                    resp.raise_for_status()
+                    if pos and resp.status_code == 200:
+                        # Range ignored: start over
+                        await out.truncate()
+                        pos = 0
+                    total = _content_total(resp, pos) or total
+                    host = resp.url.host
+                    async for chunk in resp.aiter_bytes(CHUNK):
+                        await out.write(chunk)
+                        pos += len(chunk)
+                        received += len(chunk)
+                        report.progress(pos, total)
+                        await shaper.throttle(report.task_id, len(chunk), host)
+                if not window or received < window or (total and pos >= total):
+                    break
+
+    async def _fetch_fragments(self, fmt, urls, tmp, report, connections):
+        # Fragments are fetched `connections` at a time but written in order
+        headers = fmt.get('http_headers') or {}
+        estimate = fmt.get('filesize') or fmt.get('filesize_approx')
+        host = host_of(urls[0]) if urls else None
+        pending = deque()
+        queued = 0
+        written = 0
+        async with _Writer(tmp, self.io_pool) as out:
+            try:
+                while queued < len(urls) or pending:
+                    while queued < len(urls) and len(pending) < max(1, connections):
+                        pending.append(asyncio.ensure_future(self._fragment(urls[queued], headers)))
+                        queued += 1
+                    data = await pending.popleft()
+                    await out.write(data)
+                    written += len(data)
+                    index = queued - len(pending)
+                    report.progress(written, None, estimate or written * len(urls) // index,
+                                    fragment_index=index, fragment_count=len(urls))
+                    await shaper.throttle(report.task_id, len(data), host)
+            finally:
+                for task in pending:
+                    task.cancel()
+
+    async def _fragment(self, url, headers):
+        for attempt in range(FRAGMENT_RETRIES + 1):
+            try:
+                resp = await self.client.get(url, headers=headers)
+                resp.raise_for_status()
+                return resp.content
+            except httpx.HTTPError:
+                if attempt == FRAGMENT_RETRIES:
+                    raise
+                await asyncio.sleep(0.5 * (attempt + 1))
+
+    async def merge(self, ffmpeg, formats, parts, dest, task_id, pp_slots=None):
+        """Stream-copies the downloaded parts into `dest` (what yt-dlp's Merger does)."""
+        if pp_slots is not None and not pp_slots.acquire(blocking=False):
+            update_status(task_id, {"state": "converting", "message": "Waiting for a free converter..."})
+            with STAGE_SECONDS.time(stage="postprocess_wait"):
+                # Shared with the threaded path, so poll instead of parking a thread on it
+                while not pp_slots.acquire(blocking=False):
+                    check_stop(task_id)
+                    await asyncio.sleep(0.1)
+        try:
+            base, ext = os.path.splitext(dest)
+            tmp = f"{base}.temp{ext}"
+            cmd = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y']
+            for path in parts:
+                cmd += ['-i', path]
+            for i, fmt in enumerate(formats):
+                if fmt.get('vcodec') != 'none':
+                    cmd += ['-map', f'{i}:v:0']
+                if fmt.get('acodec') != 'none':
+                    cmd += ['-map', f'{i}:a:0']
+            cmd += ['-c', 'copy', tmp]
+            started = time.perf_counter()
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+            )
+            communicate = asyncio.ensure_future(proc.communicate())
+            while not (await asyncio.wait({communicate}, timeout=0.25))[0]:
+                if stop_requested(task_id):
+                    proc.kill()
+            _, err = communicate.result()
+            if proc.returncode != 0:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                check_stop(task_id)
+                raise RuntimeError(f"FFmpeg merge failed: {err.decode(errors='replace').strip()[-300:]}")
+            os.replace(tmp, dest)
+            for path in parts:
+                os.remove(path)
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="postprocess", detail="Merger")
+        finally:
+            if pp_slots is not None:
+                pp_slots.release()
+
+    def stats(self):
+        return {"available": available(), "active": self.active, "fallbacks": self.fallbacks,
+                "max_connections": self.max_connections}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._io_pool is not None:
+            self._io_pool.shutdown(wait=False)
+            self._io_pool = None
+
+
+class _Reporter:
+    """Builds yt-dlp style progress dicts for progress_hook."""
+
+    def __init__(self, task_id, filename, fmt):
+        self.task_id = task_id
+        self.filename = filename
+        self.fmt = fmt
+        self.started = time.monotonic()
+        self.first = None
+
+    def progress(self, downloaded, total, estimate=None, **fragments):
+        now = time.monotonic()
+        if self.first is None:
+            self.first = downloaded
+        elapsed = now - self.started
+        speed = (downloaded - self.first) / elapsed if elapsed > 0 else None
+        size = total or estimate
+        progress_hook({
+            'status': 'downloading',
+            'downloaded_bytes': downloaded,
+            'total_bytes': total,
+            'total_bytes_estimate': estimate,
+            'filename': self.filename,
+            'speed': speed,
+            'eta': round((size - downloaded) / speed) if speed and size and size > downloaded else None,
+            'info_dict': self.fmt,
+            **fragments,
+        }, self.task_id)
+
+    def finished(self):
+        progress_hook({'status': 'finished', 'filename': self.filename, 'info_dict': self.fmt}, self.task_id)
+
+
+def _content_total(resp, pos):
+    m = re.search(r'/(\d+)$', resp.headers.get('Content-Range') or '')
+    if m:
+        return int(m.group(1))
+    length = resp.headers.get('Content-Length')
+    if length and resp.status_code == 200:
+        return int(length)
+    return None
+
+
+# Result a cancelled leader leaves to its followers: one of them runs the work instead
+_LEADER_GONE = object()
+
+
+class AsyncSingleFlight:
+    """SingleFlight (downloader.py) for coroutines: followers await the leader's future."""
+
+    def __init__(self):
+        self._flights = {}
+
+    async def do(self, key, fn, *args, owner=None, on_join=None, check=None, **kwargs):
+        """
+        Returns (result, shared) where shared is True for attached callers.
+        If the leader is cancelled, the first follower to wake up runs fn
+        itself and the others attach to it, so each still gets a result.
+        """
+        while True:
+            flight = self._flights.get(key)
+            if flight is None:
+                break
+            leader_id, future = flight
+            if on_join:
+                on_join(leader_id)
+            if check is not None:
+                while not (await asyncio.wait({future}, timeout=0.25))[0]:
+                    check()
+            result = await asyncio.shield(future)
+            if result is not _LEADER_GONE:
+                return result, True
+
+        future = asyncio.get_running_loop().create_future()
+        self._flights[key] = (owner, future)
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            # Not cancelled for the followers: they get _LEADER_GONE and carry on
+            future.set_result(_LEADER_GONE)
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody may be waiting; do not warn about an unretrieved exception
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._flights[key]
+        return result, False
+
+    def in_flight(self):
+        return len(self._flights)
+
+
+engine = TransferEngine(config.ENGINE_MAX_CONNECTIONS, config.ENGINE_IO_THREADS)
+engine_flight = AsyncSingleFlight()
+
+
+async def run_download_async(url, format_id, task_id, download_path="Default", pp_slots=None,
+                             connections=None, resume=False, profile=None, on_downloaded=None,
+                             plan_pool=None, download_pool=None):
+    """
+    run_download on the async engine: same arguments, statuses and result.
+    `plan_pool` runs the yt-dlp format selection and re-extractions,
+    `download_pool` the blocking steps around the transfer (format lookup,
+    media store, journal, waiting on a conversion) and the threaded download
+    of whatever the engine cannot fetch.
+    """
+    loop = asyncio.get_running_loop()
+    job, final = await loop.run_in_executor(
+        download_pool, prepare_download, url, format_id, task_id, download_path, profile)
+    if final is not None:
+        return final
+    try:
+        final, shared = await engine_flight.do(
+            job["key"], _transfer_and_convert,
+            url, job["format_id"], task_id, job["base_folder"], job["cached_info"], connections, resume,
+            job["profile"], owner=task_id, on_join=lambda leader_id: attach_follower(task_id, leader_id),
+            check=lambda: check_stop(task_id), pp_slots=pp_slots, on_downloaded=on_downloaded,
+            plan_pool=plan_pool, download_pool=download_pool,
+        )
+    except Stopped as e:
+        # Only followers get here, the leader returns a stopped status
+        leave_flight(task_id)
+        final, shared = stopped_status(e.action), True
+    finally:
+        detach_followers(task_id)
+    return await loop.run_in_executor(download_pool, finish_download, task_id, final, job["store_key"], shared)
+
+
+async def _transfer_and_convert(url, format_id, task_id, base_folder, cached_info, connections, resume,
+                                profile, pp_slots=None, on_downloaded=None, plan_pool=None, download_pool=None):
+    loop = asyncio.get_running_loop()
+    set_status(task_id, {
+        "state": "starting",
+        "message": "Resuming..." if resume else "Initializing...",
+    })
+    plan = stale = None
+    # The fallback to the chosen format alone is left to yt-dlp
+    retries = RetryState(merging=False)
+    retry = None
+    fallback = None
+    try:
+        while True:
+            try:
+                if retry is not None:
+                    step, delay = retry
+                    # Finished streams are kept and .part files continued
+                    resume = True
+                    if delay:
+                        await _wait_before_retry(task_id, delay, f"Retrying in {delay:.1f}s ({retries.kind})...")
+                    if step == REFRESH:
+                        update_status(task_id, {"state": "starting", "message": "Refreshing expired links..."})
+                        cached_info = await loop.run_in_executor(plan_pool, refresh_metadata, url)
+                        stale, plan = plan, None
+                    elif step == MERGE_ONLY:
+                        # Same streams (still on disk), into the container that takes any codec
+                        plan = {**plan, "filename": os.path.splitext(plan["filename"])[0] + ".mkv"}
+                if plan is None:
+                    plan = await loop.run_in_executor(
+                        plan_pool, downloader.run_heavy, plan_transfer,
+                        url, format_id, task_id, base_folder, cached_info, profile,
+                    )
+                    if stale is not None and stale["filename"] != plan["filename"]:
+                        _remove_parts(stale)
+                    if not is_supported(plan):
+                        raise Unsupported(", ".join(sorted({f.get('protocol') or '?' for f in plan["formats"]})))
+                path = await engine.download(plan, task_id, resume, connections, pp_slots)
+                final = downloaded_status(path, plan, task_id, profile)
+                set_status(task_id, final)
+                break
+            except Stopped as e:
+                # No retry or yt-dlp fallback: the job was asked to stop. A paused one keeps its .part files
+                log.info("Download stopped", task_id=task_id, action=e.action)
+                final = stopped_status(e.action)
+                if e.action == "cancel" and plan is not None:
+                    _remove_parts(plan, streams=True)
+                set_status(task_id, final)
+                break
+            except Unsupported as e:
+                log.debug(f"Async engine skipped: {e}", task_id=task_id)
+                FALLBACKS.inc(kind="engine_unsupported")
+                fallback = e
+                break
+            except Exception as e:
+                retry = retries.next_step(e, plan)
+                if retry is not None and retry[0] in (BACKOFF, REFRESH, MERGE_ONLY):
+                    log.warning(f"Async transfer failed ({retries.kind}), next: {retry[0]}", task_id=task_id, error=e)
+                    continue
+                log.warning("Async transfer failed, using yt-dlp", task_id=task_id, error=e)
+                FALLBACKS.inc(kind="engine_error")
+                fallback = e
+                break
+
+        if fallback is not None:
+            # yt-dlp does the whole job instead (and has its own retries)
+            engine.fallbacks += 1
+            if plan is not None:
+                _remove_parts(plan)
+            final = await loop.run_in_executor(download_pool, functools.partial(
+                downloader.run_heavy, _run_download,
+                url, format_id, task_id, base_folder, cached_info, connections, resume,
+                profile=profile, pp_slots=pp_slots,
+            ))
+    finally:
+        progress_tracker.forget(task_id)
+
+    if on_downloaded is not None:
+        on_downloaded()
+    if final.get("state") == "converting":
+        # Waits on the transcode pool, from a download pool thread like the threaded path
+        final = await loop.run_in_executor(download_pool, convert_audio, task_id, final, profile)
+    return final
+
+
+async def _wait_before_retry(task_id, delay, message):
+    """Backoff sleep that still notices a stop request."""
+    update_status(task_id, {"state": "starting", "message": message})
+    deadline = time.monotonic() + delay
+    while True:
+        check_stop(task_id)
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return
+        await asyncio.sleep(min(0.25, left))
+
+
+def _remove_parts(plan, streams=False):
+    """Deletes the .part files of a plan, and with `streams` the finished streams waiting for a merge."""
+    base = os.path.splitext(plan["filename"])[0]
+    paths = [plan["filename"] + ".part"]
+    for f in plan["formats"]:
+        path = f"{base}.f{f['format_id']}.{f['ext']}"
+        paths += [path + ".part", path] if streams else [path + ".part"]
+    _remove_files(paths)
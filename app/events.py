@@ -0,0 +1,180 @@
+import asyncio
+import threading
+import time
+
+FINAL_STATES = ("completed", "error", "cancelled")
+
+
+class Subscription:
+    """
+    One consumer of a task's status changes.
+    Changed fields are merged into a pending dict, so a slow consumer gets
+    one combined delta instead of a backlog of stale intermediate frames.
+    """
+
+    def __init__(self, bus, task_id, coalesce):
+        self.bus = bus
+        self.task_id = task_id
+        self.coalesce = coalesce
+        self.pending = {}
+        self.finished = False
+        self._wakeup = asyncio.Event()
+
+    def push(self, delta):
+        self.pending.update(delta)
+        if delta.get("state") in FINAL_STATES:
+            self.finished = True
+        self._wakeup.set()
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.pending and self.finished:
+            self.close()
+            raise StopAsyncIteration
+        await self._wakeup.wait()
+        # Throttle: let more changes pile up before flushing (final states go out at once)
+        if self.coalesce and not self.finished:
+            await asyncio.sleep(self.coalesce)
+        delta, self.pending = self.pending, {}
+        self._wakeup.clear()
+        return delta
+
+
+class EventBus:
+    """
+    Push-based task status channel.
+    Worker threads publish through loop.call_soon_threadsafe, so the shared
+    `status` dict is only mutated on the event loop once it is bound.
+    Subscribers receive only the fields that actually changed.
+    Entries are dropped `finished_ttl` seconds after they complete and after
+    `max_age` seconds without any update, so abandoned tasks do not leak.
+    With a shared job store (store.py) local changes also go to `replicate`
+    and the other nodes' changes come in through publish_remote.
+    """
+
+    def __init__(self, status, coalesce=0.2, finished_ttl=60, max_age=6 * 3600):
+        self.status = status
+        self.coalesce = coalesce
+        self.finished_ttl = finished_ttl
+        self.max_age = max_age
+        self.loop = None
+        self._loop_thread = None
+        self._subscribers = {}  # task_id -> set of Subscription
+        self._touched = {}      # task_id -> monotonic time of the last update
+        self._reaper = None
+        # Set by a shared job store (see store.py): called with every local change
+        self.replicate = None
+
+    def bind(self, loop):
+        """Attaches the bus to the running event loop and starts the reaper."""
+        self.loop = loop
+        self._loop_thread = threading.get_ident()
+        self._reaper = loop.create_task(self._reap_forever())
+
+    async def close(self):
+        if self._reaper:
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+        self.loop = None
+
+    def publish(self, task_id, fields, replace=False):
+        """
+        Records a status change for a task. Thread-safe.
+        replace=True starts a fresh entry, otherwise fields are merged into the
+        existing entry (and ignored if the task is no longer tracked).
+        """
+        if self.replicate is not None:
+            self.replicate(task_id, fields, replace)
+        self._dispatch(self._apply, task_id, fields, replace)
+
+    def publish_remote(self, task_id, fields, replace=False):
+        """
+        A change another node published (see store.py). Thread-safe, not
+        replicated again, and only kept for tasks this node tracks or someone
+        here is subscribed to.
+        """
+        self._dispatch(self._apply_remote, task_id, fields, replace)
+
+    def _dispatch(self, apply, task_id, fields, replace):
+        loop = self.loop
+        if loop is None or threading.get_ident() == self._loop_thread:
+            apply(task_id, fields, replace)
+        else:
+            try:
+                loop.call_soon_threadsafe(apply, task_id, dict(fields), replace)
+            except RuntimeError:
+                # Loop already closed (shutdown), nobody is listening anyway
+                pass
+
+    def subscribe(self, task_id):
+        """Returns an async iterator of deltas, starting with the full current status."""
+        sub = Subscription(self, task_id, self.coalesce)
+        self._subscribers.setdefault(task_id, set()).add(sub)
+        if task_id in self.status:
+            sub.push(dict(self.status[task_id]))
+        return sub
+
+    def stats(self):
+        return {
+            "tracked": len(self.status),
+            "subscribers": sum(len(subs) for subs in self._subscribers.values()),
+        }
+
+    def unsubscribe(self, sub):
+        subs = self._subscribers.get(sub.task_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subscribers[sub.task_id]
+
+    def _apply_remote(self, task_id, fields, replace):
+        if task_id in self.status or task_id in self._subscribers:
+            self._apply(task_id, fields, replace)
+
+    def _apply(self, task_id, fields, replace):
+        if replace:
+            # Keys that disappear are sent as None so merged client state stays exact
+            previous = self.status.get(task_id, {})
+            delta = {k: None for k, v in previous.items() if k not in fields and v is not None}
+            delta.update(fields)
+            self.status[task_id] = dict(fields)
+        else:
+            current = self.status.get(task_id)
+            if current is None:
+                return
+            delta = {k: v for k, v in fields.items() if current.get(k) != v}
+            if not delta:
+                return
+            current.update(delta)
+
+        self._touched[task_id] = time.monotonic()
+        for sub in tuple(self._subscribers.get(task_id, ())):
+            sub.push(delta)
+
+    def reap(self):
+        """Drops finished entries past finished_ttl and idle ones past max_age."""
+        now = time.monotonic()
+        for task_id in list(self.status):
+            touched = self._touched.get(task_id)
+            if touched is None:
+                # Written directly to the dict, start its clock now
+                self._touched[task_id] = now
+                continue
+            age = now - touched
+            final = self.status[task_id].get("state") in FINAL_STATES
+            if (final and age > self.finished_ttl) or age > self.max_age:
+                del self.status[task_id]
+                del self._touched[task_id]
+        for task_id in list(self._touched):
+            if task_id not in self.status:
+                del self._touched[task_id]
+
+    async def _reap_forever(self):
+        while True:
+            await asyncio.sleep(max(1, min(self.finished_ttl, 30)))
+            self.reap()
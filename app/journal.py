@@ -0,0 +1,148 @@
+import os
+import sqlite3
+import threading
+import time
+
+UNFINISHED_STATES = ("queued", "running", "paused")
+_UNFINISHED = ", ".join("?" * len(UNFINISHED_STATES))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    task_id          TEXT PRIMARY KEY,
+    url              TEXT NOT NULL,
+    format_id        TEXT NOT NULL,
+    download_path    TEXT NOT NULL,
+    priority         INTEGER NOT NULL DEFAULT 10,
+    connections      INTEGER,
+    profile          TEXT,
+    state            TEXT NOT NULL,
+    output_folder    TEXT,
+    file_path        TEXT,
+    downloaded_bytes INTEGER NOT NULL DEFAULT 0,
+    total_bytes      INTEGER,
+    error            TEXT,
+    attempts         INTEGER NOT NULL DEFAULT 0,
+    created_at       REAL NOT NULL,
+    updated_at       REAL NOT NULL
+)
+"""
+
+
+class JobJournal:
+    """
+    Persistent record of download jobs (SQLite, WAL mode).
+    Survives restarts so unfinished jobs can be resumed from their .part files.
+    Nothing is kept, and every call is a no-op, until open() is called
+    (the app's startup hook does it), or when path is None.
+    """
+
+    def __init__(self, path, progress_interval=2.0):
+        self.path = path
+        self.progress_interval = progress_interval
+        self._lock = threading.Lock()
+        self._last_progress = {}
+        self._db = None
+
+    def open(self):
+        """Opens (creates) the database file. Does nothing without a path or when already open."""
+        if not self.path or self._db is not None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(_SCHEMA)
+        self._db = db
+        self._migrate()
+
+    def _migrate(self):
+        # Columns added after the first release
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "profile" not in columns:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN profile TEXT")
+
+    @property
+    def enabled(self):
+        return self._db is not None
+
+    def _execute(self, sql, params=()):
+        if self._db is None:
+            return []
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def record_queued(self, task_id, url, format_id, download_path, priority, connections=None, profile=None):
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (task_id, url, format_id, download_path, priority, connections, profile,"
+            " state, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?)"
+            " ON CONFLICT(task_id) DO UPDATE SET state='queued', updated_at=excluded.updated_at",
+            (task_id, url, format_id, download_path, priority, connections, profile, now, now),
+        )
+
+    def mark_running(self, task_id, output_folder):
+        self._execute(
+            "UPDATE jobs SET state='running', output_folder=?, attempts=attempts+1,"
+            " updated_at=? WHERE task_id=?",
+            (output_folder, time.time(), task_id),
+        )
+
+    def progress(self, task_id, downloaded_bytes, total_bytes):
+        """Byte progress, written at most once per progress_interval per task."""
+        if self._db is None:
+            return
+        now = time.monotonic()
+        if now - self._last_progress.get(task_id, 0) < self.progress_interval:
+            return
+        self._last_progress[task_id] = now
+        self._execute(
+            "UPDATE jobs SET downloaded_bytes=?, total_bytes=?, updated_at=? WHERE task_id=?",
+            (downloaded_bytes, total_bytes, time.time(), task_id),
+        )
+
+    def set_priority(self, task_id, priority):
+        self._execute("UPDATE jobs SET priority=?, updated_at=? WHERE task_id=?", (priority, time.time(), task_id))
+
+    def finish(self, task_id, status):
+        self._last_progress.pop(task_id, None)
+        self._execute(
+            "UPDATE jobs SET state=?, file_path=?, error=?, updated_at=? WHERE task_id=?",
+            (
+                status.get("state", "error"),
+                status.get("file_path"),
+                status.get("message") if status.get("state") == "error" else None,
+                time.time(),
+                task_id,
+            ),
+        )
+
+    def unfinished(self):
+        """Jobs that were queued, running or paused when the server stopped, oldest first."""
+        rows = self._execute(
+            f"SELECT * FROM jobs WHERE state IN ({_UNFINISHED}) ORDER BY created_at",
+            UNFINISHED_STATES,
+        )
+        return [dict(r) for r in rows]
+
+    def get(self, task_id):
+        rows = self._execute("SELECT * FROM jobs WHERE task_id=?", (task_id,))
+        return dict(rows[0]) if rows else None
+
+    def recent(self, limit=100):
+        rows = self._execute("SELECT * FROM jobs ORDER BY updated_at DESC LIMIT ?", (limit,))
+        return [dict(r) for r in rows]
+
+    def prune(self, max_age_days):
+        """Drops finished jobs older than max_age_days."""
+        cutoff = time.time() - max_age_days * 86400
+        self._execute(
+            f"DELETE FROM jobs WHERE state NOT IN ({_UNFINISHED}) AND updated_at < ?",
+            (*UNFINISHED_STATES, cutoff),
+        )
+
+    def close(self):
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+            self._db = None
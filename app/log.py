@@ -0,0 +1,51 @@
+"""
+Tiny logging helper used instead of bare print().
+Text mode keeps the familiar "[LEVEL] message" lines; INFINITY_LOG_FORMAT=json
+emits one JSON object per line with any extra fields attached.
+"""
+import json
+import sys
+import time
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+_threshold = None
+_json = False
+
+
+def _load_settings():
+    # Read on first use, not at import: config itself logs bad settings through here
+    global _threshold, _json
+    from . import config
+    _threshold = LEVELS.get(config.LOG_LEVEL.lower(), 10)
+    _json = config.LOG_FORMAT.lower() == "json"
+
+
+def log(level, message, **fields):
+    if _threshold is None:
+        _load_settings()
+    if LEVELS.get(level, 20) < _threshold:
+        return
+    if _json:
+        record = {"ts": round(time.time(), 3), "level": level, "msg": message}
+        record.update(fields)
+        line = json.dumps(record, default=str)
+    else:
+        extra = " ".join(f"{k}={v}" for k, v in fields.items())
+        line = f"[{level.upper()}] {message}" + (f" ({extra})" if extra else "")
+    print(line, file=sys.stdout, flush=True)
+
+
+def debug(message, **fields):
+    log("debug", message, **fields)
+
+
+def info(message, **fields):
+    log("info", message, **fields)
+
+
+def warning(message, **fields):
+    log("warning", message, **fields)
+
+
+def error(message, **fields):
+    log("error", message, **fields)
@@ -1,16 +1,62 @@
-from fastapi import FastAPI, WebSocket
+import time
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
 import asyncio
+import json
 import uuid
 import shutil
 import os
 import sys
 import subprocess
-from .downloader import run_download, download_status
+from .downloader import metadata_cache, status_bus, progress_tracker, job_journal, job_store, ydl_pool, \
+    media_store, get_ffmpeg_path, warm_up
+from . import config, log
+from .metrics import registry, WS_MESSAGES
+from .scheduler import CONTROL_ACTIONS, DownloadScheduler
+from .batch import run_batch
+from .postprocess import AUDIO_PROFILES, VIDEO_PROFILES, probe, transcoder
+from .streaming import open_stream, StreamError
+from .engine import engine
+from .bandwidth import shaper
+from .startup import report as startup_report
+from .ws_protocol import Channel, compact_info
+
+startup_report.record("import", time.perf_counter() - _import_started)
 
 app = FastAPI()
+scheduler = DownloadScheduler()
+
+# Close codes of a server going down (uvicorn closes sockets with 1012 before the shutdown hook runs):
+# the downloads of such a socket are left to the journal, not cancelled
+RESTART_CLOSE_CODES = (1001, 1012)
+
+# Gauges are computed when /metrics is scraped, so they cost nothing in between
+registry.gauge("infinity_queue_depth", "Downloads waiting for a slot",
+               fn=lambda: scheduler.stats()["queued"])
+registry.gauge("infinity_active_downloads", "Downloads currently running",
+               fn=lambda: len(scheduler.active))
+registry.gauge("infinity_pool_saturation", "Busy share of each worker pool (0-1)", ("pool",),
+               fn=lambda: {
+                   "download": len(scheduler.active) / scheduler.max_downloads,
+                   "metadata": min(1.0, scheduler.metadata_active / scheduler.max_metadata),
+               })
+registry.gauge("infinity_bytes_downloaded", "Bytes downloaded since startup",
+               fn=lambda: progress_tracker.server.total)
+registry.gauge("infinity_throughput_bytes", "Smoothed server-wide download rate (bytes/s)",
+               fn=lambda: round(progress_tracker.server.current()))
+registry.gauge("infinity_metadata_cache", "Metadata cache counters", ("kind",),
+               fn=lambda: {k: v for k, v in metadata_cache.stats().items() if isinstance(v, (int, float))})
+registry.gauge("infinity_media_store", "Media store counters", ("kind",),
+               fn=lambda: {k: v for k, v in media_store.stats().items() if k != "enabled"})
+registry.gauge("infinity_engine_transfers", "Transfers running on the async engine",
+               fn=lambda: engine.active)
+registry.gauge("infinity_ws_subscribers", "Open status subscriptions",
+               fn=lambda: status_bus.stats()["subscribers"])
+registry.gauge("infinity_startup_seconds", "Time spent importing, starting and warming up", ("phase",),
+               fn=lambda: dict(startup_report.phases))
 
 # Mount static folder
 base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -20,20 +66,233 @@ app.mount("/static", StaticFiles(directory=static_path), name="static")
 @app.on_event("startup")
 async def startup_check():
     """Checks if FFmpeg is available."""
+    started = time.perf_counter()
     system_ffmpeg = shutil.which("ffmpeg")
     current_dir = os.path.dirname(os.path.abspath(__file__)) 
     project_root = os.path.dirname(current_dir) 
     local_ffmpeg = os.path.join(project_root, 'bin', 'ffmpeg.exe')
 
     if not system_ffmpeg and not os.path.exists(local_ffmpeg):
-        print("WARNING: FFmpeg NOT FOUND. Conversions will fail.")
+        log.warning("FFmpeg NOT FOUND. Conversions will fail.")
     else:
-        print(f"[OK] FFmpeg detected.")
+        log.info("FFmpeg detected.")
+
+    # Opened here rather than on import, so worker processes and tools importing the app create no files
+    job_journal.open()
+    media_store.open()
+    status_bus.bind(asyncio.get_running_loop())
+    job_store.start(status_bus)
+    if job_store.shared:
+        log.info(f"Sharing the job queue through the {job_store.name} store as {job_store.node}.")
+    await scheduler.start()
+    stats = scheduler.stats()
+    log.info(f"Scheduler ready ({stats['backend']} backend, {stats['engine']} engine): {stats['max_downloads']} downloads, "
+             f"{stats['max_postprocess']} mergers, {stats['max_transcode']} converters, "
+             f"{stats['max_metadata']} metadata workers.")
+
+    # Import yt-dlp and build its instances in the background so the first request skips their setup
+    if config.YDL_POOL_WARM > 0 or config.WARMUP_URL:
+        asyncio.get_running_loop().run_in_executor(
+            scheduler.metadata_pool, warm_up, config.YDL_POOL_WARM, config.WARMUP_URL)
+
+    # Pick up downloads interrupted by the last shutdown
+    if job_journal.enabled:
+        job_journal.prune(config.JOURNAL_KEEP_DAYS)
+        resumed = scheduler.resume_unfinished()
+        if resumed:
+            log.info(f"Resuming {len(resumed)} unfinished download(s).")
+
+    startup_report.record("startup", time.perf_counter() - started)
+    ready = startup_report.since_launch()
+    if ready is not None:
+        startup_report.record("ready", ready)
+    log.info(f"Started in {config.ENVIRONMENT} mode ({startup_report.summary()}).")
+
+@app.on_event("shutdown")
+async def shutdown_scheduler():
+    await scheduler.stop()
+    job_store.close()
+    await status_bus.close()
+    job_journal.close()
+    media_store.close()
+    transcoder.close()
+    ydl_pool.close()
 
 @app.get("/")
 async def read_root():
     return FileResponse(os.path.join(static_path, 'index.html'))
 
+@app.get("/api/queue")
+async def queue_stats():
+    """Current scheduler load (queued / active jobs and limits) and the job store."""
+    return scheduler.stats()
+
+@app.get("/api/tasks/{task_id}")
+async def task_status(task_id: str):
+    """Last known status of a task, whichever server process runs it."""
+    status = status_bus.status.get(task_id) or job_store.snapshot(task_id)
+    if status is None:
+        return {"status": "error", "message": "Unknown task"}
+    return {"task_id": task_id, **status}
+
+@app.post("/api/tasks/{task_id}")
+async def task_control(task_id: str, payload: dict):
+    """
+    Controls a task: {"action": "cancel" | "pause" | "resume" | "reprioritize"},
+    reprioritize takes "priority" (queued jobs) and/or "weight" (bandwidth share).
+    """
+    return scheduler.control(task_id, payload.get("action"), payload.get("priority"), payload.get("weight"))
+
+@app.get("/api/cache")
+async def cache_stats():
+    """Metadata cache hit/miss counters."""
+    return metadata_cache.stats()
+
+@app.get("/api/pool")
+async def pool_stats():
+    """Pooled yt-dlp instances: created, reused and idle per profile."""
+    return ydl_pool.stats()
+
+@app.get("/api/engine")
+async def engine_stats():
+    """Async transfer engine: running transfers and fallbacks to yt-dlp."""
+    return {"engine": scheduler.engine_name, **engine.stats()}
+
+@app.get("/api/bandwidth")
+async def bandwidth_stats():
+    """Bandwidth limits, overrides and the rate each running job currently gets."""
+    return shaper.stats()
+
+@app.post("/api/bandwidth")
+async def bandwidth_update(payload: dict):
+    """
+    Changes limits at runtime (bytes/s or "8M", null/0 = unlimited), e.g.
+    {"global": "50M", "per_client": "10M", "hosts": {"example.com": "2M"},
+     "tasks": {"<task_id>": {"rate": "1M", "weight": 3}}}
+    """
+    try:
+        return {"status": "success", **shaper.configure(payload)}
+    except (ValueError, TypeError, AttributeError) as e:
+        return {"status": "error", "message": str(e)}
+
+@app.get("/api/startup")
+async def startup_stats():
+    """Import, startup and warm-up durations, and which heavy modules are loaded yet."""
+    return startup_report.stats()
+
+@app.get("/api/store")
+async def store_stats():
+    """Media store size, entries and hit/miss counters."""
+    return media_store.stats()
+
+@app.get("/api/ffmpeg")
+def ffmpeg_info():
+    """Probed FFmpeg capabilities, post-processing profiles and transcode pool load."""
+    return {
+        "capabilities": probe(get_ffmpeg_path()),
+        "profiles": {
+            "audio": {name: {"codec": c, "bitrate": b} for name, (c, b) in AUDIO_PROFILES.items()},
+            "video": VIDEO_PROFILES,
+            "default_audio": config.AUDIO_PROFILE,
+            "default_video": config.VIDEO_PROFILE,
+        },
+        "transcoder": transcoder.stats(),
+    }
+
+@app.get("/api/jobs")
+async def list_jobs(limit: int = 100):
+    """Most recent jobs from the persistent journal."""
+    return {"jobs": job_journal.recent(limit)}
+
+@app.get("/api/throughput")
+async def throughput_stats():
+    """Smoothed download throughput (bytes/s) per task and for the whole server."""
+    return progress_tracker.snapshot()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text format: stage timings, counters and load gauges."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/api/batch")
+async def batch_download(payload: dict, request: Request):
+    """
+    Downloads a playlist/channel (`url`) or a list of URLs (`urls`).
+    Streams newline-delimited JSON: item metadata, progress deltas, then 'batch_done'.
+    """
+    source = payload.get("urls") or payload.get("url")
+    if not source:
+        return {"status": "error", "message": "No URL provided"}
+
+    events = asyncio.Queue()
+
+    async def emit(event):
+        await events.put(event)
+
+    async def produce():
+        try:
+            await run_batch(
+                scheduler, source, emit,
+                format_id=payload.get("format_id", "best"),
+                download_path=payload.get("download_path", "Default"),
+                priority=payload.get("priority", "low"),
+                fan_out=payload.get("fan_out"),
+                profile=payload.get("profile"),
+                client=f"http:{request.client.host}" if request.client else None,
+                cancel_on_exit=bool(payload.get("cancel_on_disconnect", config.CANCEL_ON_DISCONNECT)),
+            )
+        except Exception as e:
+            await events.put({"status": "error", "message": str(e)})
+        finally:
+            await events.put(None)
+
+    async def stream():
+        task = asyncio.create_task(produce())
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield json.dumps(event) + "\n"
+        finally:
+            task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.get("/api/formats/query")
+async def format_query(url: str, q: str, limit: int = 5):
+    """
+    Best formats of a video for a catalog query, e.g.
+    q=video:height<=1080,vcodec=avc,size<=50M or q=audio:acodec=opus
+    """
+    return (await scheduler.query_formats([url], q, limit))[0]
+
+@app.post("/api/formats/query")
+async def format_query_bulk(payload: dict):
+    """Same query over a list of URLs: {"urls": [...], "q": "...", "limit": 1}."""
+    urls = payload.get("urls") or []
+    if not urls or not payload.get("q"):
+        return {"status": "error", "message": "urls and q are required"}
+    results = await scheduler.query_formats(urls, payload["q"], payload.get("limit", 1))
+    return {"status": "success", "results": results}
+
+@app.get("/api/stream/{video_id}")
+async def stream_media(video_id: str, request: Request, format_id: str = "best", url: str = None):
+    """
+    Sends the media to the client as it downloads, nothing is written on the server.
+    `video_id` is a YouTube id; other sites pass the page as `url`.
+    Single-stream formats support Range; merged video+audio comes as fragmented MP4.
+    """
+    try:
+        status, headers, body = await open_stream(
+            asyncio.get_running_loop(), video_id, format_id, url, request.headers.get("range"))
+    except StreamError as e:
+        return PlainTextResponse(str(e), status_code=e.status, headers=e.headers)
+    except Exception as e:
+        log.error(f"Stream Error: {e}")
+        return PlainTextResponse(str(e), status_code=502)
+    return StreamingResponse(body, status_code=status, headers=headers)
+
 @app.get("/api/choose-path")
 def choose_path():
     """
@@ -57,7 +316,7 @@ def choose_path():
                 if result.returncode == 0:
                     path = result.stdout.strip()
             except Exception as e:
-                print(f"Zenity failed: {e}")
+                log.warning(f"Zenity failed: {e}")
 
         # Fallback to existing methods ONLY if Zenity is missing
         # (If Zenity was used but user cancelled, we do NOT want to open the old dialog)
@@ -100,10 +359,10 @@ except Exception as e:
                 
                 # Print stderr to console for debugging, but don't include it in 'path'
                 if proc.stderr:
-                    print(f"[DEBUG] Picker stderr: {proc.stderr.strip()}")
+                    log.debug(f"Picker stderr: {proc.stderr.strip()}")
                     
                 path = proc.stdout.strip()
-                print(f"[DEBUG] Folder selected: {path}")
+                log.debug(f"Folder selected: {path}")
 
             else:
                 # --- MAC/LINUX STRATEGY: Python Tkinter ---
@@ -136,75 +395,167 @@ except: pass
             return {"path": "Default"}
             
     except Exception as e:
-        print(f"Dialog Error: {e}")
+        log.error(f"Dialog Error: {e}")
         return {"path": "Default"}
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    # We maintain tasks here if we want to cancel them, but for now simple handling
-    active_tasks = [] 
+    # Classic JSON messages, or the compact batched protocol after a hello (see ws_protocol.py)
+    channel = Channel(websocket)
+    # Downloads cancelled when this socket closes (unless sent with "cancel_on_disconnect": false)
+    owned = set()
+    close_code = None
+    monitors = set()
+    watching = set()
+    # Bandwidth is shared fairly between connections (see bandwidth.py)
+    client_id = f"ws:{uuid.uuid4().hex[:8]}"
+
+    async def monitor_download(sub):
+        # Only changed fields are sent, tagged with the task id
+        try:
+            async for delta in sub:
+                await channel.update(sub.task_id, delta)
+        except Exception:
+            pass
+        finally:
+            sub.close()
+
+    def follow(task_id):
+        sub = status_bus.subscribe(task_id)
+        if channel.compact:
+            # The channel batches frames itself
+            sub.coalesce = 0
+        monitor = asyncio.create_task(monitor_download(sub))
+        monitors.add(monitor)
+        watching.add(task_id)
+        monitor.add_done_callback(monitors.discard)
+        monitor.add_done_callback(lambda _: watching.discard(task_id))
     
     try:
         while True:
             # Wait for any message from the client
-            data = await websocket.receive_json()
+            data = await channel.receive()
             action = data.get("action", "download")
-            
-            if action == "fetch_info":
+            WS_MESSAGES.inc(direction="in", action=action)
+
+            if action == "hello":
+                # --- PROTOCOL NEGOTIATION (the reply is always JSON text) ---
+                await websocket.send_json(channel.negotiate(data))
+
+            elif action == "fetch_info":
                 # --- FETCH MODES ---
-                await websocket.send_json({"state": "fetching", "message": "Analyzing URL..."})
-                
-                # Import here to avoid circular dependency issues if any
-                from .downloader import fetch_formats
+                await channel.send({"state": "fetching", "message": "Analyzing URL..."})
                 
                 url = data.get("url")
                 if not url:
-                    await websocket.send_json({"status": "error", "message": "No URL provided"})
+                    await channel.send({"status": "error", "message": "No URL provided"})
                     continue
 
-                result = await run_in_threadpool(fetch_formats, url)
-                await websocket.send_json(result)
+                result = await scheduler.fetch_info(url)
+                await channel.send(compact_info(result) if channel.compact else result)
                 
+            elif action == "batch":
+                # --- PLAYLIST / MULTI-URL MODE ---
+                source = data.get("urls") or data.get("url")
+                if not source:
+                    await channel.send({"status": "error", "message": "No URL provided"})
+                    continue
+
+                async def batch_runner(payload):
+                    # Its items are owned by this socket, released with the others when it closes
+                    owns = payload.get("cancel_on_disconnect", config.CANCEL_ON_DISCONNECT)
+                    try:
+                        await run_batch(
+                            scheduler, source, channel.emit,
+                            format_id=payload.get("format_id", "best"),
+                            download_path=payload.get("download_path", "Default"),
+                            priority=payload.get("priority", "low"),
+                            fan_out=payload.get("fan_out"),
+                            profile=payload.get("profile"),
+                            client=client_id,
+                            on_submit=owned.add if owns else None,
+                        )
+                    except Exception as e:
+                        log.error(f"Batch Error: {e}")
+
+                # Runs in the background so this socket keeps accepting messages
+                runner = asyncio.create_task(batch_runner(data))
+                monitors.add(runner)
+                runner.add_done_callback(monitors.discard)
+
             elif action == "download":
                 # --- DOWNLOAD MODE ---
                 url = data.get("url")
                 format_id = data.get("format_id", "best") 
                 dl_path = data.get("download_path", "Default")
+                priority = data.get("priority", "normal")
+                profile = data.get("profile")
+                try:
+                    connections = int(data.get("connections") or 0) or None
+                except (TypeError, ValueError):
+                    connections = None
+                try:
+                    weight = float(data.get("weight") or 0) or None
+                except (TypeError, ValueError):
+                    weight = None
                 
                 task_id = str(uuid.uuid4())
                 
-                # Start download in a separate task so we don't block the loop
-                # However, we also want to send status updates.
-                # The original code had a while loop monitoring 'download_status'.
-                # We can launch a monitor task effectively.
-                
-                async def monitor_download(tid):
-                    while True:
-                        if tid in download_status:
-                            current_status = download_status[tid]
-                            try:
-                                await websocket.send_json(current_status)
-                            except:
-                                break
-                            if current_status["state"] in ["completed", "error"]:
-                                break
-                        await asyncio.sleep(0.2)
-                    # Cleanup
-                    if tid in download_status:
-                        del download_status[tid]
-
-                # 1. Start the actual download
-                asyncio.create_task(
-                    run_in_threadpool(run_download, url, format_id, task_id, dl_path)
-                )
-                
-                # 2. Start the monitor
-                asyncio.create_task(monitor_download(task_id))
+                # The scheduler runs the download when a slot frees up (in this
+                # process or another one); meanwhile the monitor pushes status changes to the client.
+
+                # 1. Subscribe first so no update is missed
+                follow(task_id)
 
+                # 2. Queue the actual download
+                scheduler.submit(task_id, url, format_id, dl_path, priority, connections, profile=profile,
+                                 client=client_id, weight=weight)
+                if data.get("cancel_on_disconnect", config.CANCEL_ON_DISCONNECT):
+                    owned.add(task_id)
+
+            elif action in CONTROL_ACTIONS:
+                # --- CANCEL / PAUSE / RESUME / REPRIORITIZE ---
+                task_id = data.get("task_id")
+                result = scheduler.control(task_id, action, data.get("priority"), data.get("weight"))
+                await channel.send({**result, "action": action})
+                if action == "resume" and result["status"] == "success" and task_id not in watching:
+                    # e.g. paused from another connection
+                    follow(task_id)
+
+            elif action == "watch":
+                # --- FOLLOW AN EXISTING TASK (e.g. after reconnecting to another server process) ---
+                task_id = data.get("task_id")
+                if scheduler.adopt(task_id):
+                    # Started by a socket that closed a moment ago (e.g. this client before a reload)
+                    owned.add(task_id)
+                if task_id not in status_bus.status:
+                    snapshot = job_store.snapshot(task_id) if task_id else None
+                    if snapshot is None:
+                        await channel.send({"task_id": task_id, "status": "error", "message": "Unknown task"})
+                        continue
+                    # Subscribed first, so the snapshot is kept and sent as the first frame
+                    follow(task_id)
+                    status_bus.publish_remote(task_id, snapshot, replace=True)
+                else:
+                    follow(task_id)
+
+    except WebSocketDisconnect as e:
+        # The client went away (tab closed, page reloaded): the normal way a session ends
+        log.debug(f"WS closed ({e.code})")
+        close_code = e.code
     except Exception as e:
-        print(f"WS Error: {e}")
+        log.error(f"WS Error: {e}")
     finally:
+        # Stop pushing updates to a closed socket, and stop the downloads nobody waits for any more
+        for monitor in list(monitors):
+            monitor.cancel()
+        await channel.close()
+        if close_code in RESTART_CLOSE_CODES or scheduler.stopping:
+            if owned:
+                log.info(f"Server going down, keeping {len(owned)} download(s) of a closed connection.")
+        else:
+            scheduler.release(owned)
         try:
             await websocket.close()
         except:
@@ -0,0 +1,237 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+from . import log
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key        TEXT PRIMARY KEY,
+    digest     TEXT NOT NULL,
+    filename   TEXT NOT NULL,
+    size       INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used  REAL NOT NULL
+)
+"""
+
+# ioctl number of FICLONE (Linux): copy-on-write clone on btrfs/xfs
+_FICLONE = 0x40049409
+
+
+def _clone(src, dst, copy=True):
+    """
+    Reflink, else a hard link (same file system), else a plain copy unless
+    copy is False. dst must not exist. Returns how it was done, None when
+    nothing was. A hard linked file edited in place changes the blob too:
+    materialize() checks the blobs modified since they were stored.
+    """
+    try:
+        import fcntl
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+        return "reflink"
+    except (ImportError, OSError):
+        if os.path.exists(dst):
+            os.remove(dst)
+    try:
+        os.link(src, dst)
+        return "link"
+    except OSError:
+        pass
+    if not copy:
+        return None
+    shutil.copyfile(src, dst)
+    return "copy"
+
+
+def _digest(path, chunk=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class MediaStore:
+    """
+    Content-addressed copy of every finished download.
+    Entries are keyed by (video, format, post-processing profile) and point at
+    a blob named after the sha256 of its bytes, so two keys producing the
+    same file share one blob. A repeat download is served by cloning the
+    blob into the requested folder (a copy-on-write reflink or a hard link
+    where the file system allows it, else a copy): no network, no FFmpeg.
+    Downloads are only copied into the store with copy=True, as that writes
+    every file twice; otherwise they are kept when they can be linked.
+    Least recently used blobs are dropped once the store outgrows `max_bytes`.
+    Nothing is kept, and every call is a no-op, until open() is called
+    (the app's startup hook does it), or when root is None.
+    """
+
+    def __init__(self, root, max_bytes, copy=False):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.copy = copy
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self._warned = False
+        self._lock = threading.Lock()
+        self._db = None
+
+    def open(self):
+        """Opens (creates) the store folder and its index. Does nothing without a root or when already open."""
+        if not self.root or self._db is not None:
+            return
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        db = sqlite3.connect(os.path.join(self.root, "index.db"), check_same_thread=False, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(_SCHEMA)
+        self._db = db
+
+    @property
+    def enabled(self):
+        return self._db is not None
+
+    @staticmethod
+    def key(video, format_id, profile):
+        return f"{video}|{format_id}|{profile}"
+
+    def _execute(self, sql, params=()):
+        if self._db is None:
+            return []
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _blob(self, digest, filename):
+        ext = os.path.splitext(filename)[1]
+        return os.path.join(self.root, "objects", digest[:2], digest + ext)
+
+    def materialize(self, key, folder):
+        """
+        Puts the stored file for `key` into `folder`.
+        Returns the file path, or None on a miss.
+        """
+        if self._db is None:
+            return None
+        rows = self._execute("SELECT * FROM entries WHERE key=?", (key,))
+        if not rows:
+            self.misses += 1
+            return None
+        entry = rows[0]
+        blob = self._blob(entry["digest"], entry["filename"])
+        try:
+            st = os.stat(blob)
+            if st.st_size != entry["size"]:
+                raise OSError("size changed")
+            # Written since it was stored (edited through a hard link): only reused if its bytes are intact
+            if st.st_mtime > entry["created_at"] and _digest(blob) != entry["digest"]:
+                os.remove(blob)
+                raise OSError("content changed")
+        except OSError:
+            # Blob deleted or modified behind our back
+            self._execute("DELETE FROM entries WHERE digest=?", (entry["digest"],))
+            self.misses += 1
+            return None
+
+        dest = os.path.join(folder, entry["filename"])
+        os.makedirs(folder, exist_ok=True)
+        tmp = dest + ".store-tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        _clone(blob, tmp)
+        os.replace(tmp, dest)
+        self._execute("UPDATE entries SET last_used=? WHERE key=?", (time.time(), key))
+        self.hits += 1
+        return dest
+
+    def _used(self):
+        rows = self._execute("SELECT SUM(size) AS s FROM (SELECT MAX(size) AS size FROM entries GROUP BY digest)")
+        return (rows[0]["s"] or 0) if rows else 0
+
+    def ingest(self, key, path):
+        """
+        Adds a finished download, when it can be linked into the store (or
+        copied, with copy=True and room left). Its digest is computed here,
+        on the download thread.
+        """
+        if self._db is None or not os.path.isfile(path):
+            return
+        size = os.path.getsize(path)
+        if size > self.max_bytes:
+            self.skipped += 1
+            return
+        # Linked (or copied) under a temporary name first: nothing is hashed for a file that is not kept
+        tmp = os.path.join(self.root, "objects", f"ingest-{uuid.uuid4().hex}.tmp")
+        copy = self.copy and size <= self.max_bytes - self._used()
+        if _clone(path, tmp, copy=copy) is None:
+            self.skipped += 1
+            if not self.copy and not self._warned:
+                self._warned = True
+                log.info("Media store: downloads cannot be linked into it (other file system?), not storing them;"
+                         " INFINITY_MEDIA_STORE_COPY=1 copies them instead", root=self.root)
+            return
+        try:
+            digest = _digest(tmp)
+            filename = os.path.basename(path)
+            blob = self._blob(digest, filename)
+            if not os.path.exists(blob):
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.replace(tmp, blob)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        now = time.time()
+        self._execute(
+            "INSERT INTO entries (key, digest, filename, size, created_at, last_used)"
+            " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET digest=excluded.digest,"
+            " filename=excluded.filename, size=excluded.size, last_used=excluded.last_used",
+            (key, digest, filename, os.path.getsize(blob), now, now),
+        )
+        self.evict()
+
+    def evict(self):
+        """Drops least recently used blobs until the store fits in max_bytes."""
+        if self._db is None:
+            return
+        blobs = self._execute(
+            "SELECT digest, MIN(filename) AS filename, MAX(size) AS size, MAX(last_used) AS used"
+            " FROM entries GROUP BY digest ORDER BY used"
+        )
+        total = sum(b["size"] for b in blobs)
+        for b in blobs:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._blob(b["digest"], b["filename"]))
+            except OSError:
+                pass
+            self._execute("DELETE FROM entries WHERE digest=?", (b["digest"],))
+            total -= b["size"]
+            log.debug("Evicted from media store", digest=b["digest"][:12], size=b["size"])
+
+    def stats(self):
+        rows = self._execute("SELECT COUNT(*) AS n, COUNT(DISTINCT digest) AS blobs FROM entries")
+        size = self._execute("SELECT SUM(size) AS s FROM (SELECT MAX(size) AS size FROM entries GROUP BY digest)")
+        return {
+            "enabled": self.enabled,
+            "entries": rows[0]["n"] if rows else 0,
+            "blobs": rows[0]["blobs"] if rows else 0,
+            "bytes": (size[0]["s"] or 0) if size else 0,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+        }
+
+    def close(self):
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+            self._db = None
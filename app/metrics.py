@@ -0,0 +1,195 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers websocket sends (sub-ms) up to long downloads/merges
+DEFAULT_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+
+# Set in worker processes: forward(name, value, labels) ships samples to the parent
+forward = None
+
+
+def _label_str(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        if forward is not None:
+            forward(self.name, amount, labels)
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        lines = self.header()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_label_str(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    """A gauge either set directly or computed by `fn` at scrape time (no hot-path cost)."""
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), fn=None):
+        super().__init__(name, help, labels)
+        self._values = {}
+        self.fn = fn
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def render(self):
+        lines = self.header()
+        if self.fn is not None:
+            try:
+                result = self.fn()
+            except Exception:
+                result = None
+            if isinstance(result, dict):
+                for key, value in sorted(result.items()):
+                    key = key if isinstance(key, tuple) else (key,)
+                    lines.append(f"{self.name}{_label_str(self.labelnames, key)} {value}")
+            elif result is not None:
+                lines.append(f"{self.name} {result}")
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_label_str(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        if forward is not None:
+            forward(self.name, value, labels)
+            return
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = self.header()
+        names = self.labelnames + ("le",)
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_str(names, key + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_label_str(names, key + ('+Inf',))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {round(series[-2], 6)}")
+            lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def apply(self, name, value, labels):
+        """Records a sample forwarded from a worker process."""
+        for metric in self._metrics:
+            if metric.name == name:
+                if isinstance(metric, Counter):
+                    metric.inc(value, **labels)
+                elif isinstance(metric, Histogram):
+                    metric.observe(value, **labels)
+                return
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), fn=None):
+        return self.register(Gauge(name, help, labels, fn))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# --- Shared instruments ---
+STAGE_SECONDS = registry.histogram(
+    "infinity_stage_seconds", "Time spent per pipeline stage", ("stage", "detail"))
+DOWNLOADS = registry.counter(
+    "infinity_downloads_total", "Finished download jobs by result", ("result",))
+EXTRACTIONS = registry.counter(
+    "infinity_extractions_total", "Uncached metadata extractions by result", ("result",))
+FALLBACKS = registry.counter(
+    "infinity_fallbacks_total", "Download fallbacks taken", ("kind",))
+DOWNLOAD_FAILURES = registry.counter(
+    "infinity_download_failures_total", "Failed download attempts by failure class", ("kind",))
+RETRIES = registry.counter(
+    "infinity_download_retries_total", "Download retries by strategy", ("strategy",))
+WS_MESSAGES = registry.counter(
+    "infinity_ws_messages_total", "Websocket messages by direction and action", ("direction", "action"))
+WS_BYTES = registry.counter(
+    "infinity_ws_bytes_total", "Websocket payload bytes sent, by protocol", ("protocol",))
@@ -0,0 +1,262 @@
+"""
+FFmpeg post-processing profiles and the transcode pool.
+
+Video profiles only pick the container yt-dlp merges into (always a stream
+copy). Audio profiles run after the download, outside yt-dlp, on a bounded
+pool of their own, so a CPU-heavy conversion never holds a download slot.
+When the downloaded stream already has the target codec it is remuxed
+(-c:a copy) instead of re-encoded.
+"""
+import os
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from . import config, log
+from .catalog import audio_codec, has_audio
+from .metrics import STAGE_SECONDS
+
+# Container for each audio codec when it is copied as-is
+AUDIO_CONTAINERS = {"aac": "m4a", "mp3": "mp3", "opus": "opus", "vorbis": "ogg", "flac": "flac"}
+
+VIDEO_PROFILES = {
+    # name -> merge_output_format handed to yt-dlp
+    "mp4": "mp4",
+    "mkv": "mkv",
+    "webm": "webm",
+    # First container that takes both streams without re-encoding
+    "auto": "mp4/webm/mkv",
+}
+
+AUDIO_PROFILES = {
+    # name -> (codec, bitrate); codec None keeps whatever the source has
+    "mp3-320": ("mp3", "320k"),
+    "mp3-192": ("mp3", "192k"),
+    "mp3-128": ("mp3", "128k"),
+    "aac-256": ("aac", "256k"),
+    "aac-128": ("aac", "128k"),
+    "opus-160": ("opus", "160k"),
+    "opus-96": ("opus", "96k"),
+    "audio-copy": (None, None),
+}
+
+# Encoders in order of preference, the first one this FFmpeg has is used
+ENCODERS = {
+    "mp3": ("libmp3lame", "mp3_mf"),
+    "aac": ("libfdk_aac", "aac_at", "aac"),
+    "opus": ("libopus", "opus"),
+}
+
+
+def is_audio_profile(name):
+    return name in AUDIO_PROFILES
+
+
+def default_profile(format_id):
+    return config.AUDIO_PROFILE if format_id == "best_audio" else config.VIDEO_PROFILE
+
+
+def check_profile(name, format_id, info=None):
+    """
+    Returns a valid profile name for the job, or raises ValueError.
+    `info` (the extracted formats, when we have them) catches an audio
+    profile on a video-only format before anything is downloaded.
+    """
+    name = name or default_profile(format_id)
+    if name not in AUDIO_PROFILES and name not in VIDEO_PROFILES:
+        raise ValueError(f"Unknown post-processing profile: {name}")
+    if format_id == "best_audio" and name not in AUDIO_PROFILES:
+        raise ValueError(f"'{name}' is a video profile, best_audio needs an audio one")
+    if name in AUDIO_PROFILES and format_id != "best_audio" and has_audio(info, format_id) is False:
+        raise ValueError(f"Format {format_id} has no audio, '{name}' needs an audio stream")
+    return name
+
+
+_probe_lock = threading.Lock()
+_probed = {}
+
+
+def probe(ffmpeg):
+    """
+    Version, encoders and hardware accelerations of an FFmpeg binary.
+    Runs `ffmpeg -encoders` / `-hwaccels` once per binary and caches the answer.
+    """
+    with _probe_lock:
+        if ffmpeg in _probed:
+            return _probed[ffmpeg]
+        caps = {"path": ffmpeg, "version": None, "encoders": [], "hwaccels": []}
+        if ffmpeg:
+            try:
+                out = subprocess.run([ffmpeg, "-hide_banner", "-version"], capture_output=True,
+                                     text=True, timeout=10).stdout
+                m = re.search(r'ffmpeg version (\S+)', out)
+                caps["version"] = m.group(1) if m else None
+                out = subprocess.run([ffmpeg, "-hide_banner", "-encoders"], capture_output=True,
+                                     text=True, timeout=10).stdout
+                caps["encoders"] = re.findall(r'^\s*A\S*\s+(\S+)', out, re.MULTILINE)
+                out = subprocess.run([ffmpeg, "-hide_banner", "-hwaccels"], capture_output=True,
+                                     text=True, timeout=10).stdout
+                caps["hwaccels"] = [l.strip() for l in out.splitlines()[1:] if l.strip()]
+            except (OSError, subprocess.SubprocessError) as e:
+                log.warning(f"FFmpeg probe failed: {e}")
+        caps["audio_encoders"] = {
+            codec: next((e for e in names if e in caps["encoders"]), None)
+            for codec, names in ENCODERS.items()
+        }
+        _probed[ffmpeg] = caps
+        return caps
+
+
+def source_codec(ffmpeg, path):
+    """Audio codec of a local file as FFmpeg reads it ('aac', 'opus', ...), or None."""
+    try:
+        out = subprocess.run([ffmpeg, "-hide_banner", "-nostdin", "-i", path],
+                             capture_output=True, text=True, timeout=30).stderr
+    except (OSError, subprocess.SubprocessError):
+        return None
+    m = re.search(r'Stream #\S+.*?: Audio: (\w+)', out)
+    return m.group(1) if m else None
+
+
+def plan(profile, base, src_acodec, caps):
+    """
+    What to run for an audio profile: (mode, output path, ffmpeg output args).
+    `base` is the output path without extension.
+    mode is 'copy' when the source codec already matches, else 'encode'.
+    """
+    codec, bitrate = AUDIO_PROFILES[profile]
+    source = audio_codec(src_acodec)
+    if codec is None or codec == source:
+        ext = AUDIO_CONTAINERS.get(source, "mka")
+        return "copy", f"{base}.{ext}", ["-c:a", "copy"]
+    encoder = caps["audio_encoders"].get(codec)
+    if encoder is None:
+        raise RuntimeError(f"This FFmpeg has no {codec} encoder")
+    args = ["-c:a", encoder, "-b:a", bitrate]
+    if encoder == "opus":
+        # FFmpeg's native Opus encoder is still flagged experimental
+        args += ["-strict", "-2"]
+    if codec == "mp3":
+        args += ["-id3v2_version", "3"]
+    return "encode", f"{base}.{AUDIO_CONTAINERS[codec]}", args
+
+
+class Transcoder:
+    """Bounded pool of FFmpeg conversions, separate from the download workers."""
+
+    def __init__(self, workers, threads=0):
+        self.workers = max(1, workers)
+        # FFmpeg threads per job, by default the cores shared between the workers
+        self.threads = threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self._pool = None
+        self.active = 0
+        self.waiting = 0
+        self.cancelled = 0
+        self._lock = threading.Lock()
+        # task_id -> pending/running conversion and its FFmpeg process (see cancel)
+        self._futures = {}
+        self._procs = {}
+        self._cancelling = set()
+
+    @property
+    def pool(self):
+        # Made on first use (again after close())
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="transcode")
+            return self._pool
+
+    def run(self, ffmpeg, src_path, base, profile, src_acodec=None, on_start=None, task_id=None):
+        """
+        Converts src_path for `profile` into `base`.<ext>, removes src_path and
+        returns the new path. Blocks until done.
+        """
+        with self._lock:
+            self.waiting += 1
+        future = self.pool.submit(self._convert, ffmpeg, src_path, base, profile, src_acodec, on_start, task_id)
+        if task_id is None:
+            return future.result()
+        with self._lock:
+            self._futures[task_id] = future
+        try:
+            return future.result()
+        except CancelledError:
+            raise RuntimeError("Conversion cancelled") from None
+        finally:
+            with self._lock:
+                self._futures.pop(task_id, None)
+                self._cancelling.discard(task_id)
+
+    def cancel(self, task_id):
+        """Kills the FFmpeg of a task, or drops its conversion if it still waits. False if there is none."""
+        with self._lock:
+            future = self._futures.get(task_id)
+            if future is None:
+                return False
+            self._cancelling.add(task_id)
+            proc = self._procs.get(task_id)
+            self.cancelled += 1
+            if future.cancel():
+                self.waiting -= 1
+        if proc is not None:
+            proc.kill()
+        return True
+
+    def _convert(self, ffmpeg, src_path, base, profile, src_acodec, on_start, task_id=None):
+        with self._lock:
+            self.waiting -= 1
+            self.active += 1
+        tmp = None
+        try:
+            if not ffmpeg:
+                raise RuntimeError("FFmpeg is required for audio conversion")
+            if not src_acodec or src_acodec == 'none':
+                # Direct links often come without codec info
+                src_acodec = source_codec(ffmpeg, src_path)
+            mode, dest, args = plan(profile, base, src_acodec, probe(ffmpeg))
+            if on_start:
+                on_start(mode)
+            tmp = f"{os.path.splitext(dest)[0]}.tmp{os.path.splitext(dest)[1]}"
+            cmd = [ffmpeg, "-hide_banner", "-loglevel", "error", "-nostdin", "-y",
+                   "-i", src_path, "-vn", "-map", "0:a:0", *args, "-threads", str(self.threads), tmp]
+            started = time.perf_counter()
+            proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.PIPE, text=True)
+            with self._lock:
+                if task_id is not None:
+                    self._procs[task_id] = proc
+                # Cancelled between the submit and the Popen
+                killed = task_id in self._cancelling
+            if killed:
+                proc.kill()
+            _, err = proc.communicate()
+            if proc.returncode != 0:
+                raise RuntimeError("Conversion cancelled" if task_id in self._cancelling
+                                   else f"FFmpeg failed: {err.strip()[-300:]}")
+            os.replace(tmp, dest)
+            tmp = None
+            if os.path.abspath(dest) != os.path.abspath(src_path):
+                os.remove(src_path)
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="transcode", detail=f"{profile}:{mode}")
+            return dest
+        finally:
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+            with self._lock:
+                self.active -= 1
+                self._procs.pop(task_id, None)
+
+    def stats(self):
+        return {"workers": self.workers, "threads": self.threads, "active": self.active, "waiting": self.waiting,
+                "cancelled": self.cancelled}
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+
+transcoder = Transcoder(config.MAX_TRANSCODE, config.TRANSCODE_THREADS)
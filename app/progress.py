@@ -0,0 +1,132 @@
+import threading
+import time
+
+
+class ThroughputMeter:
+    """
+    Exponentially smoothed bytes/second.
+    `half_life` is the number of seconds after which an old sample weighs half.
+    """
+
+    def __init__(self, half_life=3.0):
+        self.half_life = half_life
+        self.rate = 0.0
+        self.total = 0
+        self._last = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def add(self, nbytes, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.total += nbytes
+            if self._last is None:
+                self._last = now
+                self._pending = nbytes
+                return
+            self._pending += nbytes
+            dt = now - self._last
+            # Tiny intervals make for noisy samples, batch them
+            if dt < 0.05:
+                return
+            instant = self._pending / dt
+            alpha = 1 - 0.5 ** (dt / self.half_life)
+            self.rate += alpha * (instant - self.rate)
+            self._last = now
+            self._pending = 0
+
+    def current(self, now=None):
+        """Smoothed rate, decayed for the time since the last sample."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self._last is None:
+                return 0.0
+            idle = max(0.0, now - self._last)
+            return self.rate * 0.5 ** (idle / self.half_life)
+
+
+class _TaskProgress:
+    __slots__ = ("filename", "last_bytes", "last_publish", "meter", "started")
+
+    def __init__(self):
+        self.filename = None
+        self.last_bytes = 0
+        self.last_publish = 0.0
+        self.meter = ThroughputMeter()
+        self.started = None
+
+
+class ProgressTracker:
+    """
+    Turns raw yt-dlp progress dicts into compact numeric records and keeps
+    smoothed throughput per task and for the whole server.
+    """
+
+    def __init__(self, publish_interval=0.1):
+        self.publish_interval = publish_interval
+        self.server = ThroughputMeter()
+        self._tasks = {}
+
+    def record(self, task_id, d):
+        """
+        Feeds one 'downloading' callback. Returns the structured record, or
+        None when it was throttled (a record went out less than
+        `publish_interval` ago).
+        """
+        now = time.monotonic()
+        task = self._tasks.get(task_id)
+        if task is None:
+            task = self._tasks[task_id] = _TaskProgress()
+
+        downloaded = d.get('downloaded_bytes') or 0
+        filename = d.get('filename')
+        # A new file (video then audio stream) restarts the byte counter
+        if filename != task.filename or downloaded < task.last_bytes:
+            task.filename = filename
+            task.last_bytes = 0
+            task.started = now
+        delta = downloaded - task.last_bytes
+        task.last_bytes = downloaded
+        if delta:
+            task.meter.add(delta, now)
+            self.server.add(delta, now)
+
+        if now - task.last_publish < self.publish_interval:
+            return None
+        task.last_publish = now
+
+        total = d.get('total_bytes')
+        # Only an estimate when one was actually used in place of the real total
+        estimated = not total and bool(d.get('total_bytes_estimate'))
+        if estimated:
+            total = d.get('total_bytes_estimate')
+        return {
+            "downloaded_bytes": downloaded,
+            "total_bytes": int(total) if total else None,
+            "total_is_estimate": estimated,
+            "speed": d.get('speed'),
+            "eta": d.get('eta'),
+            "fragment_index": d.get('fragment_index'),
+            "fragment_count": d.get('fragment_count'),
+            "throughput": round(task.meter.current(now)),
+        }
+
+    def stream_finished(self, task_id):
+        """Seconds the current file took to download (None if it never reported progress)."""
+        task = self._tasks.get(task_id)
+        if task is None or task.started is None:
+            return None
+        elapsed = time.monotonic() - task.started
+        task.started = None
+        return elapsed
+
+    def forget(self, task_id):
+        self._tasks.pop(task_id, None)
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {
+            "server_throughput": round(self.server.current(now)),
+            "server_total_bytes": self.server.total,
+            "tasks": {tid: round(t.meter.current(now)) for tid, t in list(self._tasks.items())},
+        }
@@ -0,0 +1,172 @@
+"""
+What to do when a download attempt fails.
+
+classify() sorts an exception (yt-dlp, httpx or our own) into a failure
+class; the download loops in downloader.py and engine.py pick the next step
+from it:
+
+    throttled          HTTP 429, or 403 while the format URLs are still valid:
+                       back off, then continue the .part files
+    expired_url        HTTP 410, or 403 once the signed URLs expired: extract
+                       the video again for fresh URLs, keep what is on disk
+    network            timeouts, resets, 5xx: back off and continue
+    merge_failed       FFmpeg failed after the streams were downloaded: merge
+                       them again (into MKV), without downloading anything
+    ffmpeg_missing     streams cannot be merged at all: download the chosen
+                       format alone
+    format_unavailable the video+audio selection does not exist: same
+    fatal              anything else (private video, 404...), not retried
+
+Backoff is exponential with full jitter, so jobs throttled together do not
+come back together.
+"""
+import random
+import re
+import time
+from urllib.parse import parse_qs, urlparse
+
+from . import config
+from .metrics import DOWNLOAD_FAILURES, RETRIES
+
+THROTTLED = "throttled"
+EXPIRED = "expired_url"
+NETWORK = "network"
+MERGE = "merge_failed"
+NO_FFMPEG = "ffmpeg_missing"
+FORMAT = "format_unavailable"
+FATAL = "fatal"
+
+FAILURE_CLASSES = (THROTTLED, EXPIRED, NETWORK, MERGE, NO_FFMPEG, FORMAT, FATAL)
+# Next steps (RetryState.next_step)
+BACKOFF = "backoff"
+REFRESH = "refresh_urls"
+MERGE_ONLY = "merge_only"
+DIRECT = "direct"
+
+# Signed URLs are treated as expired this many seconds early
+EXPIRY_MARGIN = 60
+
+_NETWORK_HINTS = ("timed out", "timeout", "connection reset", "connection refused", "connection aborted",
+                  "incompleteread", "incomplete read", "remote end closed", "temporary failure",
+                  "network is unreachable", "broken pipe", "eof occurred", "giving up after")
+_NO_FFMPEG_HINTS = ("ffmpeg is not installed", "ffmpeg not found", "merging needs ffmpeg",
+                    "ffprobe and ffmpeg not found")
+_MERGE_HINTS = ("postprocessing:", "conversion failed", "ffmpeg merge failed", "merger")
+_FORMAT_HINTS = ("requested format is not available", "requested format not available")
+
+
+def status_code(exc):
+    """HTTP status behind an exception (also when yt-dlp wrapped it), or None."""
+    seen = set()
+    current = exc
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        for attr in ("status", "status_code", "code"):
+            value = getattr(current, attr, None)
+            if isinstance(value, int) and 100 <= value < 600:
+                return value
+        response = getattr(current, "response", None)
+        for attr in ("status_code", "status"):
+            value = getattr(response, attr, None)
+            if isinstance(value, int) and 100 <= value < 600:
+                return value
+        exc_info = getattr(current, "exc_info", None)
+        current = (exc_info[1] if exc_info else None) or current.__cause__ or current.__context__
+    m = re.search(r"HTTP Error (\d{3})", str(exc))
+    return int(m.group(1)) if m else None
+
+
+def expires_at(info):
+    """Earliest expiry (unix time) of the signed format URLs in an info dict or plan, None if unknown."""
+    if not info:
+        return None
+    formats = info.get("requested_formats") or info.get("formats") or [info]
+    times = []
+    for fmt in formats:
+        url = fmt.get("url") or ""
+        if "expire" not in url:
+            continue
+        value = parse_qs(urlparse(url).query).get("expire", [None])[0]
+        if value is None:
+            # Manifest URLs carry it in the path (/expire/1700000000/)
+            m = re.search(r"/expire/(\d+)", url)
+            value = m.group(1) if m else None
+        if value and value.isdigit():
+            times.append(int(value))
+    return min(times) if times else None
+
+
+def urls_expired(info, now=None):
+    expiry = expires_at(info)
+    return expiry is not None and expiry - EXPIRY_MARGIN <= (now or time.time())
+
+
+def classify(exc, info=None):
+    """Failure class of a download error. `info` (metadata or plan) tells a stale 403 from throttling."""
+    message = str(exc).lower()
+    if any(hint in message for hint in _NO_FFMPEG_HINTS):
+        return NO_FFMPEG
+    if any(hint in message for hint in _FORMAT_HINTS):
+        return FORMAT
+    status = status_code(exc)
+    if status == 410 or (status == 403 and urls_expired(info)):
+        return EXPIRED
+    if status in (403, 429):
+        return THROTTLED
+    if status is not None and status >= 500:
+        return NETWORK
+    if any(hint in message for hint in _MERGE_HINTS):
+        return MERGE
+    if status is None and (isinstance(exc, (TimeoutError, ConnectionError))
+                           or any(hint in message for hint in _NETWORK_HINTS)
+                           or type(exc).__name__ in ("ReadTimeout", "ConnectTimeout", "ReadError",
+                                                     "RemoteProtocolError", "ConnectError")):
+        return NETWORK
+    return FATAL
+
+
+def backoff(attempt):
+    """Seconds to wait before retry number `attempt` (0-based): full jitter, capped."""
+    base = config.RETRY_BACKOFF_MS / 1000
+    cap = config.RETRY_BACKOFF_MAX_MS / 1000
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RetryState:
+    """Retry bookkeeping of one job: how often it failed, and how."""
+
+    def __init__(self, merging=True):
+        # Only a video + audio job can fall back to its video format alone
+        self.merging = merging
+        self.retries = 0
+        self.forbidden = 0   # 403s in a row
+        self.kind = None
+        self._tried = set()
+
+    def next_step(self, exc, info=None):
+        """
+        Classifies a failure and returns (step, delay in seconds), or None to
+        give up. Failures and retries are counted per class / step.
+        """
+        kind = self.kind = classify(exc, info)
+        DOWNLOAD_FAILURES.inc(kind=kind)
+        self.forbidden = self.forbidden + 1 if kind == THROTTLED and status_code(exc) == 403 else 0
+        if self.retries >= config.RETRY_ATTEMPTS:
+            return None
+        if kind == EXPIRED:
+            step, delay = REFRESH, 0
+        elif kind == THROTTLED:
+            # A 403 that outlasts a backoff is often a URL tied to an old session
+            step, delay = (REFRESH if self.forbidden >= 2 else BACKOFF), backoff(self.retries)
+        elif kind == NETWORK:
+            step, delay = BACKOFF, backoff(self.retries)
+        elif kind == MERGE and MERGE_ONLY not in self._tried:
+            step, delay = MERGE_ONLY, 0
+        elif kind in (NO_FFMPEG, FORMAT) and self.merging and DIRECT not in self._tried:
+            step, delay = DIRECT, 0
+        else:
+            return None
+        self.retries += 1
+        self._tried.add(step)
+        RETRIES.inc(strategy=step)
+        return step, delay
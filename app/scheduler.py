@@ -0,0 +1,534 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import config, downloader, log
+from .downloader import run_download, fetch_formats, query_formats, set_status, update_status, job_journal, \
+    job_store, status_bus, finish_download, request_stop, stopped_status
+from .bandwidth import default_weight, shaper
+from .events import FINAL_STATES
+from .metrics import STAGE_SECONDS
+from .postprocess import transcoder
+
+# Lower number = served first
+PRIORITIES = {"high": 0, "normal": 10, "low": 20}
+
+# Actions accepted by DownloadScheduler.control (websocket and POST /api/tasks/{task_id})
+CONTROL_ACTIONS = ("cancel", "pause", "resume", "reprioritize")
+
+
+def parse_priority(value):
+    """Accepts 'high' / 'normal' / 'low' or a plain number."""
+    if isinstance(value, str):
+        if value.lower() in PRIORITIES:
+            return PRIORITIES[value.lower()]
+        try:
+            return int(value)
+        except ValueError:
+            return PRIORITIES["normal"]
+    if isinstance(value, (int, float)):
+        return int(value)
+    return PRIORITIES["normal"]
+
+
+class Job:
+    def __init__(self, task_id, url, format_id, download_path, priority, connections=None, resume=False,
+                 profile=None, client=None, weight=None):
+        self.task_id = task_id
+        self.url = url
+        self.format_id = format_id
+        self.download_path = download_path
+        self.priority = priority
+        self.connections = connections
+        self.resume = resume
+        self.profile = profile
+        # Bandwidth shaping: who asked for it and its share next to other jobs
+        self.client = client
+        self.weight = weight or default_weight(format_id, profile)
+        # Wall clock: the job may be queued on one server process and run on another
+        self.queued_at = time.time()
+
+    def record(self):
+        """Plain dict the job store keeps while the job waits."""
+        return dict(vars(self))
+
+    @classmethod
+    def from_record(cls, record):
+        job = cls(record["task_id"], record["url"], record["format_id"], record["download_path"],
+                  record["priority"], record.get("connections"), record.get("resume", False),
+                  record.get("profile"), record.get("client"), record.get("weight"))
+        job.queued_at = record.get("queued_at", job.queued_at)
+        return job
+
+
+class DownloadScheduler:
+    """
+    Bounded scheduler in front of run_download.
+    1. Downloads wait in a priority queue (FIFO within the same priority),
+       kept by the job store: with a shared one, every server process takes
+       jobs from the same queue (see store.py).
+    2. At most `max_downloads` run at once, each on its own pool thread.
+    3. FFmpeg merges are gated by a separate semaphore. Audio conversions
+       run on the transcode pool and give the download slot back first.
+    4. Metadata extraction uses its own pool so it is never starved by downloads.
+       The async engine plans on another one, so fetch_info traffic (or a
+       slow extraction) never holds up downloads that are ready to start.
+    5. With backend="process" the yt-dlp work itself runs in worker processes
+       (see workers.py); the pool threads then only wait on them.
+    6. With engine="async" a running download is a coroutine, not a thread:
+       yt-dlp only picks the formats (planning pool) and engine.py moves the
+       bytes, so `max_downloads` can be in the thousands.
+    7. Jobs can be cancelled, paused, resumed and re-prioritized (control()).
+       A waiting job is changed in the store; a running one is asked to stop
+       (downloader.request_stop) and gives its slot back within a chunk.
+    """
+
+    def __init__(self, max_downloads=None, max_postprocess=None, max_metadata=None, backend=None,
+                 engine=None, store=None):
+        self.max_downloads = max(1, max_downloads or config.MAX_DOWNLOADS)
+        self.max_postprocess = max(1, max_postprocess or config.MAX_POSTPROCESS)
+        self.max_metadata = max(1, max_metadata or config.MAX_METADATA)
+
+        # Thread pools are made by start() and shut down by stop(), so the scheduler can be started again
+        self.download_pool = None
+        self.metadata_pool = None
+        self.plan_pool = None
+        self.postprocess_slots = threading.BoundedSemaphore(self.max_postprocess)
+        self.backend_name = (backend or config.EXECUTION_BACKEND).lower()
+        self.backend = None
+        self.engine_name = (engine or config.DOWNLOAD_ENGINE).lower()
+        if self.engine_name == "async":
+            from . import engine as transfer_engine
+            if not transfer_engine.available():
+                log.warning("httpx is not installed, using the threaded download engine")
+                self.engine_name = "thread"
+
+        self.store = store or job_store
+        # Queued jobs submitted here -> last position reported to their clients
+        self._positions = {}
+        self._wakeup = None
+        self._handoff = None
+        self._idle = 0
+        self._feeder = None
+        self._workers = []
+        self._loop = None
+        # Jobs this process claimed (handed to a worker or running)
+        self.jobs = {}
+        self.active = set()
+        # Downloads running as coroutines (async engine), cancelled first by stop()
+        self._running = set()
+        # Tasks whose client went away -> timer that cancels them (see release())
+        self._orphans = {}
+        # Set while stop() runs: nothing is cancelled for a client any more, the journal resumes it all
+        self.stopping = False
+        self.converting = set()
+        self.metadata_active = 0
+
+    async def start(self):
+        self.stopping = False
+        # Extra threads for jobs that handed their slot back and wait on a conversion
+        self.download_pool = ThreadPoolExecutor(self.max_downloads + transcoder.workers,
+                                                thread_name_prefix="download")
+        self.metadata_pool = ThreadPoolExecutor(self.max_metadata, thread_name_prefix="metadata")
+        # Format selection of the async engine: short calls only, nothing waits on other work here
+        self.plan_pool = ThreadPoolExecutor(self.max_metadata, thread_name_prefix="plan")
+        if self.backend_name == "process":
+            from .workers import ProcessBackend
+            self.backend = ProcessBackend(self.max_downloads + self.max_metadata, self.max_postprocess)
+            downloader.run_heavy = self.backend.call
+        self._loop = asyncio.get_running_loop()
+        self.store.on_control = self._remote_control
+        self._wakeup = asyncio.Event()
+        self._handoff = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_downloads)]
+        self._feeder = asyncio.create_task(self._feed())
+
+    async def stop(self):
+        self.stopping = True
+        for handle in self._orphans.values():
+            handle.cancel()
+        self._orphans.clear()
+        tasks = [*self._workers, self._feeder] if self._feeder else self._workers
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._feeder = None
+        self.store.on_control = None
+        # Downloads first: they still use the engine's client and the pools. Their journal
+        # entries stay unfinished and .part files stay, so the next start resumes them
+        running = list(self._running)
+        for f in running:
+            f.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        if self.engine_name == "async":
+            from .engine import engine
+            await engine.aclose()
+        for pool in (self.download_pool, self.metadata_pool, self.plan_pool):
+            if pool is not None:
+                pool.shutdown(wait=False)
+        self.download_pool = self.metadata_pool = self.plan_pool = None
+        if self.backend is not None:
+            downloader.run_heavy = downloader.run_local
+            self.backend.close()
+            self.backend = None
+
+    def submit(self, task_id, url, format_id, download_path="Default", priority="normal",
+               connections=None, resume=False, profile=None, client=None, weight=None):
+        """Queues a download and returns its 1-based queue position."""
+        job = Job(task_id, url, format_id, download_path, parse_priority(priority), connections, resume, profile,
+                  client, weight)
+        if not self.store.enqueue(job.record()):
+            # Already queued, or claimed by a process: a live one runs it, the claim of a dead
+            # one runs out after the store's lease and the job is queued again (see store.py)
+            log.warning("Task is already queued or running, not queued again", task_id=task_id,
+                        store=self.store.name)
+            return self.position(task_id)
+        job_journal.record_queued(task_id, url, format_id, download_path, job.priority, connections, profile)
+        self._positions[task_id] = 0
+        self._report_positions()
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return self.position(task_id)
+
+    def resume_unfinished(self):
+        """
+        Re-queues the jobs the journal still has as queued/running and puts
+        the paused ones back on hold. Returns the ids of the re-queued jobs.
+        """
+        resumed = []
+        for row in job_journal.unfinished():
+            if row["state"] == "paused":
+                job = Job(row["task_id"], row["url"], row["format_id"], row["download_path"], row["priority"],
+                          row["connections"], resume=True, profile=row.get("profile"))
+                self.store.pause(job.task_id, job.record())
+                continue
+            self.submit(
+                row["task_id"], row["url"], row["format_id"], row["download_path"],
+                row["priority"], row["connections"], resume=True, profile=row.get("profile"),
+            )
+            resumed.append(row["task_id"])
+        return resumed
+
+    # --- job control ---
+
+    def control(self, task_id, action, priority=None, weight=None):
+        """
+        Runs a control action on a task (any state, any server process).
+        Returns {"status": "success", "task_id", "state", ...} or an error dict.
+        """
+        try:
+            if action == "cancel":
+                result = self.cancel(task_id)
+            elif action == "pause":
+                result = self.pause(task_id)
+            elif action == "resume":
+                result = self.resume(task_id)
+            elif action == "reprioritize":
+                result = self.reprioritize(task_id, priority, weight)
+            else:
+                raise ValueError(f"Unknown action {action!r} ({', '.join(CONTROL_ACTIONS)})")
+        except (ValueError, TypeError) as e:
+            return {"status": "error", "task_id": task_id, "message": str(e)}
+        return {"status": "success", "task_id": task_id, **result}
+
+    def cancel(self, task_id):
+        """Drops a waiting job, or stops a running one and deletes its partial files."""
+        return self._stop(task_id, "cancel")
+
+    def pause(self, task_id):
+        """Holds a waiting job, or stops a running one and keeps its .part files for resume()."""
+        return self._stop(task_id, "pause")
+
+    def _stop(self, task_id, action):
+        final = stopped_status(action)
+        # Waiting: done right here, whichever process queued it
+        record = self.store.pause(task_id) if action == "pause" else self.store.remove(task_id)
+        if record is not None:
+            self._positions.pop(task_id, None)
+            set_status(task_id, final)
+            job_journal.finish(task_id, final)
+            self._report_positions()
+            return {"state": final["state"]}
+
+        pending = {"state": "cancelling" if action == "cancel" else "pausing"}
+        if task_id in self.jobs:
+            self._stop_local(task_id, action)
+            return pending
+        status = status_bus.status.get(task_id) or self.store.snapshot(task_id)
+        if status is None:
+            raise ValueError("Unknown task")
+        if status.get("state") in (*FINAL_STATES, "paused"):
+            raise ValueError(f"Task is already {status['state']}")
+        # Running on another server process
+        if not self.store.control(task_id, action):
+            raise ValueError("Task is not running")
+        return pending
+
+    def _stop_local(self, task_id, action):
+        request_stop(task_id, action)
+        update_status(task_id, {"message": "Cancelling..." if action == "cancel" else "Pausing..."})
+
+    def resume(self, task_id):
+        """Puts a paused job back in the queue; it continues from its .part files."""
+        record = self.store.resume(task_id)
+        if record is None:
+            raise ValueError("Task is not paused")
+        job_journal.record_queued(task_id, record["url"], record["format_id"], record["download_path"],
+                                  record["priority"], record.get("connections"), record.get("profile"))
+        self._positions[task_id] = 0
+        self._report_positions()
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return {"state": "queued", "position": self.position(task_id)}
+
+    def reprioritize(self, task_id, priority=None, weight=None):
+        """
+        New queue priority and/or bandwidth weight. The priority re-sorts a
+        waiting job; the weight also applies to a running one (see bandwidth.py).
+        """
+        if priority is None and weight is None:
+            raise ValueError("priority or weight is required")
+        fields = {}
+        if priority is not None:
+            fields["priority"] = parse_priority(priority)
+        if weight is not None:
+            fields["weight"] = max(0.01, float(weight))
+
+        record = self.store.update(task_id, **fields)
+        if record is not None:
+            if "priority" in fields:
+                job_journal.set_priority(task_id, fields["priority"])
+                self._report_positions()
+            return {"state": "paused" if task_id in self.store.paused() else "queued",
+                    "position": self.position(task_id), **fields}
+
+        # Running: only the weight still matters
+        if "weight" not in fields:
+            raise ValueError("Task is not waiting (only its weight can change now)")
+        if task_id in self.jobs:
+            self._reweight(task_id, fields["weight"])
+        elif not self.store.control(task_id, "reprioritize", weight=fields["weight"]):
+            raise ValueError("Task is not running")
+        return {"state": "running", "weight": fields["weight"]}
+
+    def _reweight(self, task_id, weight):
+        self.jobs[task_id].weight = weight
+        try:
+            shaper.configure({"tasks": {task_id: {"weight": weight}}})
+        except ValueError:
+            # Claimed but not started yet: the worker registers it with job.weight
+            pass
+
+    def _remote_control(self, task_id, fields):
+        # Called on the store's sync thread: another process sent a control action
+        if task_id in self.jobs and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._apply_control, task_id, fields)
+
+    def _apply_control(self, task_id, fields):
+        if task_id not in self.jobs:
+            return
+        if fields.get("action") in ("cancel", "pause"):
+            self._stop_local(task_id, fields["action"])
+        elif fields.get("action") == "reprioritize" and fields.get("weight"):
+            self._reweight(task_id, fields["weight"])
+
+    def cancel_unfinished(self, task_ids):
+        """Cancels the tasks that are not over yet (a client that started them went away)."""
+        cancelled = []
+        for task_id in task_ids:
+            if (status_bus.status.get(task_id) or {}).get("state") in FINAL_STATES:
+                continue
+            if self.control(task_id, "cancel")["status"] == "success":
+                cancelled.append(task_id)
+        if cancelled:
+            log.info(f"Cancelled {len(cancelled)} download(s) of a closed connection.")
+        return cancelled
+
+    def release(self, task_ids, grace=None):
+        """
+        The client that started these tasks went away: cancels the unfinished
+        ones after `grace` seconds (INFINITY_DISCONNECT_GRACE_S), unless a
+        client takes them back first (adopt()). Nothing is cancelled while the
+        server stops. Call from the event loop.
+        """
+        if self.stopping:
+            return
+        grace = config.DISCONNECT_GRACE_S if grace is None else grace
+        if grace <= 0:
+            self.cancel_unfinished(task_ids)
+            return
+        loop = asyncio.get_running_loop()
+        for task_id in task_ids:
+            if (status_bus.status.get(task_id) or {}).get("state") in FINAL_STATES:
+                continue
+            self.adopt(task_id)
+            self._orphans[task_id] = loop.call_later(grace, self._expire, task_id)
+
+    def adopt(self, task_id):
+        """Keeps a task release() would cancel. True if it was waiting for that."""
+        handle = self._orphans.pop(task_id, None)
+        if handle is None:
+            return False
+        handle.cancel()
+        return True
+
+    def _expire(self, task_id):
+        self._orphans.pop(task_id, None)
+        if not self.stopping:
+            self.cancel_unfinished([task_id])
+
+    def position(self, task_id):
+        try:
+            return self.store.queued().index(task_id) + 1
+        except ValueError:
+            return 0
+
+    def stats(self):
+        return {
+            "queued": self.store.size(),
+            "active": len(self.active),
+            "max_downloads": self.max_downloads,
+            "max_postprocess": self.max_postprocess,
+            "converting": len(self.converting),
+            "max_transcode": transcoder.workers,
+            "max_metadata": self.max_metadata,
+            "metadata_active": self.metadata_active,
+            "backend": self.backend_name,
+            "engine": self.engine_name,
+            "store": self.store.stats(),
+        }
+
+    async def fetch_info(self, url):
+        loop = asyncio.get_running_loop()
+        self.metadata_active += 1
+        try:
+            return await loop.run_in_executor(self.metadata_pool, fetch_formats, url)
+        finally:
+            self.metadata_active -= 1
+
+    async def query_formats(self, urls, query, limit=5):
+        """Runs one catalog query over many URLs (metadata extracted in parallel, cached)."""
+        loop = asyncio.get_running_loop()
+        self.metadata_active += len(urls)
+        try:
+            return await asyncio.gather(*(
+                loop.run_in_executor(self.metadata_pool, query_formats, url, query, limit) for url in urls
+            ))
+        finally:
+            self.metadata_active -= len(urls)
+
+    def _report_positions(self):
+        # Positions are global, but each process only reports those of the jobs it queued
+        if not self._positions:
+            return
+        waiting = set()
+        for pos, task_id in enumerate(self.store.queued(), start=1):
+            if task_id not in self._positions:
+                continue
+            waiting.add(task_id)
+            if self._positions[task_id] == pos:
+                continue
+            self._positions[task_id] = pos
+            set_status(task_id, {
+                "state": "queued",
+                "message": f"Queued, position {pos}",
+                "position": pos,
+            })
+        for task_id in self._positions.keys() - waiting:
+            del self._positions[task_id]
+
+    async def _feed(self):
+        """
+        Claims jobs from the store while a worker is free to run them, so a
+        process never takes more than it can start. A shared store is also
+        polled, for the jobs the other processes queue.
+        """
+        while True:
+            self._wakeup.clear()
+            changed = False
+            while self._idle > self._handoff.qsize():
+                record = self.store.claim()
+                if record is None:
+                    break
+                job = Job.from_record(record)
+                self.jobs[job.task_id] = job
+                self._handoff.put_nowait(job)
+                changed = True
+            if changed or self.store.shared:
+                self._report_positions()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.store.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._idle += 1
+            self._wakeup.set()
+            try:
+                job = await self._handoff.get()
+            finally:
+                self._idle -= 1
+            action = downloader.stop_requested(job.task_id)
+            if action is not None:
+                # Stopped between the claim and now
+                final = stopped_status(action)
+                set_status(job.task_id, final)
+                finish_download(job.task_id, final)
+                self._release(job, final)
+                continue
+            self.active.add(job.task_id)
+            shaper.register(job.task_id, job.client, job.weight)
+            STAGE_SECONDS.observe(max(0.0, time.time() - job.queued_at), stage="queue_wait")
+            # run_download calls this once the network part is over (before converting)
+            handed_off = asyncio.Event()
+            release_slot = lambda: loop.call_soon_threadsafe(handed_off.set)
+            if self.engine_name == "async":
+                from .engine import run_download_async
+                future = asyncio.ensure_future(run_download_async(
+                    job.url, job.format_id, job.task_id, job.download_path,
+                    self.postprocess_slots, job.connections, job.resume, job.profile, release_slot,
+                    plan_pool=self.plan_pool, download_pool=self.download_pool,
+                ))
+                self._running.add(future)
+                future.add_done_callback(self._running.discard)
+            else:
+                future = loop.run_in_executor(
+                    self.download_pool, run_download,
+                    job.url, job.format_id, job.task_id, job.download_path,
+                    self.postprocess_slots, job.connections, job.resume, job.profile, release_slot,
+                )
+            future.add_done_callback(lambda f, job=job: self._finished(job, f))
+            waiter = asyncio.ensure_future(handed_off.wait())
+            try:
+                await asyncio.wait({future, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+            if not future.done():
+                self.active.discard(job.task_id)
+                self.converting.add(job.task_id)
+
+    def _finished(self, job, future):
+        final = None
+        if not future.cancelled():
+            if future.exception() is not None:
+                set_status(job.task_id, {"state": "error", "message": str(future.exception())})
+            else:
+                final = future.result()
+        self._release(job, final)
+
+    def _release(self, job, final=None):
+        self.jobs.pop(job.task_id, None)
+        if final is not None and final.get("state") == "paused":
+            # Held until resume(), then continued from its .part files by any process
+            job.resume = True
+            self.store.pause(job.task_id, job.record())
+        else:
+            self.store.done(job.task_id)
+        downloader.clear_stop(job.task_id)
+        shaper.unregister(job.task_id)
+        self.active.discard(job.task_id)
+        self.converting.discard(job.task_id)
@@ -0,0 +1,60 @@
+"""
+Where the time goes between launching the server and serving warm requests:
+module imports, the startup hook and the background warm-up.
+Logged once the warm-up is done and served at /api/startup, so the numbers
+can be compared from one release to the next.
+"""
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from . import config
+
+# Heavy modules that are only imported when something needs them
+LAZY_MODULES = ("yt_dlp", "httpx")
+
+
+class StartupReport:
+    def __init__(self):
+        self.phases = {}  # name -> seconds, in the order they finished
+        self.warm = False
+        self._lock = threading.Lock()
+
+    def record(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] = round(seconds, 4)
+
+    @contextmanager
+    def timed(self, phase):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - started)
+
+    def since_launch(self):
+        """Seconds since run.py launched the server, None when started some other way."""
+        launched = os.environ.get("INFINITY_LAUNCHED_AT")
+        try:
+            return time.time() - float(launched) if launched else None
+        except ValueError:
+            return None
+
+    def stats(self):
+        with self._lock:
+            phases = dict(self.phases)
+        return {
+            "environment": config.ENVIRONMENT,
+            "phases": phases,
+            "warm": self.warm,
+            "loaded": {name: name in sys.modules for name in LAZY_MODULES},
+        }
+
+    def summary(self, prefix=""):
+        with self._lock:
+            return ", ".join(f"{k[len(prefix):]} {v:.2f}s" for k, v in self.phases.items() if k.startswith(prefix))
+
+
+report = StartupReport()
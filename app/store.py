@@ -0,0 +1,878 @@
+"""
+Job store: the queue of waiting downloads and the task status events, behind
+one interface so several server processes, or hosts, can share them.
+
+    memory                     one process (default), nothing leaves it
+    sqlite:///path/to/jobs.db  a WAL database, several workers on one host
+    redis://host:6379/0        a Redis server, several hosts behind a load balancer
+    fake                       in-process Redis stand-in (FakeRedis), for tests
+
+Every process (node) keeps its own EventBus for its local subscribers. With a
+shared store, the changes published on that bus are merged per task and
+written in one batch every `interval`; the batches written by the other nodes
+are read back and re-published locally. So any node can take a websocket,
+queue a job, and stream the progress of a job that another node is running.
+
+Jobs that are waiting (queued or paused) can be removed, paused, resumed
+and re-prioritized directly in the store. A running job belongs to the node
+that claimed it: control() sends that node a message (cancel, pause, new
+weight) along with the status batches, handed to `on_control` there. The
+claim is a lease the node renews while it lives; one left by a node that
+crashed runs out after `lease` seconds and its job goes back in the queue
+(or to whoever queues that task again, like resume_unfinished on restart).
+
+Calls are short, synchronous and made from the event loop as well as from
+worker threads, like the journal's: keep a shared store on a fast disk or a
+nearby Redis.
+"""
+import heapq
+import itertools
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from . import log
+from .events import FINAL_STATES
+
+# Seconds status batches stay readable by the other nodes
+EVENTS_KEEP = 60
+
+# Seconds a claimed job stays with a node that stopped renewing it (crashed, killed)
+CLAIM_LEASE = 30
+
+# claimed_by of the paused jobs in the SQLite queue (node ids never look like this)
+PAUSED = "paused"
+
+
+def _node_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class MemoryStore:
+    """Single process: a heap for the queue, statuses stay on the local EventBus."""
+
+    name = "memory"
+    shared = False
+    poll_interval = None
+
+    def __init__(self):
+        self.node = _node_id()
+        self.on_control = None
+        self._lock = threading.Lock()
+        self._heap = []      # (priority, seq, task_id)
+        self._records = {}   # task_id -> job record, while queued, paused or running
+        self._paused = {}    # task_id -> its place in the queue, kept for resume()
+        self._seq = itertools.count()
+
+    def start(self, bus):
+        pass
+
+    def close(self):
+        pass
+
+    def enqueue(self, record):
+        """Queues a job record (a dict with task_id and priority). False if the task is already known."""
+        with self._lock:
+            if record["task_id"] in self._records:
+                return False
+            self._records[record["task_id"]] = record
+            heapq.heappush(self._heap, (record["priority"], next(self._seq), record["task_id"]))
+            return True
+
+    def claim(self):
+        """Takes the next job (lowest priority number, then oldest) off the queue, or None."""
+        with self._lock:
+            if not self._heap:
+                return None
+            _, _, task_id = heapq.heappop(self._heap)
+            return self._records[task_id]
+
+    def queued(self):
+        """Task ids of the waiting jobs, in the order they will run."""
+        with self._lock:
+            return [task_id for _, _, task_id in sorted(self._heap)]
+
+    def size(self):
+        return len(self._heap)
+
+    def done(self, task_id):
+        """Forgets a finished job, so the same task id can be queued again."""
+        with self._lock:
+            self._records.pop(task_id, None)
+
+    def _unqueue(self, task_id):
+        # Called with the lock held. Returns the job's seq, None if it was not queued
+        heap = [entry for entry in self._heap if entry[2] != task_id]
+        if len(heap) == len(self._heap):
+            return None
+        seq = next(entry[1] for entry in self._heap if entry[2] == task_id)
+        heapq.heapify(heap)
+        self._heap = heap
+        return seq
+
+    def remove(self, task_id):
+        """Drops a waiting (queued or paused) job. Returns its record, None if it is not waiting."""
+        with self._lock:
+            if self._paused.pop(task_id, None) is None and self._unqueue(task_id) is None:
+                return None
+            return self._records.pop(task_id)
+
+    def pause(self, task_id, record=None):
+        """
+        Takes a queued job off the queue, or with `record` parks a running job
+        that just stopped. Paused jobs wait for resume() or remove().
+        Returns the record, None if the job was not queued.
+        """
+        with self._lock:
+            if record is None:
+                seq = self._unqueue(task_id)
+                if seq is None:
+                    return None
+                record = self._records[task_id]
+            else:
+                seq = next(self._seq)
+            self._records[task_id] = record
+            self._paused[task_id] = seq
+            return record
+
+    def resume(self, task_id):
+        """Puts a paused job back in the queue, where it was. Returns its record, or None."""
+        with self._lock:
+            seq = self._paused.pop(task_id, None)
+            if seq is None:
+                return None
+            record = self._records[task_id]
+            heapq.heappush(self._heap, (record["priority"], seq, task_id))
+            return record
+
+    def update(self, task_id, **fields):
+        """Changes the record of a waiting job (a new priority re-sorts the queue). Returns it, or None."""
+        with self._lock:
+            record = self._records.get(task_id)
+            if record is None:
+                return None
+            queued = task_id not in self._paused and any(entry[2] == task_id for entry in self._heap)
+            if not queued and task_id not in self._paused:
+                # Running: its record is not used any more
+                return None
+            record.update(fields)
+            if queued and "priority" in fields:
+                self._heap = [(record["priority"], seq, tid) if tid == task_id else (p, seq, tid)
+                              for p, seq, tid in self._heap]
+                heapq.heapify(self._heap)
+            return record
+
+    def paused(self):
+        """Task ids of the paused jobs."""
+        with self._lock:
+            return [task_id for task_id, _ in sorted(self._paused.items(), key=lambda item: item[1])]
+
+    def control(self, task_id, action, **fields):
+        """Asks the node running a task to apply `action` to it. False when there are no other nodes."""
+        return False
+
+    def snapshot(self, task_id):
+        """Last status of a task as the store knows it (None: ask the local bus)."""
+        return None
+
+    def stats(self):
+        return {"backend": self.name, "node": self.node, "queued": self.size(), "paused": len(self.paused())}
+
+
+class SharedStore(MemoryStore):
+    """
+    Base of the stores shared between nodes. Subclasses provide the queue
+    calls and six primitives: _write (one batch of events, also merged into
+    the stored status of each task), _load_snapshot, _cursor / _read (the
+    batches of the other nodes), _renew (the leases of this node's claims)
+    and _prune.
+    """
+
+    shared = True
+
+    def __init__(self, interval=0.1, finished_ttl=60, max_age=6 * 3600, lease=CLAIM_LEASE):
+        self.node = _node_id()
+        self.on_control = None
+        self.poll_interval = max(0.01, interval)
+        self.lease = lease
+        self.finished_ttl = finished_ttl
+        self.max_age = max_age
+        self.bus = None
+        self.sent = 0
+        self.received = 0
+        self.batches = 0
+        self._lock = threading.Lock()
+        self._pending = {}  # task_id -> [fields, replace], merged until the next batch
+        self._controls = []  # [task_id, fields, None], sent with the next batch
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, bus):
+        self.bus = bus
+        bus.replicate = self.record
+        self._stop.clear()
+        # Read before returning, so nothing written once the server is up gets skipped
+        cursor = self._cursor()
+        self._thread = threading.Thread(target=self._sync_forever, args=(cursor,), name="job-store", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        if self.bus is not None:
+            self.bus.replicate = None
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def record(self, task_id, fields, replace):
+        """Adds a local status change to the next batch. Thread-safe."""
+        with self._lock:
+            pending = self._pending.get(task_id)
+            if replace or pending is None:
+                self._pending[task_id] = [dict(fields), replace]
+            else:
+                pending[0].update(fields)
+        if replace or fields.get("state") in FINAL_STATES:
+            # State changes go out at once (only progress is batched), so a batch
+            # never lands after a newer state written by another node
+            self._wakeup.set()
+
+    def control(self, task_id, action, **fields):
+        with self._lock:
+            self._controls.append([task_id, {"action": action, **fields}, None])
+        self._wakeup.set()
+        return True
+
+    def snapshot(self, task_id):
+        return self._load_snapshot(task_id)
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "interval": self.poll_interval,
+            "sent": self.sent,
+            "received": self.received,
+            "batches": self.batches,
+        }
+
+    def _flush(self):
+        with self._lock:
+            if not self._pending and not self._controls:
+                return
+            pending, self._pending = self._pending, {}
+            controls, self._controls = self._controls, []
+        # replace=None marks a control message, it does not touch the stored status
+        self._write([[task_id, fields, replace] for task_id, (fields, replace) in pending.items()] + controls)
+        self.sent += len(pending) + len(controls)
+        self.batches += 1
+
+    def _sync_forever(self, cursor):
+        pruned = renewed = time.monotonic()
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            stopping = self._stop.is_set()
+            try:
+                self._flush()
+                if stopping:
+                    break
+                cursor, events = self._read(cursor)
+                for task_id, fields, replace in events:
+                    if replace is not None:
+                        self.bus.publish_remote(task_id, fields, replace)
+                    elif self.on_control is not None:
+                        self.on_control(task_id, fields)
+                self.received += len(events)
+                if time.monotonic() - renewed > self.lease / 3:
+                    renewed = time.monotonic()
+                    self._renew()
+                if time.monotonic() - pruned > 30:
+                    pruned = time.monotonic()
+                    self._prune()
+            except Exception as e:
+                log.warning(f"Job store sync failed: {e}", store=self.name)
+                if stopping:
+                    break
+                # Do not spin on a store that is down
+                self._stop.wait(1)
+
+    def _decode(self, origin, data):
+        """Events of one batch, unless this node wrote it."""
+        return [] if origin == self.node else json.loads(data)
+
+
+_SQLITE_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS queue (
+        task_id    TEXT PRIMARY KEY,
+        priority   INTEGER NOT NULL,
+        record     TEXT NOT NULL,
+        claimed_by TEXT,
+        claimed_at REAL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS queue_order ON queue (priority) WHERE claimed_by IS NULL",
+    """
+    CREATE TABLE IF NOT EXISTS events (
+        id         INTEGER PRIMARY KEY AUTOINCREMENT,
+        origin     TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        data       TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS status (
+        task_id    TEXT PRIMARY KEY,
+        data       TEXT NOT NULL,
+        final      INTEGER NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    """,
+)
+
+
+class SQLiteStore(SharedStore):
+    """Shared through one SQLite file in WAL mode: every worker process on the host opens it."""
+
+    name = "sqlite"
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._db = None
+        self._db_lock = threading.Lock()
+
+    def _connection(self):
+        # Called with _db_lock held. Opened on first use, and again after close()
+        if self._db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            for statement in _SQLITE_SCHEMA:
+                self._db.execute(statement)
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(queue)")]
+            if "claimed_at" not in columns:
+                # Queue written before claims had a lease: those claims count as expired
+                self._db.execute("ALTER TABLE queue ADD COLUMN claimed_at REAL")
+        return self._db
+
+    def _execute(self, sql, params=()):
+        with self._db_lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    def _transaction(self, fn):
+        # BEGIN IMMEDIATE takes the write lock up front, so two nodes never claim the same row
+        with self._db_lock:
+            db = self._connection()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(db)
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+            return result
+
+    def close(self):
+        super().close()
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    # Rows claimed by a node whose lease ran out (paused rows are not claims)
+    _EXPIRED = "claimed_by IS NOT NULL AND claimed_by != ? AND (claimed_at IS NULL OR claimed_at < ?)"
+
+    def enqueue(self, record):
+        def insert(db):
+            # A job left by a dead node is queued again with the new record
+            db.execute(f"DELETE FROM queue WHERE task_id=? AND {self._EXPIRED}",
+                       (record["task_id"], PAUSED, time.time() - self.lease))
+            return db.execute(
+                "INSERT OR IGNORE INTO queue (task_id, priority, record) VALUES (?, ?, ?)",
+                (record["task_id"], record["priority"], json.dumps(record)),
+            ).rowcount == 1
+        return self._transaction(insert)
+
+    def claim(self):
+        def pop(db):
+            now = time.time()
+            db.execute(f"UPDATE queue SET claimed_by=NULL, claimed_at=NULL WHERE {self._EXPIRED}",
+                       (PAUSED, now - self.lease))
+            row = db.execute(
+                "SELECT task_id, record FROM queue WHERE claimed_by IS NULL ORDER BY priority, rowid LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE queue SET claimed_by=?, claimed_at=? WHERE task_id=?", (self.node, now, row[0]))
+            return json.loads(row[1])
+        return self._transaction(pop)
+
+    def queued(self):
+        rows = self._execute("SELECT task_id FROM queue WHERE claimed_by IS NULL ORDER BY priority, rowid")
+        return [r[0] for r in rows]
+
+    def size(self):
+        return self._execute("SELECT COUNT(*) FROM queue WHERE claimed_by IS NULL")[0][0]
+
+    def done(self, task_id):
+        self._execute("DELETE FROM queue WHERE task_id=?", (task_id,))
+
+    def remove(self, task_id):
+        def delete(db):
+            row = db.execute("SELECT record FROM queue WHERE task_id=? AND (claimed_by IS NULL OR claimed_by=?)",
+                             (task_id, PAUSED)).fetchone()
+            if row is None:
+                return None
+            db.execute("DELETE FROM queue WHERE task_id=?", (task_id,))
+            return json.loads(row[0])
+        return self._transaction(delete)
+
+    def pause(self, task_id, record=None):
+        def park(db):
+            if record is None:
+                row = db.execute("SELECT record FROM queue WHERE task_id=? AND claimed_by IS NULL",
+                                 (task_id,)).fetchone()
+                if row is None:
+                    return None
+                db.execute("UPDATE queue SET claimed_by=? WHERE task_id=?", (PAUSED, task_id))
+                return json.loads(row[0])
+            # A paused row keeps its place in the queue for when it is resumed
+            db.execute(
+                "INSERT INTO queue (task_id, priority, record, claimed_by) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(task_id) DO UPDATE SET priority=excluded.priority, record=excluded.record,"
+                " claimed_by=excluded.claimed_by, claimed_at=NULL",
+                (task_id, record["priority"], json.dumps(record), PAUSED),
+            )
+            return record
+        return self._transaction(park)
+
+    def resume(self, task_id):
+        def unpark(db):
+            row = db.execute("SELECT record FROM queue WHERE task_id=? AND claimed_by=?",
+                             (task_id, PAUSED)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE queue SET claimed_by=NULL, claimed_at=NULL WHERE task_id=?", (task_id,))
+            return json.loads(row[0])
+        return self._transaction(unpark)
+
+    def update(self, task_id, **fields):
+        def change(db):
+            row = db.execute("SELECT record FROM queue WHERE task_id=? AND (claimed_by IS NULL OR claimed_by=?)",
+                             (task_id, PAUSED)).fetchone()
+            if row is None:
+                return None
+            record = {**json.loads(row[0]), **fields}
+            db.execute("UPDATE queue SET priority=?, record=? WHERE task_id=?",
+                       (record["priority"], json.dumps(record), task_id))
+            return record
+        return self._transaction(change)
+
+    def paused(self):
+        return [r[0] for r in self._execute("SELECT task_id FROM queue WHERE claimed_by=? ORDER BY rowid", (PAUSED,))]
+
+    def _renew(self):
+        self._execute("UPDATE queue SET claimed_at=? WHERE claimed_by=?", (time.time(), self.node))
+
+    def _load_snapshot(self, task_id):
+        rows = self._execute("SELECT data FROM status WHERE task_id=?", (task_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def _write(self, events):
+        now = time.time()
+
+        def write(db):
+            db.execute("INSERT INTO events (origin, created_at, data) VALUES (?, ?, ?)",
+                       (self.node, now, json.dumps(events)))
+            for task_id, fields, replace in events:
+                if replace is None:
+                    continue
+                status = {}
+                if not replace:
+                    row = db.execute("SELECT data FROM status WHERE task_id=?", (task_id,)).fetchone()
+                    status = json.loads(row[0]) if row else {}
+                status.update(fields)
+                db.execute(
+                    "INSERT INTO status (task_id, data, final, updated_at) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT(task_id) DO UPDATE SET data=excluded.data, final=excluded.final,"
+                    " updated_at=excluded.updated_at",
+                    (task_id, json.dumps(status), status.get("state") in FINAL_STATES, now),
+                )
+        self._transaction(write)
+
+    def _cursor(self):
+        return self._execute("SELECT COALESCE(MAX(id), 0) FROM events")[0][0]
+
+    def _read(self, cursor):
+        events = []
+        for row_id, origin, data in self._execute(
+                "SELECT id, origin, data FROM events WHERE id > ? ORDER BY id", (cursor,)):
+            cursor = row_id
+            events.extend(self._decode(origin, data))
+        return cursor, events
+
+    def _prune(self):
+        now = time.time()
+        self._execute("DELETE FROM events WHERE created_at < ?", (now - EVENTS_KEEP,))
+        self._execute("DELETE FROM status WHERE (final AND updated_at < ?) OR updated_at < ?",
+                      (now - self.finished_ttl, now - self.max_age))
+
+
+class RedisStore(SharedStore):
+    """
+    Shared through Redis: the queue is a sorted set (score = priority, then
+    arrival order), records a hash, status batches a capped stream and the
+    last status of each task a hash (field -> JSON value) that expires like
+    the local entry does. Claimed jobs sit in a sorted set scored by the end
+    of their lease.
+    """
+
+    name = "redis"
+
+    def __init__(self, url=None, client=None, prefix="infinity", **kwargs):
+        super().__init__(**kwargs)
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("A redis:// job store needs the redis package (pip install redis)")
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.redis = client
+        self.keys = {name: f"{prefix}:{name}" for name in ("queue", "paused", "jobs", "seq", "events", "claims")}
+        self.prefix = prefix
+        self._claimed = set()  # task ids this node holds a lease on
+
+    def enqueue(self, record):
+        task_id = record["task_id"]
+        if not self.redis.hsetnx(self.keys["jobs"], task_id, json.dumps(record)):
+            if not self._orphaned(task_id):
+                return False
+            self.redis.hset(self.keys["jobs"], task_id, json.dumps(record))
+        seq = self.redis.incr(self.keys["seq"])
+        self.redis.zadd(self.keys["queue"], {task_id: record["priority"] * 1e12 + seq})
+        return True
+
+    def _orphaned(self, task_id):
+        # A known task nobody will run: its lease ran out, or it is nowhere (lost by an older claim())
+        lease = self.redis.zscore(self.keys["claims"], task_id)
+        if lease is not None:
+            return lease < time.time() and bool(self.redis.zrem(self.keys["claims"], task_id))
+        return self.redis.zscore(self.keys["queue"], task_id) is None \
+            and self.redis.hget(self.keys["paused"], task_id) is None
+
+    def claim(self):
+        self._reclaim()
+        for task_id in self.redis.zrange(self.keys["queue"], 0, 9):
+            # Leased before it leaves the queue, so a node dying in between cannot lose it.
+            # nx: another node is taking this one
+            if not self.redis.zadd(self.keys["claims"], {task_id: time.time() + self.lease}, nx=True):
+                continue
+            record = self._record(task_id)
+            if not self.redis.zrem(self.keys["queue"], task_id) or record is None:
+                # Removed or paused meanwhile
+                self.redis.zrem(self.keys["claims"], task_id)
+                continue
+            self._claimed.add(task_id)
+            return record
+        return None
+
+    def _reclaim(self):
+        """Puts the jobs whose lease ran out back at the head of their priority."""
+        for task_id in self.redis.zrangebyscore(self.keys["claims"], 0, time.time()):
+            # zrem returns 0 to the nodes that lost the race
+            if not self.redis.zrem(self.keys["claims"], task_id):
+                continue
+            record = self._record(task_id)
+            if record is not None:
+                self.redis.zadd(self.keys["queue"], {task_id: record["priority"] * 1e12}, nx=True)
+
+    def queued(self):
+        return list(self.redis.zrange(self.keys["queue"], 0, -1))
+
+    def size(self):
+        return self.redis.zcard(self.keys["queue"])
+
+    def done(self, task_id):
+        self.redis.hdel(self.keys["jobs"], task_id)
+        self._release(task_id)
+
+    def _release(self, task_id):
+        if task_id in self._claimed:
+            self._claimed.discard(task_id)
+            self.redis.zrem(self.keys["claims"], task_id)
+
+    def _renew(self):
+        claimed = list(self._claimed)
+        if claimed:
+            expires = time.time() + self.lease
+            self.redis.zadd(self.keys["claims"], {task_id: expires for task_id in claimed}, xx=True)
+
+    def _record(self, task_id):
+        data = self.redis.hget(self.keys["jobs"], task_id)
+        return json.loads(data) if data else None
+
+    def remove(self, task_id):
+        # zrem / hdel return 0 to the nodes that lost the race
+        if not (self.redis.zrem(self.keys["queue"], task_id) or self.redis.hdel(self.keys["paused"], task_id)):
+            return None
+        record = self._record(task_id)
+        self.done(task_id)
+        return record
+
+    def pause(self, task_id, record=None):
+        if record is None:
+            score = self.redis.zscore(self.keys["queue"], task_id)
+            if score is None or not self.redis.zrem(self.keys["queue"], task_id):
+                return None
+            record = self._record(task_id)
+        else:
+            self.redis.hset(self.keys["jobs"], task_id, json.dumps(record))
+            score = record["priority"] * 1e12 + self.redis.incr(self.keys["seq"])
+        self.redis.hset(self.keys["paused"], task_id, score)
+        self._release(task_id)
+        return record
+
+    def resume(self, task_id):
+        score = self.redis.hget(self.keys["paused"], task_id)
+        if score is None or not self.redis.hdel(self.keys["paused"], task_id):
+            return None
+        self.redis.zadd(self.keys["queue"], {task_id: float(score)})
+        return self._record(task_id)
+
+    def update(self, task_id, **fields):
+        record = self._record(task_id)
+        if record is None:
+            return None
+        queued = self.redis.zscore(self.keys["queue"], task_id)
+        paused = self.redis.hget(self.keys["paused"], task_id)
+        if queued is None and paused is None:
+            return None
+        record.update(fields)
+        self.redis.hset(self.keys["jobs"], task_id, json.dumps(record))
+        if "priority" in fields:
+            # Same arrival order, new priority
+            seq = float(queued if queued is not None else paused) % 1e12
+            score = record["priority"] * 1e12 + seq
+            if queued is not None:
+                self.redis.zadd(self.keys["queue"], {task_id: score}, xx=True)
+            else:
+                self.redis.hset(self.keys["paused"], task_id, score)
+        return record
+
+    def paused(self):
+        return list(self.redis.hkeys(self.keys["paused"]))
+
+    def _load_snapshot(self, task_id):
+        status = self.redis.hgetall(f"{self.prefix}:status:{task_id}")
+        return {k: json.loads(v) for k, v in status.items()} if status else None
+
+    def _write(self, events):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.xadd(self.keys["events"], {"origin": self.node, "data": json.dumps(events)},
+                  maxlen=10000, approximate=True)
+        for task_id, fields, replace in events:
+            if replace is None:
+                continue
+            key = f"{self.prefix}:status:{task_id}"
+            if replace:
+                pipe.delete(key)
+            if fields:
+                pipe.hset(key, mapping={k: json.dumps(v) for k, v in fields.items()})
+            ttl = self.finished_ttl if fields.get("state") in FINAL_STATES else self.max_age
+            pipe.expire(key, max(1, int(ttl)))
+        pipe.execute()
+
+    def _cursor(self):
+        last = self.redis.xrevrange(self.keys["events"], count=1)
+        return last[0][0] if last else "0-0"
+
+    def _read(self, cursor):
+        events = []
+        for _, entries in self.redis.xread({self.keys["events"]: cursor}, count=1000) or ():
+            for entry_id, fields in entries:
+                cursor = entry_id
+                events.extend(self._decode(fields["origin"], fields["data"]))
+        return cursor, events
+
+    def _prune(self):
+        # The stream is capped on write and status keys expire by themselves
+        pass
+
+
+class FakeRedis:
+    """
+    In-process stand-in for the few Redis commands RedisStore uses (same
+    signatures as redis-py with decode_responses=True). Two RedisStores on one
+    FakeRedis behave like two nodes on one server.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._data = {}
+        self._expires = {}
+        self._stream_seq = itertools.count(1)
+
+    def _get(self, key, default):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return self._data.setdefault(key, default) if default is not None else self._data.get(key)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._expires.pop(key, None)
+            return sum(1 for key in keys if self._data.pop(key, None) is not None)
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if self._get(key, None) is None:
+                return False
+            self._expires[key] = time.monotonic() + seconds
+            return True
+
+    def incr(self, key):
+        with self._lock:
+            self._data[key] = int(self._get(key, None) or 0) + 1
+            return self._data[key]
+
+    def hsetnx(self, key, field, value):
+        with self._lock:
+            h = self._get(key, {})
+            if field in h:
+                return 0
+            h[field] = value
+            return 1
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        with self._lock:
+            h = self._get(key, {})
+            items = dict(mapping or {})
+            if field is not None:
+                items[field] = value
+            added = sum(1 for f in items if f not in h)
+            h.update(items)
+            return added
+
+    def hget(self, key, field):
+        with self._lock:
+            return self._get(key, {}).get(field)
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._get(key, None) or {})
+
+    def hkeys(self, key):
+        with self._lock:
+            return list(self._get(key, None) or {})
+
+    def hdel(self, key, *fields):
+        with self._lock:
+            h = self._get(key, {})
+            return sum(1 for f in fields if h.pop(f, None) is not None)
+
+    def zadd(self, key, mapping, nx=False, xx=False):
+        with self._lock:
+            z = self._get(key, {})
+            if xx:
+                mapping = {m: score for m, score in mapping.items() if m in z}
+            if nx:
+                mapping = {m: score for m, score in mapping.items() if m not in z}
+            added = sum(1 for m in mapping if m not in z)
+            z.update(mapping)
+            return added
+
+    def zrem(self, key, *members):
+        with self._lock:
+            z = self._get(key, {})
+            return sum(1 for m in members if z.pop(m, None) is not None)
+
+    def zscore(self, key, member):
+        with self._lock:
+            return self._get(key, {}).get(member)
+
+    def zpopmin(self, key, count=1):
+        with self._lock:
+            z = self._get(key, {})
+            popped = sorted(z.items(), key=lambda kv: (kv[1], kv[0]))[:count]
+            for member, _ in popped:
+                del z[member]
+            return popped
+
+    def zrange(self, key, start, end):
+        with self._lock:
+            members = [m for m, _ in sorted(self._get(key, {}).items(), key=lambda kv: (kv[1], kv[0]))]
+            return members[start:] if end == -1 else members[start:end + 1]
+
+    def zrangebyscore(self, key, min, max):
+        with self._lock:
+            return [m for m, score in sorted(self._get(key, {}).items(), key=lambda kv: (kv[1], kv[0]))
+                    if min <= score <= max]
+
+    def zcard(self, key):
+        with self._lock:
+            return len(self._get(key, {}))
+
+    def xadd(self, key, fields, maxlen=None, approximate=True):
+        with self._lock:
+            stream = self._get(key, [])
+            entry_id = f"{next(self._stream_seq)}-0"
+            stream.append((entry_id, dict(fields)))
+            if maxlen and len(stream) > maxlen:
+                del stream[:len(stream) - maxlen]
+            return entry_id
+
+    def xrevrange(self, key, count=None):
+        with self._lock:
+            return list(reversed(self._get(key, [])))[:count]
+
+    def xread(self, streams, count=None, block=None):
+        with self._lock:
+            result = []
+            for key, last in streams.items():
+                after = int(str(last).split("-")[0])
+                entries = [e for e in self._get(key, []) if int(e[0].split("-")[0]) > after][:count]
+                if entries:
+                    result.append([key, entries])
+            return result
+
+    def pipeline(self, transaction=True):
+        return _FakePipeline(self)
+
+
+class _FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        return lambda *args, **kwargs: self.calls.append((method, args, kwargs))
+
+    def execute(self):
+        calls, self.calls = self.calls, []
+        return [method(*args, **kwargs) for method, args, kwargs in calls]
+
+
+def open_store(url, interval=0.1, finished_ttl=60, max_age=6 * 3600, lease=CLAIM_LEASE):
+    """Builds the store for INFINITY_JOB_STORE (see the module docstring). Raises ValueError."""
+    url = (url or "memory").strip()
+    options = {"interval": interval, "finished_ttl": finished_ttl, "max_age": max_age, "lease": lease}
+    if url == "memory":
+        return MemoryStore()
+    if url.startswith("sqlite://"):
+        return SQLiteStore(url[len("sqlite://"):], **options)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore(url, **options)
+    if url == "fake":
+        return RedisStore(client=FakeRedis(), **options)
+    raise ValueError(f"Unknown job store: {url!r} (memory, sqlite:///path, redis://host or fake)")
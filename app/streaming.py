@@ -0,0 +1,351 @@
+"""
+Streams media straight to an HTTP client without touching the server's disk.
+
+Single-stream formats (audio only, progressive video) are a byte pass-through
+of the upstream response, so Range requests (single ranges, suffix ones too)
+work and the first bytes go out as soon as the CDN answers. Video+audio selections are remuxed by FFmpeg,
+which reads both streams itself and writes fragmented MP4 to a pipe.
+
+Every chunk is pulled only when the previous one was sent, so memory stays at
+one chunk per stream whatever the file size.
+"""
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from . import config, log
+from .catalog import is_audio_only
+from .downloader import extract_metadata, get_ffmpeg_path, resolve_format, ydl_pool
+from .metrics import STAGE_SECONDS
+
+CHUNK = 64 * 1024
+MIME_TYPES = {
+    "mp4": "video/mp4", "m4a": "audio/mp4", "webm": "video/webm",
+    "mp3": "audio/mpeg", "ogg": "audio/ogg", "opus": "audio/ogg",
+}
+
+# Blocking reads run here; one thread per stream so a slow client never starves the others
+_readers = ThreadPoolExecutor(config.MAX_STREAMS, thread_name_prefix="stream")
+_slots = threading.BoundedSemaphore(config.MAX_STREAMS)
+
+
+class StreamError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers
+
+
+def source_url(video_id, url=None):
+    """The page URL to extract: an explicit `url`, else a YouTube video id."""
+    if url:
+        return url
+    if not re.fullmatch(r'[\w-]{11}', video_id):
+        raise StreamError(400, "Not a YouTube video id; pass the page as ?url=")
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def parse_range(header):
+    """
+    'bytes=start-end' / 'bytes=start-' -> (start, end or None),
+    'bytes=-length' (the last `length` bytes) -> (None, length).
+    None when absent or not usable (multi ranges, end before start): the
+    whole file is sent then, as RFC 9110 allows.
+    """
+    m = re.fullmatch(r'bytes=(\d*)-(\d*)', (header or "").strip())
+    if not m or not (m.group(1) or m.group(2)):
+        return None
+    if not m.group(1):
+        return None, int(m.group(2))
+    start, end = int(m.group(1)), int(m.group(2)) if m.group(2) else None
+    if end is not None and end < start:
+        return None
+    return start, end
+
+
+def resolve_range(byte_range, total):
+    """(first, last) byte of a parsed range in a file of `total` bytes. Raises StreamError(416)."""
+    start, end = byte_range
+    if start is None:
+        # The last `end` bytes (none for "bytes=-0")
+        start, end = (max(0, total - end), None) if end else (total, None)
+    if start >= total:
+        raise StreamError(416, "Requested range is not satisfiable", {"Content-Range": f"bytes */{total}"})
+    return start, total - 1 if end is None else min(end, total - 1)
+
+
+def select_formats(info, format_id):
+    """
+    Picks the formats the same way run_download does.
+    Returns a list of one format (pass-through) or two (video + audio).
+    """
+    if format_id == "best_audio":
+        spec = 'bestaudio/best'
+    elif is_audio_only(info, format_id):
+        spec = format_id
+    else:
+        spec = f"{format_id}+bestaudio/best"
+    formats = info.get('formats') or []
+    # The context yt-dlp hands its format selectors
+    ctx = {
+        'formats': formats,
+        'has_merged_format': any('none' not in (f.get('acodec'), f.get('vcodec')) for f in formats),
+        'incomplete_formats': (all(f.get('vcodec') == 'none' for f in formats)
+                               or all(f.get('acodec') == 'none' for f in formats)),
+    }
+    with ydl_pool.acquire('metadata') as ydl:
+        selected = list(ydl.build_format_selector(spec)(ctx))
+    if not selected:
+        raise StreamError(404, f"Requested format is not available: {format_id}")
+    chosen = selected[-1]
+    parts = chosen.get('requested_formats') or [chosen]
+    # "best+bestaudio" can resolve to the same progressive file twice
+    if len(parts) == 2 and parts[0].get('format_id') == parts[1].get('format_id'):
+        parts = parts[:1]
+    return list(parts)
+
+
+def _content_name(info, ext):
+    title = re.sub(r'[\\/:*?"<>|\r\n]+', '_', info.get('title') or info.get('id') or 'video')
+    return f"{title}.{ext}"
+
+
+class PassThrough:
+    """
+    Relays one http(s) format, honouring the client's Range.
+    A satisfied range is answered with 206; when the file size cannot be
+    found out the range is ignored and the whole file sent with 200.
+    Formats that yt-dlp downloads in chunks (`http_chunk_size`, YouTube
+    throttles long single requests) are fetched in ranged windows as well.
+    """
+
+    def __init__(self, fmt, byte_range=None):
+        self.fmt = fmt
+        self.byte_range = byte_range
+        self.start, self.end = 0, None
+        self.window = (fmt.get('downloader_options') or {}).get('http_chunk_size')
+        self.total = None
+        self._lease = None
+        self._ydl = None
+        self._resp = None
+
+    def _request(self, start, stop=None):
+        from yt_dlp.networking import Request
+
+        stop = self.end if stop is None else stop
+        if self.window:
+            stop = start + self.window - 1 if stop is None else min(stop, start + self.window - 1)
+        headers = dict(self.fmt.get('http_headers') or {})
+        if start or stop is not None:
+            headers['Range'] = f"bytes={start}-{'' if stop is None else stop}"
+        return self._ydl.urlopen(Request(self.fmt['url'], headers=headers))
+
+    @staticmethod
+    def _total_of(resp):
+        """File size an upstream response tells, or None."""
+        m = re.search(r'/(\d+)$', resp.headers.get('Content-Range') or '')
+        if m:
+            return int(m.group(1))
+        if resp.headers.get('Content-Length') and resp.status == 200:
+            return int(resp.headers['Content-Length'])
+        return None
+
+    def _probe_total(self):
+        # One byte, for the size a suffix range needs before the real request
+        resp = self._request(0, 0)
+        try:
+            return self._total_of(resp)
+        finally:
+            resp.close()
+
+    def open(self):
+        """Sends the first upstream request. Returns (status, headers) for the client."""
+        # yt-dlp is loaded lazily (see ydl_pool); the lease below has imported it by now
+        from yt_dlp.networking.exceptions import HTTPError
+
+        self._lease = ydl_pool.acquire('metadata')
+        self._ydl = self._lease.__enter__()
+        ranged = self.byte_range is not None
+        try:
+            if ranged and self.byte_range[0] is None:
+                self.total = self._probe_total() or self.fmt.get('filesize')
+                if self.total:
+                    self.start, self.end = resolve_range(self.byte_range, self.total)
+                else:
+                    ranged = False
+            elif ranged:
+                self.start, self.end = self.byte_range
+            sent_range = bool(self.start or self.end is not None or self.window)
+            self._resp = self._request(self.start)
+            if sent_range and self._resp.status == 200:
+                # Range ignored upstream: the body is the whole file, sent as such (in one request)
+                self.start, self.end = 0, None
+                self.window = None
+                ranged = False
+            self.total = self._total_of(self._resp) or self.total or self.fmt.get('filesize')
+            if ranged and not self.total:
+                # No valid Content-Range without the size: send the whole file instead
+                ranged = False
+                if self.start or self.end is not None:
+                    self._resp.close()
+                    self.start, self.end = 0, None
+                    self._resp = self._request(0)
+            if ranged:
+                self.start, self.end = resolve_range((self.start, self.end), self.total)
+        except StreamError:
+            self.close()
+            raise
+        except Exception as e:
+            self.close()
+            if isinstance(e, HTTPError) and e.status == 416:
+                total = self._total_of(e.response)
+                raise StreamError(416, "Requested range is not satisfiable",
+                                  {"Content-Range": f"bytes */{total}"} if total else None)
+            raise StreamError(502, f"Upstream request failed: {e}")
+
+        ext = self.fmt.get('ext') or 'mp4'
+        headers = {"Accept-Ranges": "bytes", "Content-Type": MIME_TYPES.get(ext, "application/octet-stream")}
+        if ranged:
+            headers["Content-Length"] = str(self.end - self.start + 1)
+            headers["Content-Range"] = f"bytes {self.start}-{self.end}/{self.total}"
+            return 206, headers
+        if self.total:
+            headers["Content-Length"] = str(self.total)
+        return 200, headers
+
+    def read(self):
+        """Next chunk, or b'' at the end. Blocking."""
+        from yt_dlp.networking.exceptions import HTTPError
+
+        while self._resp is not None:
+            chunk = self._resp.read(CHUNK)
+            if chunk and self.end is not None:
+                # Never past the range announced to the client, whatever upstream sends
+                chunk = chunk[:max(0, self.end + 1 - self.start)]
+            if chunk:
+                self.start += len(chunk)
+                return chunk
+            self._resp.close()
+            self._resp = None
+            done = (self.end is not None and self.start > self.end) or \
+                   (self.total is not None and self.start >= self.total)
+            if self.window and not done:
+                try:
+                    self._resp = self._request(self.start)
+                except HTTPError as e:
+                    # Size was unknown and the last window ended exactly at EOF
+                    if e.status != 416:
+                        raise
+        return b''
+
+    def close(self):
+        if self._resp is not None:
+            self._resp.close()
+            self._resp = None
+        if self._lease is not None:
+            self._lease.__exit__(None, None, None)
+            self._lease = None
+
+
+class Remux:
+    """FFmpeg reads the selected streams and writes fragmented MP4 to stdout."""
+
+    def __init__(self, formats):
+        self.formats = formats
+        self.proc = None
+
+    def command(self, ffmpeg):
+        cmd = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin']
+        for fmt in self.formats:
+            headers = ''.join(f"{k}: {v}\r\n" for k, v in (fmt.get('http_headers') or {}).items())
+            if headers:
+                cmd += ['-headers', headers]
+            cmd += ['-i', fmt['url']]
+        if len(self.formats) == 2:
+            cmd += ['-map', '0:v:0', '-map', '1:a:0']
+        cmd += [
+            '-c', 'copy',
+            '-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+            'pipe:1',
+        ]
+        return cmd
+
+    def open(self):
+        ffmpeg = get_ffmpeg_path()
+        if not ffmpeg:
+            raise StreamError(501, "FFmpeg is required to stream merged formats")
+        self.proc = subprocess.Popen(
+            self.command(ffmpeg), stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0,
+        )
+        # Length is unknown until FFmpeg is done, so no Range here
+        return 200, {"Accept-Ranges": "none", "Content-Type": "video/mp4"}
+
+    def read(self):
+        return self.proc.stdout.read(CHUNK)
+
+    def close(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.kill()
+        if self.proc is not None:
+            self.proc.wait()
+            self.proc.stdout.close()
+        self.proc = None
+
+
+async def open_stream(loop, video_id, format_id="best", url=None, range_header=None):
+    """
+    Resolves the formats and opens the source.
+    Returns (status, headers, body iterator). Raises StreamError.
+    """
+    if not _slots.acquire(blocking=False):
+        raise StreamError(503, "Too many streams in progress, try again shortly")
+    started = time.perf_counter()
+    source = None
+    try:
+        page = source_url(video_id, url)
+        info = await loop.run_in_executor(_readers, extract_metadata, page)
+        try:
+            format_id = await loop.run_in_executor(_readers, resolve_format, page, format_id)
+        except ValueError as e:
+            raise StreamError(404, str(e))
+        formats = await loop.run_in_executor(_readers, select_formats, info, format_id)
+
+        passthrough = len(formats) == 1 and formats[0].get('protocol') in ('http', 'https')
+        if passthrough:
+            source = PassThrough(formats[0], parse_range(range_header))
+            ext = formats[0].get('ext') or 'mp4'
+        else:
+            source = Remux(formats)
+            ext = 'mp4'
+        status, headers = await loop.run_in_executor(_readers, source.open)
+        headers["Content-Disposition"] = f"inline; filename*=UTF-8''{quote(_content_name(info, ext), safe='')}"
+    except Exception:
+        if source is not None:
+            source.close()
+        _slots.release()
+        raise
+
+    mode = "passthrough" if passthrough else "remux"
+    log.debug("Streaming to client", video=video_id, format=format_id, mode=mode)
+
+    async def body():
+        first = True
+        try:
+            while True:
+                chunk = await loop.run_in_executor(_readers, source.read)
+                if not chunk:
+                    break
+                if first:
+                    STAGE_SECONDS.observe(time.perf_counter() - started, stage="stream_first_byte", detail=mode)
+                    first = False
+                # Starlette awaits the socket write before asking for more: that is the backpressure
+                yield chunk
+        finally:
+            await loop.run_in_executor(_readers, source.close)
+            _slots.release()
+
+    return status, headers, body()
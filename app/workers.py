@@ -0,0 +1,95 @@
+"""
+Process-pool execution backend.
+yt-dlp's Python-side work (signature deciphering, player JSON parsing, format
+selection) holds the GIL; running it in worker processes keeps the uvicorn
+event loop responsive and lets extraction scale with cores.
+
+The parent keeps everything stateful (cache, single-flight, journal, event
+bus). Only the heavy calls are shipped to a worker; their status updates
+come back over a multiprocessing queue and are re-published in the parent.
+Stop requests (cancel / pause) go the other way through a managed dict the
+workers' hooks read.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from . import downloader, metrics
+
+# Set inside each worker process by _init_worker
+_worker_pp_slots = None
+
+
+def _init_worker(events, pp_slots, stops):
+    global _worker_pp_slots
+    _worker_pp_slots = pp_slots
+    downloader.stop_requests = stops
+    downloader.status_sink = lambda task_id, fields, replace: events.put(("status", task_id, fields, replace))
+    metrics.forward = lambda name, value, labels: events.put(("metric", name, value, labels))
+
+
+class WorkerError(Exception):
+    """An exception raised inside a worker, reduced to its message."""
+
+
+def _call_in_worker(fn, args, kwargs):
+    # Process-local objects (the converter semaphore) cannot be pickled: use the worker's copy
+    if "pp_slots" in kwargs:
+        kwargs["pp_slots"] = _worker_pp_slots
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        # yt-dlp errors carry tracebacks, which cannot cross the process boundary
+        raise WorkerError(str(e)) from None
+
+
+class ProcessBackend:
+    def __init__(self, workers, max_postprocess):
+        ctx = multiprocessing.get_context("spawn")
+        self.events = ctx.Queue()
+        self.pp_slots = ctx.BoundedSemaphore(max_postprocess)
+        # task_id -> "cancel" / "pause", written by the parent (downloader.request_stop)
+        self.manager = ctx.Manager()
+        self.stops = self.manager.dict()
+        downloader.stop_relay = self.stops
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(self.events, self.pp_slots, self.stops),
+        )
+        self._relay = threading.Thread(target=self._relay_events, name="worker-events", daemon=True)
+        self._relay.start()
+
+    def call(self, fn, *args, **kwargs):
+        """Runs fn in a worker process and blocks until it returns (drop-in for downloader.run_heavy)."""
+        if "pp_slots" in kwargs:
+            kwargs["pp_slots"] = None
+        return self.pool.submit(_call_in_worker, fn, args, kwargs).result()
+
+    def _relay_events(self):
+        while True:
+            item = self.events.get()
+            if item is None:
+                break
+            kind, *item = item
+            if kind == "metric":
+                metrics.registry.apply(*item)
+                continue
+            task_id, fields, replace = item
+            # Parent-side publish also mirrors to single-flight followers
+            if replace:
+                downloader.set_status(task_id, fields)
+                downloader.progress_tracker.forget(task_id)
+            else:
+                if fields.get("downloaded_bytes") is not None:
+                    downloader.progress_tracker.record(task_id, fields)
+                    # Workers never open the journal, the parent writes the progress
+                    downloader.job_journal.progress(task_id, fields["downloaded_bytes"], fields.get("total_bytes"))
+                downloader.update_status(task_id, fields)
+
+    def close(self):
+        downloader.stop_relay = None
+        self.pool.shutdown(wait=False)
+        self.events.put(None)
+        self.manager.shutdown()
@@ -0,0 +1,216 @@
+"""
+Framing of the /ws channel.
+
+Classic mode (the default) is what the web UI speaks: one JSON object per
+message, status updates tagged with their task_id.
+
+A client switches to the compact mode by sending a hello first:
+
+    {"action": "hello", "protocol": "compact", "encoding": "msgpack", "interval": 250}
+
+The reply (always JSON text) says what was granted, then:
+1. Status updates of all the connection's tasks go out together, one frame
+   per `interval` ms: {"u": [[handle, {short key: value}], ...]}. A final
+   state is flushed at once.
+2. A task is named by a small integer handle; new handles come first in the
+   frame that uses them: {"h": [[handle, task_id]], "u": [...]}. A handle is
+   dropped after the task's final state.
+3. Only fields that differ from what this connection last received are
+   sent, under the short keys listed in the hello reply (others as-is).
+4. With encoding "msgpack" (needs the msgpack package) every frame is a
+   binary MessagePack message, otherwise compact JSON text. The client may
+   send either.
+5. fetch_info results list formats as columns and rows, without the
+   `size` strings (`filesize_bytes` carries the same).
+
+Compression is permessage-deflate, negotiated by the server itself when the
+client offers it (INFINITY_WS_DEFLATE).
+"""
+import asyncio
+import itertools
+import json
+import time
+
+from starlette.websockets import WebSocketDisconnect
+
+from . import config
+from .events import FINAL_STATES
+from .metrics import STAGE_SECONDS, WS_BYTES, WS_MESSAGES
+
+KEYS = {
+    "state": "s",
+    "message": "m",
+    "downloaded_bytes": "d",
+    "total_bytes": "t",
+    "total_is_estimate": "te",
+    "speed": "v",
+    "eta": "eta",
+    "throughput": "r",
+    "fragment_index": "fi",
+    "fragment_count": "fc",
+    "position": "q",
+    "filename": "f",
+    "file_path": "p",
+    "batch_id": "b",
+    "index": "i",
+    "item": "it",
+}
+# Sent as integers: sub-byte and sub-second precision is noise for a progress bar
+_ROUNDED = ("speed", "eta", "throughput")
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Channel:
+    """One /ws connection: encodes outgoing messages and, in compact mode, batches task updates."""
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.compact = False
+        self.encoding = "json"
+        self.interval = config.WS_FRAME_INTERVAL_MS / 1000
+        self._handles = {}   # task_id -> handle, until the task's final state went out
+        self._sent = {}      # task_id -> fields as this client last received them
+        self._pending = {}   # task_id -> fields changed since the last frame
+        self._counter = itertools.count(1)
+        self._wakeup = asyncio.Event()
+        self._urgent = asyncio.Event()
+        self._flusher = None
+
+    def negotiate(self, hello):
+        """Applies a hello message, returns the reply."""
+        if hello.get("protocol") == "compact":
+            self.compact = True
+            if hello.get("encoding") == "msgpack" and msgpack is not None:
+                self.encoding = "msgpack"
+            try:
+                self.interval = min(5.0, max(0.02, float(hello["interval"]) / 1000))
+            except (KeyError, TypeError, ValueError):
+                pass
+            if self._flusher is None:
+                self._flusher = asyncio.create_task(self._flush_forever())
+        offered = "permessage-deflate" in self.websocket.headers.get("sec-websocket-extensions", "")
+        reply = {
+            "action": "hello",
+            "protocol": "compact" if self.compact else "classic",
+            "encoding": self.encoding,
+            "deflate": bool(config.WS_DEFLATE and offered),
+        }
+        if self.compact:
+            reply["interval"] = round(self.interval * 1000)
+            reply["keys"] = {short: name for name, short in KEYS.items()}
+        return reply
+
+    async def receive(self):
+        """Next client message, JSON text or (compact mode) a MessagePack binary frame."""
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        if message.get("bytes") is not None:
+            if msgpack is None:
+                raise ValueError("Binary frames need the msgpack package")
+            return msgpack.unpackb(message["bytes"])
+        return json.loads(message["text"])
+
+    async def send(self, message, action=None):
+        """Sends one message right away (replies, fetch results, batch events)."""
+        started = time.perf_counter()
+        if self.encoding == "msgpack":
+            data = msgpack.packb(message)
+            await self.websocket.send_bytes(data)
+            size = len(data)
+        else:
+            text = json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+            await self.websocket.send_text(text)
+            size = len(text.encode("utf-8"))
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="ws_send")
+        WS_BYTES.inc(size, protocol="compact" if self.compact else "classic")
+        if action:
+            WS_MESSAGES.inc(direction="out", action=action)
+
+    async def update(self, task_id, delta):
+        """A task's changed fields: sent now in classic mode, batched into the next frame in compact mode."""
+        if not self.compact:
+            await self.send({"task_id": task_id, **delta}, action="status")
+            return
+        self._pending.setdefault(task_id, {}).update(delta)
+        if delta.get("state") in FINAL_STATES:
+            self._urgent.set()
+        self._wakeup.set()
+
+    async def emit(self, event):
+        """Batch runner events: task-tagged ones are status updates like any other."""
+        if self.compact and event.get("task_id"):
+            fields = dict(event)
+            await self.update(fields.pop("task_id"), fields)
+        else:
+            await self.send(event, action="batch")
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+
+    async def _flush_forever(self):
+        while True:
+            await self._wakeup.wait()
+            # Let the other tasks' changes pile up (a final state goes out at once)
+            if not self._urgent.is_set():
+                try:
+                    await asyncio.wait_for(self._urgent.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            self._urgent.clear()
+            frame = self._frame()
+            if frame:
+                await self.send(frame, action="frame")
+
+    def _frame(self):
+        new = []
+        updates = []
+        pending, self._pending = self._pending, {}
+        for task_id, delta in pending.items():
+            handle = self._handles.get(task_id)
+            if handle is None:
+                handle = self._handles[task_id] = next(self._counter)
+                self._sent[task_id] = {}
+                new.append([handle, task_id])
+            sent = self._sent[task_id]
+            fields = {}
+            for key, value in delta.items():
+                if key in _ROUNDED and isinstance(value, float):
+                    value = round(value)
+                if key in sent and sent[key] == value:
+                    continue
+                sent[key] = value
+                fields[KEYS.get(key, key)] = value
+            if fields:
+                updates.append([handle, fields])
+            if delta.get("state") in FINAL_STATES:
+                del self._handles[task_id]
+                del self._sent[task_id]
+        if not new and not updates:
+            return None
+        if new:
+            return {"h": new, "u": updates}
+        return {"u": updates}
+
+
+def compact_info(result):
+    """fetch_info result with the format lists as columns + rows, minus the size strings."""
+    formats = result.get("formats")
+    if not isinstance(formats, dict):
+        return result
+    tables = {}
+    for kind, rows in formats.items():
+        columns = []
+        for row in rows:
+            for key in row:
+                if key != "size" and key not in columns:
+                    columns.append(key)
+        tables[kind] = {"columns": columns, "rows": [[row.get(key) for key in columns] for row in rows]}
+    return {**result, "formats": tables}
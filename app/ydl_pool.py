@@ -0,0 +1,175 @@
+import queue
+import threading
+from contextlib import contextmanager
+
+# Imported on first use (see _yt_dlp), it is by far the slowest import of the app
+yt_dlp = None
+
+# Params that yt-dlp derives state from at construction time and need
+# extra work when overridden per call
+_DERIVED = ("format", "outtmpl", "overwrites")
+_MISSING = object()
+
+
+def _yt_dlp():
+    global yt_dlp
+    if yt_dlp is None:
+        import yt_dlp as module
+        yt_dlp = module
+    return yt_dlp
+
+
+class _Lease:
+    """Per-checkout hooks, called through the instance's permanent dispatchers."""
+
+    def __init__(self):
+        self.progress_hooks = []
+        self.postprocessor_hooks = []
+
+
+class YDLPool:
+    """
+    Thread-safe pool of pre-built YoutubeDL instances, one free list per
+    option profile (e.g. 'metadata', 'merge', 'flat').
+    Reusing an instance keeps its loaded extractors, player JS / signature
+    caches, cookies and its keep-alive HTTP connection pool.
+
+    Each checkout is exclusive. Per-call overrides (outtmpl, format, hooks,
+    ...) are applied on checkout and rolled back on return.
+    """
+
+    def __init__(self, profiles, max_idle=4):
+        # profile name -> callable returning the YoutubeDL params for it
+        self.profiles = profiles
+        self.max_idle = max_idle
+        self._idle = {name: queue.LifoQueue() for name in profiles}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def _create(self, profile):
+        params = dict(self.profiles[profile]())
+        lease_ref = [None]
+
+        def dispatch_progress(d):
+            lease = lease_ref[0]
+            if lease is not None:
+                for hook in lease.progress_hooks:
+                    hook(d)
+
+        def dispatch_postprocessor(d):
+            lease = lease_ref[0]
+            if lease is not None:
+                for hook in lease.postprocessor_hooks:
+                    hook(d)
+
+        params['progress_hooks'] = [dispatch_progress]
+        params['postprocessor_hooks'] = [dispatch_postprocessor]
+        ydl = _yt_dlp().YoutubeDL(params)
+        ydl._pool_lease = lease_ref
+        ydl._pool_profile = profile
+        ydl._pool_defaults = {k: ydl.params.get(k) for k in _DERIVED}
+        with self._lock:
+            self.created += 1
+        return ydl
+
+    def warm(self, profile, count=1):
+        """Builds `count` idle instances ahead of the first request."""
+        for _ in range(count):
+            ydl = self._create(profile)
+            # Loads the extractor classes now instead of on the first URL
+            ydl.get_info_extractor('Youtube')
+            self._release(ydl)
+
+    @contextmanager
+    def acquire(self, profile, progress_hooks=(), postprocessor_hooks=(), **overrides):
+        """
+        Yields an exclusive YoutubeDL for `profile` with `overrides` applied
+        to its params for the duration of the block.
+        """
+        try:
+            ydl = self._idle[profile].get_nowait()
+            with self._lock:
+                self.reused += 1
+        except queue.Empty:
+            ydl = self._create(profile)
+
+        lease = _Lease()
+        lease.progress_hooks = list(progress_hooks)
+        lease.postprocessor_hooks = list(postprocessor_hooks)
+        saved = {k: ydl.params.get(k, _MISSING) for k in overrides}
+        healthy = False
+        try:
+            self._apply(ydl, overrides)
+            ydl._pool_lease[0] = lease
+            yield ydl
+            healthy = True
+        except _yt_dlp().utils.YoutubeDLError:
+            # Ordinary extraction/download failure, the instance itself is fine
+            healthy = True
+            raise
+        finally:
+            ydl._pool_lease[0] = None
+            try:
+                self._restore(ydl, saved)
+            except Exception:
+                healthy = False
+            if healthy:
+                self._release(ydl)
+            else:
+                # A failed call may leave half-written state behind: do not reuse
+                ydl.close()
+
+    def _apply(self, ydl, overrides):
+        for key, value in overrides.items():
+            ydl.params[key] = value
+        if "overwrites" in overrides:
+            if overrides["overwrites"] is None:
+                ydl.params.pop("overwrites", None)
+                ydl.params.pop("nooverwrites", None)
+            else:
+                ydl.params["nooverwrites"] = not overrides["overwrites"]
+        if "outtmpl" in overrides:
+            tmpl = overrides["outtmpl"]
+            ydl.params["outtmpl"] = dict(tmpl) if isinstance(tmpl, dict) else {"default": tmpl}
+            ydl._parse_outtmpl()
+        if "format" in overrides:
+            fmt = overrides["format"]
+            ydl.format_selector = fmt if fmt in (None, '-') or callable(fmt) else ydl.build_format_selector(fmt)
+
+    def _restore(self, ydl, saved):
+        restore = {}
+        for key, value in saved.items():
+            if value is _MISSING:
+                ydl.params.pop(key, None)
+            else:
+                restore[key] = value
+        # Derived state goes back to the profile defaults
+        for key in _DERIVED:
+            if key in saved:
+                restore[key] = ydl._pool_defaults[key]
+        if restore:
+            self._apply(ydl, restore)
+
+    def _release(self, ydl):
+        idle = self._idle[ydl._pool_profile]
+        if idle.qsize() >= self.max_idle:
+            ydl.close()
+        else:
+            idle.put(ydl)
+
+    def stats(self):
+        return {
+            "created": self.created,
+            "reused": self.reused,
+            "idle": {name: q.qsize() for name, q in self._idle.items()},
+        }
+
+    def close(self):
+        for idle in self._idle.values():
+            while True:
+                try:
+                    idle.get_nowait().close()
+                except queue.Empty:
+                    break
+
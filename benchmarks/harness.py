@@ -0,0 +1,71 @@
+import asyncio
+import sys
+import time
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None if empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(latencies):
+    """p50/p90/p99/max/mean of a list of seconds, in milliseconds."""
+    if not latencies:
+        return {"count": 0}
+    ms = [v * 1000 for v in latencies]
+    return {
+        "count": len(ms),
+        "p50_ms": round(percentile(ms, 50), 2),
+        "p90_ms": round(percentile(ms, 90), 2),
+        "p99_ms": round(percentile(ms, 99), 2),
+        "max_ms": round(max(ms), 2),
+        "mean_ms": round(sum(ms) / len(ms), 2),
+    }
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB (None where unsupported)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class LoopLagProbe:
+    """
+    Measures event-loop responsiveness: repeatedly sleeps `interval` and
+    records how late it woke up.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.lags = []
+        self._running = True
+
+    async def run(self):
+        while self._running:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - start - self.interval))
+
+    def stop(self):
+        self._running = False
+
+    def summary(self):
+        return summarize(self.lags)
+
+
+class Stopwatch:
+    def __init__(self):
+        self.start = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start
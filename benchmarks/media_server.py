@@ -0,0 +1,143 @@
+"""
+Local stand-in for a media CDN.
+Serves synthetic "video" files of any size so yt-dlp's generic extractor
+can be driven fully offline:
+
+    http://127.0.0.1:<port>/media/<name>-<bytes>.mp4[?rate=<bytes per second>]
+
+Supports HEAD, Range requests (206) and optional per-connection throttling.
+"""
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+CHUNK = 64 * 1024
+_PATTERN = bytes(range(256)) * (CHUNK // 256)
+_PATH = re.compile(r'^/media/([\w.-]+?)-(\d+)\.(mp4|webm|m4a)$')
+_TYPES = {"mp4": "video/mp4", "webm": "video/webm", "m4a": "audio/mp4"}
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _resolve(self):
+        parsed = urlparse(self.path)
+        m = _PATH.match(parsed.path)
+        if not m:
+            self.send_error(404)
+            return None
+        size = int(m.group(2))
+        rate = int(parse_qs(parsed.query).get("rate", ["0"])[0] or 0)
+        return size, rate, _TYPES[m.group(3)]
+
+    def _range(self, size):
+        header = self.headers.get("Range")
+        m = re.match(r'bytes=(\d*)-(\d*)$', header or "")
+        if not m or (not m.group(1) and not m.group(2)):
+            return 0, size - 1, False
+        if m.group(1):
+            start = int(m.group(1))
+            end = int(m.group(2)) if m.group(2) else size - 1
+        else:
+            start = max(0, size - int(m.group(2)))
+            end = size - 1
+        return start, min(end, size - 1), True
+
+    def _headers(self, size, ctype):
+        start, end, partial = self._range(size)
+        if start >= size:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+        self.send_response(206 if partial else 200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        if partial:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        return start, end
+
+    def do_HEAD(self):
+        resolved = self._resolve()
+        if resolved:
+            self._headers(resolved[0], resolved[2])
+
+    def do_GET(self):
+        resolved = self._resolve()
+        if not resolved:
+            return
+        size, rate, ctype = resolved
+        span = self._headers(size, ctype)
+        if span is None:
+            return
+        start, end = span
+        remaining = end - start + 1
+        offset = start % CHUNK
+        began = time.monotonic()
+        sent = 0
+        try:
+            while remaining > 0:
+                n = min(CHUNK - offset, remaining)
+                self.wfile.write(_PATTERN[offset:offset + n])
+                offset = 0
+                remaining -= n
+                sent += n
+                if rate:
+                    # Sleep until we are back under the per-connection rate
+                    ahead = sent / rate - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class MediaServer:
+    """Runs MediaHandler on a background thread. Use as a context manager."""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.httpd = ThreadingHTTPServer((host, port), MediaHandler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, name, size, ext="mp4", rate=None):
+        url = f"{self.base_url}/media/{name}-{size}.{ext}"
+        return f"{url}?rate={rate}" if rate else url
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import sys
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    with MediaServer(port=port) as server:
+        print(f"Serving synthetic media on {server.base_url}/media/<name>-<bytes>.mp4")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
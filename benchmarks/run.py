@@ -0,0 +1,84 @@
+"""
+Offline benchmark / load test for InfinityLoader.
+
+    python -m benchmarks.run --jobs 32 --concurrency 8 --size-mb 4
+    python -m benchmarks.run --scenarios ws --rate 2000000 --json bench.json
+    python -m benchmarks.run --scenarios mux --jobs 40 --rate 500000
+    python -m benchmarks.run --scenarios startup --jobs 5
+
+Everything runs against a local synthetic media server, so it works in CI
+without network access. Exit code is 1 if any job failed.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="InfinityLoader benchmarks")
+    parser.add_argument("--scenarios", default="fetch,download,ws",
+                        help="comma separated: fetch, download, ws, mux, startup")
+    parser.add_argument("--jobs", type=int, default=16, help="jobs per scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="parallel clients")
+    parser.add_argument("--size-mb", type=float, default=2.0, help="synthetic file size")
+    parser.add_argument("--rate", type=int, default=0,
+                        help="per-connection server rate limit in bytes/s (0 = unlimited)")
+    parser.add_argument("--same-url", action="store_true",
+                        help="every job requests the same URL (exercises single-flight)")
+    parser.add_argument("--backend", choices=("thread", "process"), help="execution backend")
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    out_dir = tempfile.mkdtemp(prefix="infinity-bench-")
+
+    # Isolate the app from the user's setup before it is imported
+    os.environ.setdefault("INFINITY_JOURNAL", "off")
+    os.environ.setdefault("INFINITY_DOWNLOAD_FOLDER", out_dir)
+    os.environ.setdefault("INFINITY_DATA_DIR", os.path.join(out_dir, ".data"))
+    os.environ.setdefault("INFINITY_YDL_POOL_WARM", "0")
+    if args.backend:
+        os.environ["INFINITY_BACKEND"] = args.backend
+
+    from .media_server import MediaServer
+    from . import scenarios
+
+    size = int(args.size_mb * 1024 * 1024)
+    wanted = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    results = []
+
+    with MediaServer() as server:
+        print(f"Media server: {server.base_url}  output: {out_dir}")
+        if "fetch" in wanted:
+            results.append(scenarios.bench_fetch(server, args.jobs, args.concurrency, size, args.same_url))
+        if "download" in wanted:
+            results.append(scenarios.bench_download(
+                server, args.jobs, args.concurrency, size, out_dir, args.rate or None, args.same_url))
+            scenarios.cleanup(out_dir)
+        if "ws" in wanted:
+            results.append(scenarios.bench_websocket(
+                server, args.jobs, args.concurrency, size, out_dir, args.rate or None))
+            scenarios.cleanup(out_dir)
+        if "mux" in wanted:
+            results.append(scenarios.bench_multiplex(server, args.jobs, size, out_dir, args.rate or None))
+    if "startup" in wanted:
+        # One fresh interpreter per job, no media server needed
+        results.append(scenarios.bench_startup(args.jobs))
+
+    for result in results:
+        print(json.dumps(result, indent=2))
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failed = sum(r.get("errors", 0) for r in results)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""
+Benchmark scenarios. Each one returns a plain dict of results.
+The app modules are imported lazily so run.py can set INFINITY_* first.
+"""
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .harness import LoopLagProbe, Stopwatch, peak_rss_mb, summarize
+
+_run_ids = itertools.count(1)
+
+
+def _names(prefix, jobs, same_url):
+    run = next(_run_ids)
+    if same_url:
+        return [f"{prefix}{run}-shared"] * jobs
+    return [f"{prefix}{run}-{i}" for i in range(jobs)]
+
+
+def _run_concurrently(fn, items, concurrency):
+    """Runs fn(item) on `concurrency` threads; returns (latencies, results, wall seconds)."""
+    latencies = []
+    results = []
+    lock = threading.Lock()
+
+    def timed(item):
+        watch = Stopwatch()
+        result = fn(item)
+        with lock:
+            latencies.append(watch.elapsed)
+            results.append(result)
+
+    watch = Stopwatch()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(timed, items))
+    return latencies, results, watch.elapsed
+
+
+def bench_fetch(server, jobs, concurrency, size, same_url=False):
+    """fetch_formats against local URLs, cold (extraction) then warm (cache)."""
+    from app import downloader
+
+    urls = [server.url(name, size) for name in _names("meta", jobs, same_url)]
+    cold, results, cold_wall = _run_concurrently(downloader.fetch_formats, urls, concurrency)
+    warm, _, warm_wall = _run_concurrently(downloader.fetch_formats, urls, concurrency)
+    return {
+        "scenario": "fetch_formats",
+        "jobs": jobs,
+        "concurrency": concurrency,
+        "errors": sum(1 for r in results if r.get("status") != "success"),
+        "cold": {**summarize(cold), "jobs_per_s": round(jobs / cold_wall, 2)},
+        "warm": {**summarize(warm), "jobs_per_s": round(jobs / warm_wall, 2)},
+        "cache": downloader.metadata_cache.stats(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_download(server, jobs, concurrency, size, out_dir, rate=None, same_url=False):
+    """run_download end to end (extraction + transfer + write) on `concurrency` threads."""
+    from app import downloader
+
+    urls = [server.url(name, size, rate=rate) for name in _names("dl", jobs, same_url)]
+
+    def download(url):
+        return downloader.run_download(url, "best", str(uuid.uuid4()), out_dir)
+
+    latencies, results, wall = _run_concurrently(download, urls, concurrency)
+    completed = sum(1 for r in results if r.get("state") == "completed")
+    moved = completed * size if not same_url else size
+    return {
+        "scenario": "run_download",
+        "jobs": jobs,
+        "concurrency": concurrency,
+        "size_mb": round(size / 1024 / 1024, 2),
+        "completed": completed,
+        "errors": jobs - completed,
+        "latency": summarize(latencies),
+        "jobs_per_s": round(jobs / wall, 2),
+        "throughput_mb_s": round(moved / 1024 / 1024 / wall, 2),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_websocket(server, jobs, concurrency, size, out_dir, rate=None):
+    """
+    Full /ws protocol through the ASGI app: each client thread opens a socket,
+    submits one download and reads progress frames until it finishes.
+    Event-loop lag is sampled on the server's loop the whole time.
+    """
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    urls = [server.url(name, size, rate=rate) for name in _names("ws", jobs, False)]
+    frames = []
+    lock = threading.Lock()
+    probe = LoopLagProbe()
+
+    with TestClient(app) as client:
+        client.portal.start_task_soon(probe.run)
+
+        def session(url):
+            count = 0
+            with client.websocket_connect("/ws") as ws:
+                ws.send_json({"action": "download", "url": url, "format_id": "best", "download_path": out_dir})
+                while True:
+                    msg = ws.receive_json()
+                    count += 1
+                    if msg.get("state") in ("completed", "error"):
+                        break
+            with lock:
+                frames.append(count)
+            return msg
+
+        latencies, results, wall = _run_concurrently(session, urls, concurrency)
+        probe.stop()
+
+    completed = sum(1 for r in results if r.get("state") == "completed")
+    return {
+        "scenario": "websocket",
+        "jobs": jobs,
+        "concurrency": concurrency,
+        "size_mb": round(size / 1024 / 1024, 2),
+        "completed": completed,
+        "errors": jobs - completed,
+        "latency": summarize(latencies),
+        "jobs_per_s": round(jobs / wall, 2),
+        "throughput_mb_s": round(completed * size / 1024 / 1024 / wall, 2),
+        "frames_per_job": round(sum(frames) / len(frames), 1) if frames else 0,
+        "loop_lag": probe.summary(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_multiplex(server, jobs, size, out_dir, rate=None):
+    """
+    One client socket running `jobs` downloads at once, in the classic /ws
+    protocol and in the compact one (JSON, then MessagePack if installed).
+    Counts the frames and payload bytes the client had to read.
+    Every mode runs in its own app lifespan.
+    """
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.ws_protocol import msgpack
+
+    modes = [("classic", None), ("compact-json", "json")]
+    if msgpack is not None:
+        modes.append(("compact-msgpack", "msgpack"))
+    results = []
+
+    for mode, encoding in modes:
+        # A lifespan per mode: the app is started and stopped again like a restarted server,
+        # after the previous scenario's lifespan too
+        with TestClient(app) as client:
+            urls = [server.url(name, size, rate=rate) for name in _names("mux", jobs, False)]
+            frames = 0
+            received = 0
+            states = {}
+            watch = Stopwatch()
+            with client.websocket_connect("/ws") as ws:
+                if encoding:
+                    ws.send_json({"action": "hello", "protocol": "compact", "encoding": encoding})
+                    short = {name: key for key, name in ws.receive_json()["keys"].items()}
+                handles = {}
+                for url in urls:
+                    ws.send_json({"action": "download", "url": url, "format_id": "best", "download_path": out_dir})
+                while len(states) < jobs or any(s not in ("completed", "error") for s in states.values()):
+                    message = ws.receive()
+                    data = message.get("bytes") if message.get("bytes") is not None else message["text"].encode()
+                    frames += 1
+                    received += len(data)
+                    if encoding == "msgpack":
+                        frame = msgpack.unpackb(data)
+                    else:
+                        frame = json.loads(data)
+                    if not encoding:
+                        if frame.get("task_id") and "state" in frame:
+                            states[frame["task_id"]] = frame["state"]
+                        continue
+                    for handle, task_id in frame.get("h", ()):
+                        handles[handle] = task_id
+                    for handle, fields in frame.get("u", ()):
+                        state = fields.get(short["state"])
+                        if state:
+                            states[handles[handle]] = state
+            completed = sum(1 for s in states.values() if s == "completed")
+            results.append({
+                "mode": mode,
+                "completed": completed,
+                "errors": jobs - completed,
+                "frames": frames,
+                "kb_received": round(received / 1024, 1),
+                "bytes_per_job": round(received / jobs),
+                "wall_s": round(watch.elapsed, 2),
+            })
+            cleanup(out_dir)
+
+    return {
+        "scenario": "ws_multiplex",
+        "jobs": jobs,
+        "size_mb": round(size / 1024 / 1024, 2),
+        "errors": sum(r["errors"] for r in results),
+        "modes": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+# Runs in a fresh interpreter: the app import and the warm-up, as a cold server pays them
+_STARTUP_PROBE = """
+import json, time
+started = time.perf_counter()
+import app.main
+from app import downloader, startup
+startup.report.record("interpreter_import", time.perf_counter() - started)
+downloader.warm_up(1)
+print(json.dumps(startup.report.stats()))
+"""
+
+
+def bench_startup(runs):
+    """Cold start cost: import of app.main and the background warm-up, per phase."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    phases = {}
+    errors = 0
+    lazy = {}
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, "-c", _STARTUP_PROBE], cwd=root,
+                              capture_output=True, text=True)
+        try:
+            stats = json.loads(proc.stdout.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            errors += 1
+            continue
+        for phase, seconds in stats["phases"].items():
+            phases.setdefault(phase, []).append(seconds)
+        lazy = stats["loaded"]
+    return {
+        "scenario": "startup",
+        "runs": runs,
+        "errors": errors,
+        "phases": {phase: summarize(values) for phase, values in phases.items()},
+        "loaded_after_warmup": lazy,
+    }
+
+
+def cleanup(out_dir):
+    for name in os.listdir(out_dir):
+        try:
+            os.remove(os.path.join(out_dir, name))
+        except OSError:
+            pass
@@ -1,3 +1,6 @@
+import time
+_launched_at = time.time()
+
 import uvicorn
 import os
 import sys
@@ -39,7 +42,23 @@ if __name__ == "__main__":
     # Ensure current directory is in Python path so imports work
     sys.path.insert(0, os.getcwd())
 
-    print("Starting YouTube Downloader Server...")
+    # Production: no auto-reloader (it runs the app in a second process and watches every file)
+    production = "--prod" in sys.argv or os.environ.get("INFINITY_ENV", "").lower() == "production"
+    if production:
+        os.environ["INFINITY_ENV"] = "production"
+    # Several server processes share one port; they need a shared INFINITY_JOB_STORE to share the queue
+    workers = int(os.environ.get("INFINITY_WORKERS", "1") or 1)
+    if "--workers" in sys.argv[:-1]:
+        workers = int(sys.argv[sys.argv.index("--workers") + 1])
+    if workers > 1 and not production:
+        print("[WARNING] --workers needs production mode (the reloader runs a single process), using 1.")
+        workers = 1
+    if workers > 1 and os.environ.get("INFINITY_JOB_STORE", "memory") == "memory":
+        print("[WARNING] Each worker keeps its own queue; set INFINITY_JOB_STORE=sqlite:///... to share it.")
+    # Lets the app report how long it took to become ready (/api/startup)
+    os.environ["INFINITY_LAUNCHED_AT"] = str(_launched_at)
+
+    print(f"Starting YouTube Downloader Server ({'production' if production else 'development'} mode)...")
     
     # 1. Find the app
     app_string = pre_check_imports()
@@ -52,7 +71,10 @@ if __name__ == "__main__":
         print("Open http://127.0.0.1:8000 in your browser")
         try:
             # Start Uvicorn with the dynamically found app string
-            uvicorn.run(app_string, host="127.0.0.1", port=8000, reload=True)
+            # permessage-deflate compresses /ws frames for clients that offer it (INFINITY_WS_DEFLATE=0 saves the CPU)
+            deflate = os.environ.get("INFINITY_WS_DEFLATE", "1") != "0"
+            uvicorn.run(app_string, host="127.0.0.1", port=8000, reload=not production, workers=workers,
+                        ws_per_message_deflate=deflate)
         except KeyboardInterrupt:
             print("\nServer stopped by user.")
         except Exception as e:
@@ -4,6 +4,7 @@ let currentUrl = "";
 let selectedPath = "Default";
 let currentData = null; // Store data for tab switching
 let activeTab = 'video'; // Default tab
+let taskStates = {}; // task_id -> merged status (server only sends changed fields)
 
 // Debounce logic for auto-scan
 document.getElementById('urlInput').addEventListener('input', function (e) {
@@ -123,7 +124,16 @@ function startDownload(formatId) {
 }
 
 function handleMessage(event) {
-    const data = JSON.parse(event.data);
+    let data = JSON.parse(event.data);
+
+    // Download updates are deltas: merge them into the task's last known status
+    if (data.task_id) {
+        data = Object.assign(taskStates[data.task_id] || {}, data);
+        taskStates[data.task_id] = data;
+        if (data.state === "completed" || data.state === "error" || data.state === "cancelled") {
+            delete taskStates[data.task_id];
+        }
+    }
 
     // 1. Fetch Info Result
     if (data.status === "success" && data.formats) {
@@ -137,17 +147,29 @@ function handleMessage(event) {
     }
 
     // 2. Download Progress
-    if (data.state === "processing") {
+    if (data.state === "queued") {
         document.getElementById('statusText').innerText = data.message;
-        const percentMatch = data.message.match(/(\d+\.?\d*)%/);
-        if (percentMatch) {
-            document.getElementById('progressFill').style.width = percentMatch[1] + "%";
+        document.getElementById('progressFill').style.width = "0%";
+    }
+    else if (data.state === "processing") {
+        document.getElementById('statusText').innerText = formatProgress(data);
+        if (data.total_bytes) {
+            const percent = Math.min(100, data.downloaded_bytes / data.total_bytes * 100);
+            document.getElementById('progressFill').style.width = percent.toFixed(1) + "%";
         }
     }
     else if (data.state === "converting") {
         document.getElementById('statusText').innerText = "Merging/Converting...";
         document.getElementById('progressFill').style.width = "100%";
     }
+    else if (data.state === "paused" || data.state === "cancelled") {
+        document.getElementById('statusText').innerText = data.message;
+    }
+    else if (data.state === "error") {
+        document.getElementById('statusText').innerText = "Error: " + data.message;
+        document.getElementById('dockIcon').className = "fa-solid fa-circle-exclamation dock-icon";
+        document.getElementById('dockIcon').style.animation = "none";
+    }
     else if (data.state === "completed") {
         document.getElementById('statusText').innerText = "Download Complete!";
         document.getElementById('dockIcon').className = "fa-solid fa-check-circle dock-icon";
@@ -163,6 +185,31 @@ function handleMessage(event) {
     }
 }
 
+function formatBytes(bytes) {
+    if (!bytes) return "0 B";
+    const units = ["B", "KB", "MB", "GB"];
+    let i = 0;
+    while (bytes >= 1024 && i < units.length - 1) { bytes /= 1024; i++; }
+    return bytes.toFixed(i ? 1 : 0) + " " + units[i];
+}
+
+function formatProgress(data) {
+    let text = "Downloading";
+    if (data.total_bytes) {
+        const percent = Math.min(100, data.downloaded_bytes / data.total_bytes * 100);
+        text += `: ${percent.toFixed(1)}%`;
+    } else if (data.downloaded_bytes) {
+        text += `: ${formatBytes(data.downloaded_bytes)}`;
+    }
+    const speed = data.throughput || data.speed;
+    if (speed) text += ` • ${formatBytes(speed)}/s`;
+    if (data.eta != null) {
+        const m = Math.floor(data.eta / 60), s = Math.floor(data.eta % 60);
+        text += ` • ETA ${m}:${String(s).padStart(2, '0')}`;
+    }
+    return text;
+}
+
 function renderResults(data) {
     const area = document.getElementById('contentArea');
     area.classList.remove('hidden');
@@ -0,0 +1,11 @@
+import os
+import tempfile
+
+# Keep the app away from the user's setup; set before anything imports app.config
+_data = tempfile.mkdtemp(prefix="infinity-tests-")
+os.environ.setdefault("INFINITY_DATA_DIR", _data)
+os.environ.setdefault("INFINITY_DOWNLOAD_FOLDER", os.path.join(_data, "downloads"))
+os.environ.setdefault("INFINITY_JOURNAL", "off")
+os.environ.setdefault("INFINITY_MEDIA_STORE", "off")
+os.environ.setdefault("INFINITY_YDL_POOL_WARM", "0")
+os.environ.setdefault("INFINITY_LOG_LEVEL", "warning")
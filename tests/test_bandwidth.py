@@ -0,0 +1,76 @@
+import pytest
+
+from app.bandwidth import MIN_RATE, Shaper, parse_rate
+
+
+def rates(shaper):
+    return {task_id: task["rate"] for task_id, task in shaper.stats()["tasks"].items()}
+
+
+def start(shaper, *tasks):
+    """Registers (task_id, weight, host) jobs and moves a byte for each, so they share the limits."""
+    for task_id, weight, host in tasks:
+        shaper.register(task_id, weight=weight)
+    for task_id, _, host in tasks:
+        shaper.reserve(task_id, 1, host)
+
+
+def test_global_limit_is_split_by_weight():
+    shaper = Shaper(global_rate=1_000_000)
+    start(shaper, ("a", 1, "h"), ("b", 3, "h"))
+    assert rates(shaper) == {"a": 250_000, "b": 750_000}
+
+
+def test_capped_job_leaves_its_share_to_the_others():
+    shaper = Shaper(global_rate=900_000)
+    start(shaper, ("a", 1, "h"), ("b", 1, "h"), ("c", 1, "h"))
+    shaper.configure({"tasks": {"a": {"rate": 100_000}}})
+    shaper.reserve("a", 1, "h")
+    assert rates(shaper) == {"a": 100_000, "b": 400_000, "c": 400_000}
+
+
+def test_host_limit_inside_the_global_one():
+    shaper = Shaper(global_rate=1_000_000)
+    shaper.configure({"hosts": {"slow": 200_000}})
+    start(shaper, ("a", 1, "slow"), ("b", 1, "slow"), ("c", 1, "fast"))
+    assert rates(shaper) == {"a": 100_000, "b": 100_000, "c": 800_000}
+
+
+def test_saturated_group_still_gives_the_minimum():
+    shaper = Shaper(global_rate=MIN_RATE)
+    start(shaper, *((f"t{i}", 1, "h") for i in range(4)))
+    assert set(rates(shaper).values()) == {MIN_RATE}
+
+
+def test_no_limit_no_rate():
+    shaper = Shaper()
+    start(shaper, ("a", 1, "h"))
+    assert not shaper.limited
+    assert rates(shaper) == {"a": None}
+    assert shaper.reserve("a", 10 ** 9, "h") == 0
+
+
+@pytest.mark.parametrize("value, rate", [
+    ("10M", 10 * 1024 ** 2), ("512k", 512 * 1024), ("1.5MB/s", int(1.5 * 1024 ** 2)), (2048, 2048),
+    (0, None), ("off", None), ("", None), (None, None),
+])
+def test_parse_rate(value, rate):
+    assert parse_rate(value) == rate
+
+
+def test_parse_rate_rejects_garbage():
+    with pytest.raises(ValueError):
+        parse_rate("fast")
+
+
+def test_configure_rejects_unknown_tasks():
+    shaper = Shaper(global_rate=1_000_000)
+    start(shaper, ("a", 1, "h"))
+    with pytest.raises(ValueError, match="ghost"):
+        shaper.configure({"global": 500_000, "tasks": {"a": {"weight": 5}, "ghost": {"rate": 1000}}})
+    # Nothing applied
+    assert shaper.stats()["limits"]["global"] == 1_000_000
+    assert shaper.stats()["tasks"]["a"]["weight"] == 1
+    shaper.unregister("a")
+    with pytest.raises(ValueError):
+        shaper.configure({"tasks": {"a": {"weight": 2}}})
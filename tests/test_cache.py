@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+from app.cache import TTLCache, video_key
+
+
+@pytest.mark.parametrize("url", [
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://youtube.com/watch?feature=share&v=dQw4w9WgXcQ&t=30",
+    "https://m.youtube.com/watch?v=dQw4w9WgXcQ#comments",
+    "youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://youtu.be/dQw4w9WgXcQ?si=abc",
+    "https://www.youtube.com/shorts/dQw4w9WgXcQ",
+    "https://www.youtube.com/embed/dQw4w9WgXcQ?autoplay=1",
+    "https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ",
+    "https://www.youtube.com/live/dQw4w9WgXcQ",
+    "  https://www.youtube.com/v/dQw4w9WgXcQ  ",
+])
+def test_youtube_urls_share_one_key(url):
+    assert video_key(url) == "youtube:dQw4w9WgXcQ"
+
+
+def test_other_urls_keep_everything_but_the_fragment():
+    assert video_key("https://vimeo.com/123?x=1#t=5") == "https://vimeo.com/123?x=1"
+    assert video_key("https://www.youtube.com/playlist?list=PL123") == "https://www.youtube.com/playlist?list=PL123"
+    assert video_key("https://notyoutube.com/watch?v=dQw4w9WgXcQ") != "youtube:dQw4w9WgXcQ"
+    assert video_key(None) == ""
+
+
+def test_entries_expire():
+    cache = TTLCache(ttl=0.05)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=10)
+    assert cache.get("a") == 1
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_goes_first():
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_size_zero_disables_the_cache():
+    cache = TTLCache(maxsize=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None and len(cache) == 0
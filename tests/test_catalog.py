@@ -0,0 +1,99 @@
+import pytest
+
+from app.catalog import FormatCatalog, is_query, parse_query
+
+
+def test_parse_query():
+    assert parse_query("video:height<=1080,vcodec=AVC,size<=50M") == {
+        "kind": "video", "max_height": 1080, "vcodec": "avc", "max_bytes": 50 * 1024 ** 2,
+    }
+    assert parse_query("audio:abr>=128,acodec=opus,ext=webm") == {
+        "kind": "audio", "min_abr": 128.0, "acodec": "opus", "ext": "webm",
+    }
+    assert parse_query("video: height >= 720 , height=1080") == {"kind": "video", "min_height": 720, "height": 1080}
+    assert parse_query("video:size<=1.5g")["max_bytes"] == int(1.5 * 1024 ** 3)
+    assert parse_query("video:size<=1000") == {"kind": "video", "max_bytes": 1000}
+    assert parse_query("audio:") == {"kind": "audio"}
+
+
+@pytest.mark.parametrize("text", ["video:height<1080", "video:size>=10M", "video:fps=60", "video:abr"])
+def test_parse_query_rejects_bad_terms(text):
+    with pytest.raises(ValueError):
+        parse_query(text)
+
+
+def test_is_query():
+    assert is_query("video:height<=720")
+    assert not is_query("137+140")
+    assert not is_query("best")
+    assert not is_query(None)
+
+
+def youtube_like_formats():
+    """A typical YouTube format list: storyboards, DASH audio/video in two containers, a progressive file."""
+    return [
+        {"format_id": "sb0", "ext": "mhtml", "vcodec": "none", "acodec": "none", "format_note": "storyboard"},
+        {"format_id": "139", "ext": "m4a", "vcodec": "none", "acodec": "mp4a.40.5", "abr": 48.8, "filesize": 1_200_000},
+        {"format_id": "140", "ext": "m4a", "vcodec": "none", "acodec": "mp4a.40.2", "abr": 129.5, "filesize": 3_300_000},
+        {"format_id": "251", "ext": "webm", "vcodec": "none", "acodec": "opus", "abr": 135.1, "filesize_approx": 3_100_000},
+        {"format_id": "600", "ext": "webm", "vcodec": "none", "acodec": "opus", "abr": None},
+        {"format_id": "160", "ext": "mp4", "vcodec": "avc1.4d400c", "acodec": "none", "height": 144, "tbr": 80, "filesize": 900_000, "format_note": "144p"},
+        {"format_id": "597", "ext": "mp4", "vcodec": "avc1.4d400b", "acodec": "none", "height": 144, "tbr": 60, "filesize": 700_000, "format_note": "144p"},
+        {"format_id": "133", "ext": "mp4", "vcodec": "avc1.4d4015", "acodec": "none", "height": 240, "tbr": 150, "format_note": "240p"},
+        {"format_id": "242", "ext": "webm", "vcodec": "vp9", "acodec": "none", "height": 240, "tbr": 140, "filesize": 2_000_000, "format_note": "240p"},
+        {"format_id": "18", "ext": "mp4", "vcodec": "avc1.42001E", "acodec": "mp4a.40.2", "height": 360, "tbr": 500, "filesize_approx": 9_000_000, "format_note": "360p"},
+        {"format_id": "134", "ext": "mp4", "vcodec": "avc1.4d401e", "acodec": "none", "height": 360, "tbr": 300, "filesize": 9_000_000, "format_note": "360p"},
+        {"format_id": "137", "ext": "mp4", "vcodec": "avc1.640028", "acodec": "none", "height": 1080, "tbr": 4000, "filesize": 120_000_000, "format_note": "1080p"},
+        {"format_id": "248", "ext": "webm", "vcodec": "vp9", "acodec": "none", "height": 1080, "tbr": 2500, "filesize": 80_000_000, "format_note": "1080p"},
+        {"format_id": "399", "ext": "mp4", "vcodec": "av01.0.08M.08", "acodec": "none", "height": 1080, "tbr": 2000, "filesize": 150_000_000, "format_note": "1080p"},
+        {"format_id": "136", "ext": "mp4", "vcodec": "avc1.4d401f", "acodec": "none", "height": 720, "tbr": 2000, "filesize": 60_000_000, "format_note": "720p"},
+        {"format_id": "tiny", "ext": "mp4", "vcodec": "avc1", "acodec": "none", "height": 90, "filesize": 10},
+    ]
+
+
+def legacy_lists(formats):
+    """The card lists fetch_formats built before the catalog, kept as the reference."""
+    video_formats, audio_formats, unique_videos = [], [], {}
+    for f in formats:
+        filesize = f.get('filesize') or f.get('filesize_approx')
+        size_str = f"{filesize / 1024 / 1024:.1f} MB" if filesize else "N/A"
+        filesize_val = filesize or 0
+        if f.get('vcodec') == 'none' and f.get('acodec') != 'none':
+            audio_formats.append({
+                'format_id': f['format_id'], 'ext': f['ext'], 'quality': f.get('abr', 0) or 0,
+                'note': f"{(f.get('abr') or 0):.0f}kbps", 'size': size_str, 'filesize_bytes': filesize_val,
+            })
+        elif f.get('vcodec') != 'none':
+            height = f.get('height') or 0
+            if height >= 144:
+                candidate = {
+                    'format_id': f['format_id'], 'ext': f['ext'], 'quality': f"{height}p", 'height': height,
+                    'note': f.get('format_note', ''), 'size': size_str, 'filesize_bytes': filesize_val,
+                }
+                key = (height, f['ext'])
+                if key not in unique_videos or candidate['filesize_bytes'] > unique_videos[key]['filesize_bytes']:
+                    unique_videos[key] = candidate
+    video_formats = list(unique_videos.values())
+    audio_formats.sort(key=lambda x: x['filesize_bytes'], reverse=True)
+    video_formats.sort(key=lambda x: x['height'], reverse=True)
+    return video_formats, audio_formats
+
+
+def test_ui_lists_match_the_old_fetch_formats_output():
+    formats = youtube_like_formats()
+    assert FormatCatalog(formats, duration=600).ui_lists() == legacy_lists(formats)
+    # Same on reversed input (tie-breaking follows the input order in both)
+    assert FormatCatalog(formats[::-1]).ui_lists() == legacy_lists(formats[::-1])
+
+
+def test_queries():
+    catalog = FormatCatalog(youtube_like_formats(), duration=600)
+    assert catalog.best(kind="video") in ("137", "248", "399")
+    assert catalog.best(kind="video", vcodec="avc", max_height=720) == "136"
+    assert catalog.best(kind="video", max_bytes=10 * 1024 ** 2, min_height=300) in ("18", "134")
+    assert catalog.best(kind="video", ext="webm", height=240) == "242"
+    assert catalog.best(kind="audio", acodec="opus") == "251"
+    assert catalog.best(kind="audio", min_abr=130) == "251"
+    assert catalog.best(kind="video", height=4320) is None
+    # 133 has no size: estimated from its bitrate and the duration
+    assert catalog.row(catalog.format_ids.index("133"))["filesize"] == 150 * 125 * 600
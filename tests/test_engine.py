@@ -0,0 +1,93 @@
+import asyncio
+import glob
+import time
+
+import pytest
+
+from app import downloader
+from app.engine import AsyncSingleFlight, engine
+from app.scheduler import DownloadScheduler
+from app.store import MemoryStore
+from benchmarks.media_server import MediaServer
+
+
+def test_followers_share_the_result():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def fetch(value):
+        calls.append(value)
+        await asyncio.sleep(0.05)
+        return value * 2
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", fetch, 21) for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert calls == [21]
+    assert sorted(results, key=lambda r: r[1]) == [(42, False), (42, True), (42, True)]
+    assert flight.in_flight() == 0
+
+
+def test_followers_get_the_leader_error():
+    flight = AsyncSingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.05)
+        raise OSError("boom")
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", fail) for _ in range(2)), return_exceptions=True)
+
+    assert [str(e) for e in asyncio.run(main())] == ["boom", "boom"]
+
+
+def test_cancelled_leader_hands_over_to_a_follower():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def fetch(who):
+        calls.append(who)
+        await asyncio.sleep(0.1)
+        return "done"
+
+    async def main():
+        leader = asyncio.create_task(flight.do("k", fetch, "leader", owner="leader"))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(flight.do("k", fetch, f"follower{i}", owner=f"follower{i}"))
+                     for i in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*followers)
+
+    results = asyncio.run(main())
+    # One follower ran it again, the other two attached to it
+    assert len(calls) == 2 and calls[0] == "leader"
+    assert sorted(shared for _, shared in results) == [False, True, True]
+    assert all(result == "done" for result, _ in results)
+
+
+def test_stop_cancels_running_downloads_before_closing(tmp_path):
+    async def run(url):
+        scheduler = DownloadScheduler(max_downloads=1, store=MemoryStore(), engine="async")
+        await scheduler.start()
+        scheduler.submit("stop-task", url, "best", str(tmp_path))
+        deadline = time.monotonic() + 20
+        while (downloader.download_status.get("stop-task") or {}).get("state") != "processing":
+            assert time.monotonic() < deadline, downloader.download_status.get("stop-task")
+            await asyncio.sleep(0.05)
+        running = list(scheduler._running)
+        await scheduler.stop()
+        return running
+
+    with MediaServer() as server:
+        # ~10 s at this rate, so it is still running when stop() comes
+        running = asyncio.run(run(server.url("stop", 2 * 1024 * 1024, rate=200 * 1024)))
+
+    assert len(running) == 1 and running[0].cancelled()
+    assert engine._client is None
+    # Not failed, not cancelled: left for the next start to resume
+    assert downloader.download_status["stop-task"]["state"] == "processing"
+    assert glob.glob(str(tmp_path / "*.part"))
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+
+from app.events import EventBus
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_subscriber_gets_the_current_status_then_only_changes():
+    async def main():
+        bus = EventBus({}, coalesce=0)
+        bus.publish("t", {"state": "downloading", "percent": 10}, replace=True)
+        sub = bus.subscribe("t")
+        assert await sub.__anext__() == {"state": "downloading", "percent": 10}
+        bus.publish("t", {"state": "downloading", "percent": 20})
+        assert await sub.__anext__() == {"percent": 20}
+
+    run(main())
+
+
+def test_changes_are_coalesced_for_a_slow_subscriber():
+    async def main():
+        bus = EventBus({}, coalesce=0.05)
+        bus.bind(asyncio.get_running_loop())
+        bus.publish("t", {"state": "downloading"}, replace=True)
+        sub = bus.subscribe("t")
+        await sub.__anext__()
+        for percent in range(1, 50):
+            bus.publish("t", {"percent": percent, "speed": 100})
+        assert await sub.__anext__() == {"percent": 49, "speed": 100}
+        await bus.close()
+
+    run(main())
+
+
+def test_final_state_ends_the_stream():
+    async def main():
+        bus = EventBus({}, coalesce=10)
+        bus.publish("t", {"state": "downloading"}, replace=True)
+        sub = bus.subscribe("t")
+        bus.publish("t", {"state": "completed", "file_path": "/x"})
+        # Not held back by the coalescing window
+        frames = [frame async for frame in sub]
+        assert frames == [{"state": "completed", "file_path": "/x"}]
+        assert bus.stats()["subscribers"] == 0
+
+    run(asyncio.wait_for(main(), 1))
+
+
+def test_replace_sends_removed_keys_as_none():
+    async def main():
+        bus = EventBus({}, coalesce=0)
+        bus.publish("t", {"state": "downloading", "percent": 50}, replace=True)
+        sub = bus.subscribe("t")
+        await sub.__anext__()
+        bus.publish("t", {"state": "queued"}, replace=True)
+        assert await sub.__anext__() == {"percent": None, "state": "queued"}
+
+    run(main())
+
+
+def test_publish_from_a_thread_runs_on_the_loop():
+    async def main():
+        status = {}
+        bus = EventBus(status, coalesce=0)
+        bus.bind(asyncio.get_running_loop())
+        bus.publish("t", {"state": "queued"}, replace=True)
+        sub = bus.subscribe("t")
+        await sub.__anext__()
+        thread = threading.Thread(target=bus.publish, args=("t", {"state": "downloading"}))
+        thread.start()
+        thread.join()
+        # Queued on the loop, not applied from the thread
+        assert status["t"]["state"] == "queued"
+        assert await sub.__anext__() == {"state": "downloading"}
+        await bus.close()
+
+    run(main())
+
+
+def test_reap_drops_finished_and_idle_entries():
+    status = {}
+    bus = EventBus(status, finished_ttl=0, max_age=3600)
+    bus.publish("done", {"state": "completed"}, replace=True)
+    bus.publish("busy", {"state": "downloading"}, replace=True)
+    bus._touched["done"] -= 1
+    bus.reap()
+    assert list(status) == ["busy"]
+    bus.max_age = 0
+    bus._touched["busy"] -= 1
+    bus.reap()
+    assert status == {}
@@ -0,0 +1,59 @@
+import os
+
+from app import scheduler as scheduler_module
+from app.journal import JobJournal
+from app.scheduler import DownloadScheduler
+from app.store import MemoryStore
+
+
+def fill(journal):
+    for i, task_id in enumerate(("done", "running", "queued", "paused", "failed")):
+        journal.record_queued(task_id, f"https://example.com/{task_id}", "best", "/tmp/out", 10 - i, 4)
+    journal.mark_running("running", "/tmp/out")
+    journal.progress("running", 500, 1000)
+    journal.finish("done", {"state": "completed", "file_path": "/tmp/out/done.mp4"})
+    journal.finish("paused", {"state": "paused"})
+    journal.finish("failed", {"state": "error", "message": "HTTP Error 404"})
+
+
+def test_closed_journal_does_nothing(tmp_path):
+    journal = JobJournal(str(tmp_path / "jobs.db"))
+    fill(journal)
+    assert not journal.enabled
+    assert journal.unfinished() == []
+    assert not os.path.exists(tmp_path / "jobs.db")
+    JobJournal(None).open()
+
+
+def test_unfinished_jobs_survive_a_restart(tmp_path):
+    journal = JobJournal(str(tmp_path / "data" / "jobs.db"))
+    journal.open()
+    fill(journal)
+    journal.close()
+
+    journal = JobJournal(str(tmp_path / "data" / "jobs.db"))
+    journal.open()
+    rows = {row["task_id"]: row for row in journal.unfinished()}
+    assert list(rows) == ["running", "queued", "paused"]
+    assert rows["running"]["downloaded_bytes"] == 500 and rows["running"]["attempts"] == 1
+    assert rows["running"]["connections"] == 4
+    assert journal.get("done")["file_path"] == "/tmp/out/done.mp4"
+    assert journal.get("failed")["error"] == "HTTP Error 404"
+    journal.prune(0)
+    assert journal.get("done") is None and len(journal.unfinished()) == 3
+    journal.close()
+
+
+def test_scheduler_replays_the_journal(tmp_path, monkeypatch):
+    journal = JobJournal(str(tmp_path / "jobs.db"))
+    journal.open()
+    fill(journal)
+    monkeypatch.setattr(scheduler_module, "job_journal", journal)
+    store = MemoryStore()
+    resumed = DownloadScheduler(store=store, engine="thread").resume_unfinished()
+    assert resumed == ["running", "queued"]
+    assert store.queued() == ["queued", "running"]  # by priority
+    assert store.paused() == ["paused"]
+    record = store.claim()
+    assert record["resume"] is True and record["connections"] == 4
+    journal.close()
@@ -0,0 +1,102 @@
+import os
+import time
+
+import pytest
+
+from app import media_store as media_store_module
+from app.media_store import MediaStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MediaStore(str(tmp_path / "store"), max_bytes=10_000)
+    store.open()
+    yield store
+    store.close()
+
+
+def download(tmp_path, name, data):
+    path = tmp_path / "downloads" / name
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(data)
+    # yt-dlp dates files with the upload time
+    os.utime(path, (time.time() - 86400, time.time() - 86400))
+    return str(path)
+
+
+def no_links(monkeypatch):
+    def link(src, dst):
+        raise OSError(18, "Invalid cross-device link")
+    monkeypatch.setattr(media_store_module.os, "link", link)
+
+
+def test_closed_store_does_nothing(tmp_path):
+    store = MediaStore(str(tmp_path / "store"), 10_000)
+    store.ingest("k", download(tmp_path, "a.mp4", b"x"))
+    assert store.materialize("k", str(tmp_path)) is None
+    assert not os.path.exists(tmp_path / "store")
+
+
+def test_repeat_download_is_served_from_the_store(store, tmp_path):
+    store.ingest("video|best|mp4", download(tmp_path, "a.mp4", b"a" * 100))
+    path = store.materialize("video|best|mp4", str(tmp_path / "again"))
+    assert path == str(tmp_path / "again" / "a.mp4")
+    assert open(path, "rb").read() == b"a" * 100
+    assert store.materialize("other|best|mp4", str(tmp_path / "again")) is None
+    assert store.stats()["hits"] == 1 and store.stats()["misses"] == 1
+
+
+def test_same_bytes_share_one_blob(store, tmp_path):
+    store.ingest("k1", download(tmp_path, "a.mp4", b"same"))
+    store.ingest("k2", download(tmp_path, "b.mp4", b"same"))
+    stats = store.stats()
+    assert stats["entries"] == 2 and stats["blobs"] == 1 and stats["bytes"] == 4
+
+
+def test_edited_file_does_not_serve_a_changed_blob(store, tmp_path):
+    path = download(tmp_path, "a.mp4", b"original")
+    store.ingest("k", path)
+    time.sleep(0.01)
+    with open(path, "r+b") as f:
+        f.write(b"EDITED!!")
+    served = store.materialize("k", str(tmp_path / "again"))
+    if served is not None:
+        # Reflinked or copied: the blob kept its bytes
+        assert open(served, "rb").read() == b"original"
+    else:
+        # Hard linked: the edit reached the blob, which is dropped
+        assert store.stats()["entries"] == 0
+
+
+def test_nothing_is_copied_unless_enabled(store, tmp_path, monkeypatch):
+    no_links(monkeypatch)
+    monkeypatch.setattr(media_store_module, "_FICLONE", 0)
+    store.ingest("k", download(tmp_path, "a.mp4", b"a" * 100))
+    assert store.stats()["entries"] == 0 and store.stats()["skipped"] == 1
+    assert os.listdir(os.path.join(store.root, "objects")) == []
+    store.copy = True
+    store.ingest("k", download(tmp_path, "a.mp4", b"a" * 100))
+    assert store.stats()["entries"] == 1
+
+
+def test_copies_need_room_left(store, tmp_path, monkeypatch):
+    no_links(monkeypatch)
+    monkeypatch.setattr(media_store_module, "_FICLONE", 0)
+    store.copy = True
+    store.ingest("k1", download(tmp_path, "a.mp4", b"a" * 6000))
+    store.ingest("k2", download(tmp_path, "b.mp4", b"b" * 6000))
+    assert store.stats()["entries"] == 1 and store.stats()["skipped"] == 1
+
+
+def test_too_big_files_are_skipped(store, tmp_path):
+    store.ingest("k", download(tmp_path, "a.mp4", b"a" * 20_000))
+    assert store.stats()["entries"] == 0
+
+
+def test_least_recently_used_blobs_are_evicted(store, tmp_path):
+    for i in range(3):
+        store.ingest(f"k{i}", download(tmp_path, f"{i}.mp4", bytes([i]) * 4000))
+        time.sleep(0.01)
+    assert store.materialize("k0", str(tmp_path / "again")) is None
+    assert store.materialize("k2", str(tmp_path / "again")) is not None
+    assert store.stats()["bytes"] == 8000
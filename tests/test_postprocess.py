@@ -0,0 +1,74 @@
+import pytest
+
+from app import config
+from app.downloader import job_options
+from app.postprocess import check_profile, plan
+
+CAPS = {"audio_encoders": {"mp3": "libmp3lame", "aac": "aac", "opus": "opus"}}
+
+INFO = {"formats": [
+    {"format_id": "140", "vcodec": "none", "acodec": "mp4a.40.2"},
+    {"format_id": "137", "vcodec": "avc1.640028", "acodec": "none"},
+    {"format_id": "18", "vcodec": "avc1.42001E", "acodec": "mp4a.40.2"},
+    {"format_id": "direct", "vcodec": None, "acodec": None},
+]}
+
+
+def test_plan_copies_matching_codec():
+    assert plan("aac-256", "/d/song", "mp4a.40.2", CAPS) == ("copy", "/d/song.m4a", ["-c:a", "copy"])
+    assert plan("opus-160", "/d/song", "opus", CAPS)[:2] == ("copy", "/d/song.opus")
+    # audio-copy keeps any codec, unknown ones go to Matroska audio
+    assert plan("audio-copy", "/d/song", "vorbis", CAPS)[1] == "/d/song.ogg"
+    assert plan("audio-copy", "/d/song", "alac", CAPS)[1] == "/d/song.mka"
+
+
+def test_plan_encodes_other_codecs():
+    mode, dest, args = plan("mp3-192", "/d/song", "opus", CAPS)
+    assert (mode, dest) == ("encode", "/d/song.mp3")
+    assert args == ["-c:a", "libmp3lame", "-b:a", "192k", "-id3v2_version", "3"]
+    # Native Opus encoder needs -strict
+    assert plan("opus-96", "/d/song", "aac", CAPS)[2] == ["-c:a", "opus", "-b:a", "96k", "-strict", "-2"]
+
+
+def test_plan_without_encoder():
+    with pytest.raises(RuntimeError):
+        plan("mp3-320", "/d/song", "opus", {"audio_encoders": {"mp3": None}})
+
+
+def test_check_profile_defaults():
+    assert check_profile(None, "best_audio") == config.AUDIO_PROFILE
+    assert check_profile(None, "137") == config.VIDEO_PROFILE
+    assert check_profile("mkv", "137") == "mkv"
+
+
+def test_check_profile_rejects():
+    with pytest.raises(ValueError):
+        check_profile("flac-9000", "137")
+    with pytest.raises(ValueError):
+        check_profile("mp4", "best_audio")
+
+
+def test_check_profile_audio_needs_audio_stream():
+    assert check_profile("mp3-192", "best_audio", INFO) == "mp3-192"
+    assert check_profile("mp3-192", "140", INFO) == "mp3-192"
+    assert check_profile("mp3-192", "18", INFO) == "mp3-192"
+    with pytest.raises(ValueError, match="no audio"):
+        check_profile("mp3-192", "137", INFO)
+    # Nothing known about the format: left to job_options
+    assert check_profile("mp3-192", "137") == "mp3-192"
+    assert check_profile("mp3-192", "direct", INFO) == "mp3-192"
+
+
+def test_job_options_audio_profile_formats():
+    def fmt(format_id, info, profile="mp3-192"):
+        return job_options(format_id, "a" * 16, "/d", info, profile)["format"]
+
+    assert fmt("best_audio", None) == "bestaudio/best"
+    assert fmt("140", INFO) == "140"
+    assert fmt("18", INFO) == "18"
+    # Unknown or video-only: the best audio comes along
+    assert fmt("137", None) == "137+bestaudio/bestaudio"
+    assert fmt("direct", INFO) == "direct+bestaudio/bestaudio"
+    # Video profiles are unchanged
+    assert fmt("140", INFO, "mp4") == "140"
+    assert fmt("137", INFO, "mp4") == "137+bestaudio/best"
@@ -0,0 +1,61 @@
+import time
+
+from app.progress import ProgressTracker, ThroughputMeter
+
+
+def hook(downloaded, filename="v.mp4", **fields):
+    return {"status": "downloading", "downloaded_bytes": downloaded, "filename": filename, **fields}
+
+
+def test_record_is_numeric():
+    tracker = ProgressTracker(publish_interval=0)
+    record = tracker.record("t", hook(500, total_bytes=1000, speed=250.0, eta=2))
+    assert record["downloaded_bytes"] == 500
+    assert record["total_bytes"] == 1000
+    assert record["total_is_estimate"] is False
+    assert record["speed"] == 250.0 and record["eta"] == 2
+
+
+def test_estimated_total():
+    tracker = ProgressTracker(publish_interval=0)
+    record = tracker.record("t", hook(10, total_bytes_estimate=999.6))
+    assert record["total_bytes"] == 999 and record["total_is_estimate"] is True
+    record = tracker.record("t", hook(20))
+    assert record["total_bytes"] is None and record["total_is_estimate"] is False
+
+
+def test_records_are_throttled():
+    tracker = ProgressTracker(publish_interval=10)
+    assert tracker.record("t", hook(1)) is not None
+    assert tracker.record("t", hook(2)) is None
+    # Other tasks have their own window
+    assert tracker.record("u", hook(1)) is not None
+
+
+def test_a_new_file_restarts_the_byte_count():
+    tracker = ProgressTracker(publish_interval=0)
+    tracker.record("t", hook(1000, filename="video"))
+    tracker.record("t", hook(300, filename="audio"))
+    assert tracker.server.total == 1300
+
+
+def test_meter_smooths_and_decays():
+    meter = ThroughputMeter(half_life=1.0)
+    now = time.monotonic()
+    meter.add(0, now)
+    for i in range(1, 41):
+        meter.add(1000, now + i * 0.1)
+    # ~10 kB/s after four half lives
+    assert 9000 < meter.current(now + 4.0) <= 10000
+    assert meter.current(now + 5.0) < meter.current(now + 4.0) * 0.6
+    assert ThroughputMeter().current() == 0.0
+
+
+def test_stream_finished_and_forget():
+    tracker = ProgressTracker(publish_interval=0)
+    assert tracker.stream_finished("t") is None
+    tracker.record("t", hook(1))
+    assert tracker.stream_finished("t") >= 0
+    assert tracker.stream_finished("t") is None
+    tracker.forget("t")
+    assert tracker.snapshot()["tasks"] == {}
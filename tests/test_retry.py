@@ -0,0 +1,127 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app import config, downloader
+from app.retry import BACKOFF, DIRECT, EXPIRED, FATAL, FORMAT, MERGE, MERGE_ONLY, NETWORK, NO_FFMPEG, REFRESH, \
+    THROTTLED, RetryState, classify, status_code
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP Error {status}: nope")
+        self.status = status
+
+
+def signed(expire):
+    return {"formats": [{"url": f"https://cdn.example/video?expire={int(expire)}&sig=x"}]}
+
+
+@pytest.mark.parametrize("exc, info, kind", [
+    (HTTPError(429), None, THROTTLED),
+    (HTTPError(403), signed(time.time() + 3600), THROTTLED),
+    (HTTPError(403), signed(time.time() - 10), EXPIRED),
+    (HTTPError(410), None, EXPIRED),
+    (HTTPError(503), None, NETWORK),
+    (TimeoutError("read timed out"), None, NETWORK),
+    (Exception("Connection reset by peer"), None, NETWORK),
+    (Exception("ERROR: Postprocessing: Conversion failed!"), None, MERGE),
+    (Exception("You have requested merging of multiple formats but ffmpeg is not installed"), None, NO_FFMPEG),
+    (Exception("Requested format is not available"), None, FORMAT),
+    (HTTPError(404), None, FATAL),
+    (Exception("Private video"), None, FATAL),
+])
+def test_classify(exc, info, kind):
+    assert classify(exc, info) == kind
+
+
+def test_status_code_of_a_wrapped_error():
+    try:
+        try:
+            raise HTTPError(429)
+        except HTTPError as e:
+            raise RuntimeError("download failed") from e
+    except RuntimeError as e:
+        assert status_code(e) == 429
+    assert status_code(Exception("HTTP Error 502: Bad Gateway")) == 502
+    assert status_code(Exception("no status")) is None
+
+
+def test_repeated_403_refreshes_the_urls():
+    state = RetryState()
+    assert state.next_step(HTTPError(403))[0] == BACKOFF
+    assert state.next_step(HTTPError(403))[0] == REFRESH
+
+
+def test_merge_and_direct_fallbacks_are_tried_once():
+    state = RetryState()
+    assert state.next_step(Exception("Postprocessing: Conversion failed")) == (MERGE_ONLY, 0)
+    assert state.next_step(Exception("Postprocessing: Conversion failed")) is None
+    state = RetryState()
+    assert state.next_step(Exception("ffmpeg not found")) == (DIRECT, 0)
+    assert state.next_step(Exception("ffmpeg not found")) is None
+    assert RetryState(merging=False).next_step(Exception("ffmpeg not found")) is None
+
+
+def test_gives_up_after_the_attempts(monkeypatch):
+    monkeypatch.setattr(config, "RETRY_BACKOFF_MS", 0)
+    state = RetryState()
+    steps = [state.next_step(TimeoutError("timed out")) for _ in range(config.RETRY_ATTEMPTS + 1)]
+    assert all(step == (BACKOFF, 0) for step in steps[:-1])
+    assert steps[-1] is None
+    assert state.next_step(HTTPError(404)) is None
+
+
+class SignedUpstream:
+    """Serves the file once (the extraction), then answers 403 like a CDN whose signed URL expired."""
+
+    def __init__(self):
+        served = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if served:
+                    self.send_error(403)
+                    return
+                served.append(self.path)
+                body = b"\0" * 4096
+                self.send_response(200)
+                self.send_header("Content-Type", "video/mp4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def url(self, expire):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/clip.mp4?expire={int(expire)}&sig=x"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def test_download_failure_is_classified_with_the_resolved_urls(tmp_path, monkeypatch):
+    kinds = []
+
+    class Recording(RetryState):
+        def next_step(self, exc, info=None):
+            kinds.append(classify(exc, info))
+            return None
+
+    monkeypatch.setattr(downloader, "RetryState", Recording)
+    upstream = SignedUpstream()
+    try:
+        # Nothing cached: the URLs only exist in what this attempt extracted
+        final = downloader._run_download(upstream.url(time.time() - 10), "best", "expired-task", str(tmp_path))
+    finally:
+        upstream.close()
+    assert final["state"] == "error"
+    assert kinds == [EXPIRED]
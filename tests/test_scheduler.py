@@ -0,0 +1,103 @@
+import asyncio
+import glob
+import os
+import time
+
+from fastapi.testclient import TestClient
+
+from app import downloader
+from app.journal import JobJournal
+from app.scheduler import DownloadScheduler, parse_priority
+from app.store import MemoryStore
+from benchmarks.media_server import MediaServer
+
+
+def test_parse_priority():
+    assert parse_priority("high") == 0
+    assert parse_priority("LOW") == 20
+    assert parse_priority("5") == 5
+    assert parse_priority(7.9) == 7
+    assert parse_priority("soon") == parse_priority(None) == 10
+
+
+def test_scheduler_can_be_started_again():
+    async def cycle():
+        scheduler = DownloadScheduler(max_downloads=1, store=MemoryStore(), engine="thread")
+        for _ in range(2):
+            await scheduler.start()
+            pools = (scheduler.download_pool, scheduler.metadata_pool, scheduler.plan_pool)
+            assert await asyncio.get_running_loop().run_in_executor(scheduler.download_pool, sum, [1, 2]) == 3
+            await scheduler.stop()
+            assert scheduler.download_pool is scheduler.metadata_pool is scheduler.plan_pool is None
+            assert all(pool._shutdown for pool in pools)
+
+    asyncio.run(cycle())
+
+
+def test_downloads_after_an_app_restart(tmp_path):
+    from app.main import app
+
+    with MediaServer() as server:
+        for round_ in range(2):
+            with TestClient(app) as client:
+                with client.websocket_connect("/ws") as ws:
+                    ws.send_json({"action": "download", "url": server.url(f"restart{round_}", 256 * 1024),
+                                  "format_id": "best", "download_path": str(tmp_path)})
+                    while True:
+                        message = ws.receive_json()
+                        if message.get("state") in ("completed", "error"):
+                            break
+            assert message["state"] == "completed", message
+
+
+def test_released_tasks_are_cancelled_after_the_grace_period():
+    async def run():
+        scheduler = DownloadScheduler(max_downloads=1, store=MemoryStore(), engine="thread")
+        for task_id in ("kept", "dropped"):
+            scheduler.submit(task_id, f"https://example.com/{task_id}", "best")
+        scheduler.release(["kept", "dropped"], grace=0.1)
+        # The client came back for one of them
+        assert scheduler.adopt("kept")
+        assert not scheduler.adopt("unknown")
+        await asyncio.sleep(0.3)
+        return scheduler.store.queued()
+
+    assert asyncio.run(run()) == ["kept"]
+    assert downloader.download_status["dropped"]["state"] == "cancelled"
+
+
+def test_shutdown_resumes_the_downloads_of_open_sockets(tmp_path, monkeypatch):
+    from app.main import app
+
+    # uvicorn closes the sockets with 1012 before the app's shutdown hook runs
+    monkeypatch.setattr(downloader.job_journal, "path", str(tmp_path / "jobs.db"))
+    with MediaServer() as server:
+        url = server.url("shutdown", 1024 * 1024, rate=256 * 1024)
+        with TestClient(app) as client:
+            with client.websocket_connect("/ws") as ws:
+                ws.send_json({"action": "download", "url": url, "format_id": "best",
+                              "download_path": str(tmp_path)})
+                while True:
+                    message = ws.receive_json()
+                    if message.get("state") == "processing":
+                        break
+                task_id = message["task_id"]
+                ws.close(1012)
+            # uvicorn then waits for the open requests before shutting down; a cancel would land now
+            time.sleep(0.5)
+
+        journal = JobJournal(str(tmp_path / "jobs.db"))
+        journal.open()
+        assert [row["task_id"] for row in journal.unfinished()] == [task_id]
+        journal.close()
+        assert glob.glob(str(tmp_path / "*.part"))
+
+        with TestClient(app) as client:
+            with client.websocket_connect("/ws") as ws:
+                ws.send_json({"action": "watch", "task_id": task_id})
+                while True:
+                    message = ws.receive_json()
+                    if message.get("state") in ("completed", "error", "cancelled"):
+                        break
+    assert message["state"] == "completed", message
+    assert os.path.getsize(tmp_path / "shutdown-1048576.mp4") == 1024 * 1024
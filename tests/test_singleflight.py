@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+from app.downloader import SingleFlight
+
+
+def run_together(flight, fn, n, **kwargs):
+    results = [None] * n
+    errors = [None] * n
+
+    def call(i):
+        try:
+            results[i] = flight.do("key", fn, i, owner=i, **kwargs)
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(n)]
+    for i, t in enumerate(threads):
+        t.start()
+        if i == 0:
+            time.sleep(0.05)  # the first one leads
+    for t in threads:
+        t.join()
+    return results, errors
+
+
+def test_concurrent_calls_run_once():
+    calls = []
+
+    def work(i):
+        calls.append(i)
+        time.sleep(0.2)
+        return f"done by {i}"
+
+    flight = SingleFlight()
+    joined = []
+    results, errors = run_together(flight, work, 4, on_join=joined.append)
+    assert calls == [0]
+    assert results[0] == ("done by 0", False)
+    assert all(r == ("done by 0", True) for r in results[1:])
+    assert joined == [0, 0, 0]
+    assert flight.in_flight() == 0
+
+
+def test_followers_get_the_leaders_error():
+    def work(i):
+        time.sleep(0.1)
+        raise ValueError("boom")
+
+    results, errors = run_together(SingleFlight(), work, 3)
+    assert all(isinstance(e, ValueError) for e in errors)
+
+
+def test_a_follower_can_stop_waiting():
+    class Left(Exception):
+        pass
+
+    def check():
+        raise Left()
+
+    flight = SingleFlight()
+    release = threading.Event()
+    leader = threading.Thread(target=flight.do, args=("key", release.wait, 5))
+    leader.start()
+    time.sleep(0.05)
+    with pytest.raises(Left):
+        flight.do("key", release.wait, 5, check=check)
+    release.set()
+    leader.join()
+
+
+def test_calls_after_the_flight_run_again():
+    flight = SingleFlight()
+    assert flight.do("key", lambda: 1) == (1, False)
+    assert flight.do("key", lambda: 2) == (2, False)
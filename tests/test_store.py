@@ -0,0 +1,147 @@
+import time
+
+import pytest
+
+from app.store import FakeRedis, MemoryStore, RedisStore, SQLiteStore
+
+
+def job(task_id, priority=10):
+    return {"task_id": task_id, "priority": priority}
+
+
+@pytest.fixture(params=["memory", "sqlite", "fake"])
+def make_store(request, tmp_path):
+    """Builds stores of one backend; two of them share the queue like two nodes."""
+    redis = FakeRedis()
+    stores = []
+
+    def make(lease=30):
+        if request.param == "memory":
+            store = stores[0] if stores else MemoryStore()
+        elif request.param == "sqlite":
+            store = SQLiteStore(str(tmp_path / "jobs.db"), lease=lease)
+        else:
+            store = RedisStore(client=redis, lease=lease)
+        stores.append(store)
+        return store
+
+    make.backend = request.param
+    yield make
+    for store in stores:
+        store.close()
+
+
+@pytest.fixture
+def make_shared(make_store):
+    if make_store.backend == "memory":
+        pytest.skip("a memory store is not shared")
+    return make_store
+
+
+def test_claims_by_priority_then_arrival(make_store):
+    store = make_store()
+    for task_id, priority in (("a", 10), ("b", 0), ("c", 10), ("d", 20)):
+        assert store.enqueue(job(task_id, priority))
+    assert store.queued() == ["b", "a", "c", "d"]
+    assert [store.claim()["task_id"] for _ in range(4)] == ["b", "a", "c", "d"]
+    assert store.claim() is None
+
+
+def test_enqueue_refuses_a_known_task_until_done(make_store):
+    store = make_store()
+    assert store.enqueue(job("a"))
+    assert not store.enqueue(job("a"))
+    assert store.claim()["task_id"] == "a"
+    assert not store.enqueue(job("a"))
+    store.done("a")
+    assert store.enqueue(job("a"))
+
+
+def test_pause_and_resume_keep_the_place_in_the_queue(make_store):
+    store = make_store()
+    for task_id in "abc":
+        store.enqueue(job(task_id))
+    assert store.pause("a")["task_id"] == "a"
+    assert store.pause("a") is None
+    assert store.queued() == ["b", "c"]
+    assert store.paused() == ["a"]
+    assert store.resume("a")["task_id"] == "a"
+    assert store.queued() == ["a", "b", "c"]
+    assert store.resume("a") is None
+
+
+def test_pause_a_running_job_then_remove_it(make_store):
+    store = make_store()
+    store.enqueue(job("a"))
+    record = store.claim()
+    assert store.remove("a") is None
+    store.pause("a", {**record, "resume": True})
+    assert store.paused() == ["a"]
+    assert store.claim() is None
+    assert store.remove("a")["resume"] is True
+    assert store.paused() == [] and store.enqueue(job("a"))
+
+
+def test_update_reorders_a_waiting_job(make_store):
+    store = make_store()
+    for task_id in "abc":
+        store.enqueue(job(task_id))
+    assert store.update("c", priority=0)["priority"] == 0
+    assert store.queued() == ["c", "a", "b"]
+    store.claim()
+    assert store.update("c", priority=5) is None
+
+
+def test_nodes_never_claim_the_same_job(make_shared):
+    a, b = make_shared(), make_shared()
+    for task_id in "xyz":
+        a.enqueue(job(task_id))
+    claimed = [a.claim(), b.claim(), b.claim(), a.claim()]
+    assert sorted(r["task_id"] for r in claimed if r) == ["x", "y", "z"]
+    assert claimed[3] is None
+
+
+def test_claim_of_a_dead_node_is_taken_back(make_shared):
+    dead = make_shared(lease=0.2)
+    dead.enqueue(job("x"))
+    assert dead.claim()["task_id"] == "x"
+    alive = make_shared(lease=0.2)
+    assert alive.claim() is None
+    time.sleep(0.3)
+    assert alive.claim()["task_id"] == "x"
+
+
+def test_enqueue_takes_over_a_task_whose_claim_expired(make_shared):
+    dead = make_shared(lease=0.2)
+    dead.enqueue(job("x"))
+    dead.claim()
+    restarted = make_shared(lease=0.2)
+    # Still leased: the dead node might only be slow
+    assert not restarted.enqueue(job("x", 0))
+    time.sleep(0.3)
+    assert restarted.enqueue({**job("x", 0), "resume": True})
+    assert restarted.claim()["resume"] is True
+
+
+def test_renewed_claims_are_kept(make_shared):
+    owner = make_shared(lease=0.3)
+    owner.enqueue(job("x"))
+    owner.claim()
+    other = make_shared(lease=0.3)
+    for _ in range(3):
+        time.sleep(0.15)
+        owner._renew()
+        assert other.claim() is None
+    owner.done("x")
+    time.sleep(0.35)
+    assert other.claim() is None
+
+
+def test_paused_jobs_are_not_reclaimed(make_shared):
+    node = make_shared(lease=0.1)
+    node.enqueue(job("x"))
+    record = node.claim()
+    node.pause("x", record)
+    time.sleep(0.2)
+    assert make_shared(lease=0.1).claim() is None
+    assert node.paused() == ["x"]
@@ -0,0 +1,132 @@
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.streaming import PassThrough, StreamError, parse_range, resolve_range
+
+
+@pytest.mark.parametrize("header, parsed", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, None)),
+    ("bytes=-500", (None, 500)),
+    (" bytes=5-5 ", (5, 5)),
+    (None, None),
+    ("", None),
+    ("bytes=-", None),
+    ("bytes=10-5", None),
+    ("bytes=0-1,5-9", None),
+    ("items=0-1", None),
+])
+def test_parse_range(header, parsed):
+    assert parse_range(header) == parsed
+
+
+@pytest.mark.parametrize("byte_range, resolved", [
+    ((0, 99), (0, 99)),
+    ((0, 5000), (0, 999)),
+    ((100, None), (100, 999)),
+    ((None, 100), (900, 999)),
+    ((None, 5000), (0, 999)),
+    ((999, None), (999, 999)),
+])
+def test_resolve_range(byte_range, resolved):
+    assert resolve_range(byte_range, 1000) == resolved
+
+
+@pytest.mark.parametrize("byte_range", [(1000, None), (1500, 2000), (None, 0)])
+def test_unsatisfiable_range(byte_range):
+    with pytest.raises(StreamError) as e:
+        resolve_range(byte_range, 1000)
+    assert e.value.status == 416
+    assert e.value.headers == {"Content-Range": "bytes */1000"}
+
+
+BODY = bytes(range(256)) * 20  # 5120 bytes
+
+
+class Upstream(BaseHTTPRequestHandler):
+    """Serves BODY; `mode` picks how it treats Range: honour, ignore (200) or overshoot (206 to the end)."""
+
+    mode = "honour"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        m = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range") or "")
+        if not m or self.mode == "ignore":
+            self.send_response(200)
+            body = BODY
+        else:
+            start = int(m.group(1))
+            end = len(BODY) - 1 if self.mode == "overshoot" or not m.group(2) else int(m.group(2))
+            body = BODY[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{start + len(body) - 1}/{len(BODY)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def upstream():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Upstream)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def url(mode):
+        Upstream.mode = mode
+        return f"http://127.0.0.1:{server.server_address[1]}/video.mp4"
+
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+def relay(url, header, window=None):
+    fmt = {"url": url, "ext": "mp4"}
+    if window:
+        fmt["downloader_options"] = {"http_chunk_size": window}
+    source = PassThrough(fmt, parse_range(header))
+    try:
+        status, headers = source.open()
+        body = b"".join(iter(source.read, b""))
+    finally:
+        source.close()
+    assert len(body) == int(headers["Content-Length"])
+    return status, headers, body
+
+
+@pytest.mark.parametrize("header, status, body, content_range", [
+    ("bytes=0-99", 206, BODY[:100], "bytes 0-99/5120"),
+    ("bytes=100-", 206, BODY[100:], "bytes 100-5119/5120"),
+    ("bytes=-10", 206, BODY[-10:], "bytes 5110-5119/5120"),
+    (None, 200, BODY, None),
+])
+def test_pass_through(upstream, header, status, body, content_range):
+    got_status, headers, got_body = relay(upstream("honour"), header)
+    assert (got_status, headers.get("Content-Range"), got_body) == (status, content_range, body)
+
+
+@pytest.mark.parametrize("header", ["bytes=0-99", "bytes=100-199", "bytes=-10"])
+def test_upstream_ignoring_ranges_gets_the_whole_file(upstream, header):
+    status, headers, body = relay(upstream("ignore"), header)
+    assert status == 200 and "Content-Range" not in headers and body == BODY
+
+
+def test_windowed_format_on_an_upstream_ignoring_ranges(upstream):
+    status, headers, body = relay(upstream("ignore"), None, window=1000)
+    assert status == 200 and body == BODY
+
+
+def test_body_stops_at_the_end_of_the_range(upstream):
+    status, headers, body = relay(upstream("overshoot"), "bytes=0-99")
+    assert status == 206 and headers["Content-Range"] == f"bytes 0-99/{len(BODY)}"
+    assert body == BODY[:100]
+
+
+def test_windowed_range(upstream):
+    status, headers, body = relay(upstream("honour"), "bytes=50-4049", window=1000)
+    assert status == 206 and body == BODY[50:4050]
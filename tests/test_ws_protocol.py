@@ -0,0 +1,169 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app import ws_protocol
+from app.ws_protocol import Channel, compact_info
+
+
+class FakeSocket:
+    """Records what a Channel sends; receive() hands out `incoming` in order."""
+
+    def __init__(self, incoming=(), extensions=""):
+        self.headers = {"sec-websocket-extensions": extensions}
+        self.incoming = list(incoming)
+        self.sent = []
+
+    async def receive(self):
+        return self.incoming.pop(0)
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    async def send_bytes(self, data):
+        self.sent.append(ws_protocol.msgpack.unpackb(data))
+
+
+def compact():
+    socket = FakeSocket()
+    channel = Channel(socket)
+    channel.compact = True
+    return socket, channel
+
+
+def test_classic_by_default():
+    async def run():
+        socket = FakeSocket(extensions="permessage-deflate")
+        channel = Channel(socket)
+        reply = channel.negotiate({"action": "hello"})
+        await channel.update("t1", {"state": "processing", "speed": 1.5})
+        return socket, reply
+
+    socket, reply = asyncio.run(run())
+    assert reply == {"action": "hello", "protocol": "classic", "encoding": "json", "deflate": True}
+    assert socket.sent == [{"task_id": "t1", "state": "processing", "speed": 1.5}]
+
+
+def test_hello_grants_compact_mode():
+    async def run():
+        channel = Channel(FakeSocket())
+        reply = channel.negotiate({"protocol": "compact", "encoding": "msgpack", "interval": 1})
+        await channel.close()
+        return reply
+
+    reply = asyncio.run(run())
+    assert reply["protocol"] == "compact"
+    assert reply["encoding"] == ("msgpack" if ws_protocol.msgpack else "json")
+    # Clamped to 20 ms
+    assert reply["interval"] == 20
+    assert reply["keys"]["s"] == "state" and reply["keys"]["d"] == "downloaded_bytes"
+    assert reply["deflate"] is False
+
+
+def test_frames_use_handles_and_send_changes_only():
+    _, channel = compact()
+    channel._pending = {"a": {"state": "processing", "downloaded_bytes": 10, "speed": 99.6},
+                        "b": {"state": "queued", "position": 2}}
+    assert channel._frame() == {
+        "h": [[1, "a"], [2, "b"]],
+        "u": [[1, {"s": "processing", "d": 10, "v": 100}], [2, {"s": "queued", "q": 2}]],
+    }
+    # Nothing new for a known handle, unchanged fields are dropped
+    channel._pending = {"a": {"state": "processing", "downloaded_bytes": 20, "custom": 1}}
+    assert channel._frame() == {"u": [[1, {"d": 20, "custom": 1}]]}
+    channel._pending = {"a": {"state": "processing"}}
+    assert channel._frame() is None
+    # Handle dropped after the final state; the task gets a new one if it comes back
+    channel._pending = {"a": {"state": "completed"}}
+    assert channel._frame() == {"u": [[1, {"s": "completed"}]]}
+    channel._pending = {"a": {"state": "queued"}}
+    assert channel._frame() == {"h": [[3, "a"]], "u": [[3, {"s": "queued"}]]}
+
+
+def test_updates_are_batched_and_final_states_flushed():
+    async def run():
+        socket = FakeSocket()
+        channel = Channel(socket)
+        channel.negotiate({"protocol": "compact", "interval": 5000})
+        await channel.update("a", {"state": "processing", "downloaded_bytes": 1})
+        await channel.update("b", {"state": "processing", "downloaded_bytes": 2})
+        await channel.update("a", {"downloaded_bytes": 3})
+        await asyncio.sleep(0.05)
+        # Still waiting for the interval
+        assert socket.sent == []
+        await channel.update("b", {"state": "error", "message": "boom"})
+        await asyncio.sleep(0.05)
+        await channel.close()
+        return socket.sent
+
+    assert asyncio.run(run()) == [{
+        "h": [[1, "a"], [2, "b"]],
+        "u": [[1, {"s": "processing", "d": 3}], [2, {"s": "error", "d": 2, "m": "boom"}]],
+    }]
+
+
+def test_batch_events():
+    async def run():
+        socket = FakeSocket()
+        channel = Channel(socket)
+        await channel.emit({"batch_id": "x", "state": "batch_started"})
+        channel.negotiate({"protocol": "compact", "interval": 20})
+        await channel.emit({"batch_id": "x", "state": "batch_started"})
+        await channel.emit({"batch_id": "x", "task_id": "t", "index": 1})
+        await asyncio.sleep(0.1)
+        await channel.close()
+        return socket.sent
+
+    assert asyncio.run(run()) == [
+        {"batch_id": "x", "state": "batch_started"},
+        {"batch_id": "x", "state": "batch_started"},
+        {"h": [[1, "t"]], "u": [[1, {"b": "x", "i": 1}]]},
+    ]
+
+
+def test_receive():
+    incoming = [{"type": "websocket.receive", "text": '{"action": "watch"}'},
+                {"type": "websocket.disconnect", "code": 1012}]
+    if ws_protocol.msgpack:
+        incoming.insert(1, {"type": "websocket.receive", "bytes": ws_protocol.msgpack.packb({"action": "cancel"})})
+
+    async def run():
+        channel = Channel(FakeSocket(incoming))
+        messages = []
+        with pytest.raises(WebSocketDisconnect) as e:
+            while True:
+                messages.append(await channel.receive())
+        return messages, e.value.code
+
+    messages, code = asyncio.run(run())
+    assert messages[0] == {"action": "watch"}
+    assert len(messages) == (2 if ws_protocol.msgpack else 1)
+    assert code == 1012
+
+
+def test_compact_info():
+    result = {"status": "success", "formats": {"video": [
+        {"format_id": "137", "size": "10 MB", "filesize_bytes": 10_485_760, "height": 1080},
+        {"format_id": "22", "size": "5 MB", "filesize_bytes": 5_242_880, "note": "muxed"},
+    ]}}
+    assert compact_info(result)["formats"] == {"video": {
+        "columns": ["format_id", "filesize_bytes", "height", "note"],
+        "rows": [["137", 10_485_760, 1080, None], ["22", 5_242_880, None, "muxed"]],
+    }}
+    error = {"status": "error", "message": "nope"}
+    assert compact_info(error) is error
+
+
+def test_hello_over_the_app_socket():
+    from app.main import app
+
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws") as ws:
+            ws.send_json({"action": "hello", "protocol": "compact", "encoding": "json", "interval": 100})
+            reply = ws.receive_json()
+            assert (reply["protocol"], reply["encoding"], reply["interval"]) == ("compact", "json", 100)
+            ws.send_text(json.dumps({"action": "watch", "task_id": "nobody"}))
+            assert ws.receive_json() == {"task_id": "nobody", "status": "error", "message": "Unknown task"}
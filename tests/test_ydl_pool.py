@@ -0,0 +1,61 @@
+import pytest
+
+from app.ydl_pool import YDLPool
+
+PROFILES = {"meta": lambda: {"quiet": True, "skip_download": True, "format": "best", "outtmpl": "%(id)s.%(ext)s"}}
+
+
+@pytest.fixture
+def pool():
+    pool = YDLPool(PROFILES, max_idle=2)
+    yield pool
+    pool.close()
+
+
+def test_instances_are_reused(pool):
+    with pool.acquire("meta") as first:
+        pass
+    with pool.acquire("meta") as second:
+        assert second is first
+    assert pool.stats()["created"] == 1 and pool.stats()["reused"] == 1
+
+
+def test_overrides_are_rolled_back(pool):
+    with pool.acquire("meta") as ydl:
+        selector = ydl.format_selector
+        defaults = dict(ydl.params)
+    with pool.acquire("meta", format="bestaudio", outtmpl="/x/%(title)s.%(ext)s", overwrites=True,
+                      noplaylist=True) as ydl:
+        assert ydl.params["outtmpl"]["default"] == "/x/%(title)s.%(ext)s"
+        assert ydl.params["nooverwrites"] is False
+        assert ydl.format_selector is not selector
+    with pool.acquire("meta") as ydl:
+        assert ydl.params["format"] == "best"
+        assert ydl.params["outtmpl"] == defaults["outtmpl"]
+        assert "noplaylist" not in ydl.params
+        assert "overwrites" not in ydl.params and "nooverwrites" not in ydl.params
+
+
+def test_hooks_only_see_their_own_checkout(pool):
+    seen = []
+    with pool.acquire("meta", progress_hooks=[seen.append]) as ydl:
+        for hook in ydl.params["progress_hooks"]:
+            hook({"status": "downloading"})
+    with pool.acquire("meta") as ydl:
+        for hook in ydl.params["progress_hooks"]:
+            hook({"status": "finished"})
+    assert seen == [{"status": "downloading"}]
+
+
+def test_a_broken_instance_is_not_reused(pool):
+    with pytest.raises(RuntimeError):
+        with pool.acquire("meta") as broken:
+            raise RuntimeError("unexpected")
+    with pool.acquire("meta") as ydl:
+        assert ydl is not broken
+
+
+def test_idle_instances_are_bounded(pool):
+    with pool.acquire("meta"), pool.acquire("meta"), pool.acquire("meta"):
+        pass
+    assert pool.stats()["idle"] == {"meta": 2}